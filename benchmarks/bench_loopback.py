@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+'''Benchmark the client stack on its own, without sockets.
+
+Runs a scenario load test (see gandyloo.scenario) against the in-process
+server in gandyloo.loopback, on a virtual clock, and reports the CPU time
+the clients spent per message received: from bytes arriving to responses
+being handled. Simulated time costs nothing, so runs are quick, and the
+same seed gives the same run.
+
+Usage: python benchmarks/bench_loopback.py [--users N] [--size WxH]
+    [--duration SECONDS] [--mix MIX] [--seed N]
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gandyloo import instrument, loopback, scenario
+
+def run(users, width, height, duration, mix, seed):
+    clock = loopback.VirtualClock()
+    game = loopback.Game(width, height, seed=seed)
+    endpoint = loopback.LoopbackEndpoint(clock,
+            loopback.MinesweeperServerFactory(game), latency=0.001)
+    population = scenario.Population(clock, endpoint,
+            scenario.parse_mix(mix), users, ramp=1.0, seed=seed)
+
+    instrument.reset()
+    instrument.enable()
+    start = time.time()
+    results = []
+    population.run(duration).addCallback(results.append)
+    clock.run()
+    elapsed = time.time() - start
+    instrument.disable()
+    assert results, 'the run did not finish'
+
+    stages, counters = instrument.summary()
+    return elapsed, stages, counters, results[0]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the client stack over in-memory connections.')
+    parser.add_argument('--users', default=1000, type=int, help='Virtual users [default: 1000]')
+    parser.add_argument('--size', default='30x16', help='Board size [default: 30x16]')
+    parser.add_argument('--duration', default=10.0, type=float, help='Simulated seconds [default: 10]')
+    parser.add_argument('--mix', default='spectator=50,digger=30,flagger=20', help='Scenario mix [default: spectator=50,digger=30,flagger=20]')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed [default: 0]')
+    args = parser.parse_args()
+    width, height = (int(n) for n in args.size.split('x'))
+
+    elapsed, stages, counters, report = run(args.users, width, height,
+            args.duration, args.mix, args.seed)
+    messages = counters.get('messages', 0)
+    client = stages['client.data_received']
+    print('{} messages, {} bytes in {:.2f} s ({:.0f} simulated s)'.format(
+        messages, counters.get('bytes', 0), elapsed, args.duration))
+    print('{:>10.2f} us/message, client'.format(client['per_message'] * 1e6))
+    print('{:>10.2f} us/message, everything'.format(
+        elapsed / messages * 1e6))
+    for name in ('parse.parse_at', 'scenario.step'):
+        if name in stages:
+            print('{:>10.2f} us/message, {}'.format(
+                stages[name]['per_message'] * 1e6, name))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+'''Benchmark the memory each connection uses, and the cost of commands.
+
+Creates many MinesweeperClients on in-memory transports, gives each a
+HELLO and a board, and reports the memory allocated per connection, with
+and without ConnectionStats. Then compares building and rendering a new
+DigCommand for every send with using the shared command table.
+
+Memory is measured with tracemalloc where there is one (Python 3.4+).
+Elsewhere it is estimated by adding up sys.getsizeof over every object
+only the new connections refer to, which leaves out allocator overhead;
+on PyPy, which has neither, only the command timings are run.
+
+Usage: python benchmarks/bench_memory.py [--connections N] [--size WxH]
+'''
+import argparse
+import gc
+import os
+import sys
+import timeit
+import types
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gandyloo import message, stats
+from gandyloo.connection import MinesweeperClient
+
+class NullSink(object):
+    def response(self, resp):
+        self.last = resp
+
+class NullTransport(object):
+    def write(self, data):
+        pass
+
+def hello(width, height):
+    return ("Welcome to Minesweeper. Board: {} columns by {} rows. "
+        "Players: 1 including you. Type 'help' for help.\r\n").format(
+                width, height)
+
+def board_frame(width, height):
+    return '\r\n'.join(['- ' * (width - 1) + '-'] * height) + '\r\n'
+
+# Shared by every connection, so not counted by _sizeof.
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType,
+        types.BuiltinFunctionType)
+
+def _sizeof(roots, seen):
+    '''Return the total sys.getsizeof of the objects reachable from roots
+    that aren't in seen (a set of ids), adding them to seen.'''
+    total = 0
+    pending = list(roots)
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, _SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return total
+
+def can_measure():
+    if tracemalloc is not None:
+        return True
+    try:
+        sys.getsizeof(0)
+    except TypeError:
+        return False
+    return True
+
+def per_connection(count, width, height, with_stats):
+    frame = board_frame(width, height)
+    greeting = hello(width, height)
+
+    # Parse one board first, so the shared board cache isn't counted.
+    warm = MinesweeperClient(NullSink())
+    warm.dataReceived(greeting + frame)
+
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+    clients = []
+    for _ in range(count):
+        client = MinesweeperClient(NullSink(),
+                stats.ConnectionStats() if with_stats else None)
+        client.makeConnection(NullTransport())
+        client.dataReceived(greeting)
+        client.dataReceived(frame)
+        clients.append(client)
+    gc.collect()
+    if tracemalloc is not None:
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return float(after - before) / count
+    # Everything the warm client refers to (the board cache's boards,
+    # the command tables) is shared, so isn't counted.
+    seen = set()
+    _sizeof([warm], seen)
+    return float(_sizeof(clients, seen)) / count
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-connection memory.')
+    parser.add_argument('--connections', default=2000, type=int, help='Connections to create [default: 2000]')
+    parser.add_argument('--size', default='100x100', help='Board size [default: 100x100]')
+    args = parser.parse_args()
+    width, height = (int(n) for n in args.size.split('x'))
+
+    if can_measure():
+        for with_stats in (False, True):
+            print('{:>8.0f} bytes/connection{}{}'.format(
+                per_connection(args.connections, width, height, with_stats),
+                ' (with ConnectionStats)' if with_stats else '',
+                '' if tracemalloc else ' (sys.getsizeof estimate)'))
+    else:
+        print('Skipping bytes/connection: needs tracemalloc or '
+                'sys.getsizeof, and this Python has neither.')
+
+    table = message.command_table((width, height))
+    number = 200000
+    new = timeit.timeit(
+            lambda: message.DigCommand((7, 9)).render(), number=number)
+    shared = timeit.timeit(
+            lambda: table.dig((7, 9)).render(), number=number)
+    print('{:>8.3f} us/dig, new command'.format(new / number * 1e6))
+    print('{:>8.3f} us/dig, command table'.format(shared / number * 1e6))
+
+    if can_measure():
+        for obj in (message.DigCommand((7, 9)), message.BoardResp(None)):
+            print('{:>8} bytes/{}'.format(sys.getsizeof(obj),
+                type(obj).__name__))
+
+if __name__ == '__main__':
+    main()
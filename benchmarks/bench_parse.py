@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+'''Benchmark parsing BOARD frames of various sizes.
+
+Compares the old regex-based frame matching with parse.scan_board, and
+times full parses (with the board cache disabled) for complete and
+partially received frames.
+
+Usage: python benchmarks/bench_parse.py [--repeat N]
+'''
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gandyloo import parse
+
+# What parse_start used to run on every call to find a board.
+OLD_BOARD = re.compile(r'(([0-8F -] )*[0-8F -](\r\n?|\n))+')
+
+SIZES = [(10, 10), (100, 100), (500, 100), (1000, 100), (2000, 100),
+        (2000, 500)]
+
+def make_frame(width, height, newline, rng):
+    rows = []
+    for y in range(height):
+        rows.append(' '.join(rng.choice('12345678F -') for x in range(width)))
+    return newline.join(rows) + newline
+
+def old_find_frame(buf, size):
+    width, height = size
+    contents = OLD_BOARD.match(buf).group(0)
+    lines = contents.splitlines(True)
+    if len(lines) < height:
+        raise parse.NotReadyError()
+    return len(''.join(lines[:height]))
+
+def uncached_parse(buf, size):
+    parse.board_cache.clear()
+    return parse.parse_start(buf, size)
+
+def bench(func, repeat):
+    number = 1
+    while True:
+        elapsed = min(timeit.repeat(func, number=number, repeat=repeat))
+        if elapsed > 0.2 or number >= 1 << 20:
+            return elapsed / number
+        number *= 2
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark BOARD parsing.')
+    parser.add_argument('--repeat', default=3, type=int,
+            help='Repetitions per measurement; the best is reported [default: 3]')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print('{:>11} {:>4} {:>12} {:>12} {:>12} {:>12}'.format(
+        'size', 'nl', 'old match', 'scan_board', 'parse', 'partial'))
+    for size in SIZES:
+        for newline in ('\n', '\r\n'):
+            frame = make_frame(size[0], size[1], newline, rng)
+            partial = frame[:len(frame) * 9 // 10]
+            assert old_find_frame(frame, size) == parse.scan_board(frame, size)
+
+            def partial_parse():
+                try:
+                    parse.parse_start(partial, size)
+                except parse.NotReadyError:
+                    pass
+
+            times = [
+                bench(lambda: old_find_frame(frame, size), args.repeat),
+                bench(lambda: parse.scan_board(frame, size), args.repeat),
+                bench(lambda: uncached_parse(frame, size), args.repeat),
+                bench(partial_parse, args.repeat),
+            ]
+            print('{:>11} {:>4} {}'.format('{}x{}'.format(*size),
+                repr(newline)[1:-1],
+                ' '.join('{:>10.3f}ms'.format(t * 1000) for t in times)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+'''Fuzz the parser with hostile streams, and check it stays linear.
+
+Each generator makes a stream a broken or hostile server might send (a
+HELLO followed by long lines with no newline, runs of carriage returns,
+near-miss board rows, floods of tiny messages, mutated boards, ...) at a
+range of sizes. Every stream is fed to a MinesweeperClient whole, a byte
+at a time and in random chunks, and timed. For each generator and way of
+feeding, the time per byte at the largest size must be within --slack
+times that at the smallest; otherwise parsing isn't linear, and this
+exits with status 1.
+
+With --record DIR, streams that break linearity or take longer than
+--slow seconds are saved in DIR (once each), as a corpus for
+tests/test_parse.py to replay. The unit tests check that the corpus is
+parsed with linear work, by counting; this checks the time it takes.
+
+Usage: python benchmarks/fuzz_parse.py [--sizes 4096,65536] [--seed N]
+    [--generators long_line,cr_run,...] [--record tests/parse_corpus]
+'''
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gandyloo import parse
+from gandyloo.connection import MinesweeperClient
+
+def hello(width, height):
+    return ("Welcome to Minesweeper. Board: {} columns by {} rows. "
+        "Players: 1 including you. Type 'help' for help.\r\n").format(
+                width, height)
+
+def board_row(rng, width):
+    return ' '.join(rng.choice('012345678F -') for _ in range(width))
+
+# Generators: given a random.Random and a size n, return a stream of about
+# n characters.
+
+def long_line(rng, n):
+    return hello(10, 10) + 'x' * n
+
+def cr_run(rng, n):
+    return hello(10, 10) + '\r' * n + 'BOOM!\r\n'
+
+def leading_newlines(rng, n):
+    return '\r\n' * (n // 2) + hello(10, 10)
+
+def board_like_line(rng, n):
+    # Looks like the first row of a very wide board, and never ends.
+    return hello(10, 10) + '- ' * (n // 2)
+
+def near_miss_rows(rng, n):
+    # Correct rows, except each frame's last row is one tile short.
+    width = 50
+    rows = [board_row(rng, width) for _ in range(9)]
+    frame = '\r\n'.join(rows) + '\r\n' + board_row(rng, width - 1) + '\r\n'
+    return hello(width, 10) + frame * (n // len(frame) + 1)
+
+def slow_board(rng, n):
+    # One big valid board, to be fed in small pieces.
+    width = 200
+    height = max(n // (2 * width + 1), 1)
+    return hello(width, height) + ''.join(board_row(rng, width) + '\r\n'
+            for _ in range(height))
+
+def tiny_messages(rng, n):
+    return hello(10, 10) + 'BOOM!\r\n' * (n // 7)
+
+def help_lines(rng, n):
+    return hello(10, 10) + ''.join(
+            'x' * rng.randrange(1, 200) + rng.choice(['\r\n', '\n', '\r'])
+            for _ in range(n // 100))
+
+def tile_soup(rng, n):
+    return hello(20, 20) + ''.join(rng.choice('012345678F -\r\n')
+            for _ in range(n))
+
+def mutated_boards(rng, n):
+    width, height = 30, 16
+    frame = ''.join(board_row(rng, width) + '\r\n' for _ in range(height))
+    stream = list(frame * (n // len(frame) + 1))
+    for _ in range(len(stream) // 500):
+        stream[rng.randrange(len(stream))] = rng.choice('x\r\n -F9')
+    return hello(width, height) + ''.join(stream)
+
+def big_hello(rng, n):
+    return ('Welcome to Minesweeper. Board: ' + '9' * n
+            + ' columns by 1 rows.\r\n')
+
+GENERATORS = [long_line, cr_run, leading_newlines, board_like_line,
+        near_miss_rows, slow_board, tiny_messages, help_lines, tile_soup,
+        mutated_boards, big_hello]
+
+class NullSink(object):
+    def response(self, resp):
+        pass
+
+class NullTransport(object):
+    def write(self, data):
+        pass
+
+def chunks(stream, how, rng):
+    if how == 'whole':
+        return [stream]
+    if how == 'bytes':
+        return list(stream)
+    result = []
+    pos = 0
+    while pos < len(stream):
+        n = rng.randrange(1, 64)
+        result.append(stream[pos:pos + n])
+        pos += n
+    return result
+
+CHUNKINGS = ['whole', 'bytes', 'random']
+
+def feed(pieces):
+    '''Feed pieces to a new client. Return the seconds taken, and the
+    exception that stopped it, if any (other than InvalidResponseError,
+    which is expected).'''
+    parse.board_cache.clear()
+    client = MinesweeperClient(NullSink())
+    client.makeConnection(NullTransport())
+    start = time.time()
+    try:
+        for piece in pieces:
+            client.dataReceived(piece)
+    except parse.InvalidResponseError:
+        pass
+    except Exception as e:
+        return time.time() - start, e
+    return time.time() - start, None
+
+# Streams recorded so far, so that a stream that is slow fed several ways
+# is only saved once.
+_recorded = set()
+
+def record(directory, name, stream):
+    if stream in _recorded:
+        return
+    _recorded.add(stream)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, name + '.txt')
+    with io.open(path, 'w', encoding='latin-1', newline='') as f:
+        f.write(type(u'')(stream))
+    print('  recorded ' + path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Fuzz the parser and check parse time grows linearly.')
+    parser.add_argument('--sizes', default='4096,16384,65536,262144', help='Stream sizes to try, in characters [default: 4096,16384,65536,262144]')
+    parser.add_argument('--generators', default=None, help='Comma-separated generators to run [default: all]')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed [default: 0]')
+    parser.add_argument('--repeat', default=3, type=int, help='Timings per stream; the fastest counts [default: 3]')
+    parser.add_argument('--slack', default=4.0, type=float, help='Allowed growth in time per byte from the smallest size to the largest [default: 4]')
+    parser.add_argument('--slow', default=1.0, type=float, help='Seconds beyond which a stream counts as slow [default: 1]')
+    parser.add_argument('--record', default=None, metavar='DIR', help='Save slow and nonlinear streams in DIR')
+    args = parser.parse_args()
+    sizes = [int(n) for n in args.sizes.split(',')]
+    generators = GENERATORS
+    if args.generators:
+        names = args.generators.split(',')
+        generators = [g for g in GENERATORS if g.__name__ in names]
+
+    failed = False
+    for generator in generators:
+        for how in CHUNKINGS:
+            per_byte = []
+            for n in sizes:
+                rng = random.Random(args.seed)
+                stream = generator(rng, n)
+                pieces = chunks(stream, how, rng)
+                best = None
+                for _ in range(args.repeat):
+                    seconds, error = feed(pieces)
+                    if error is not None:
+                        print('{} ({}, {}): {!r}'.format(generator.__name__,
+                            how, n, error))
+                        failed = True
+                        if args.record:
+                            record(args.record, '{}-{}-{}-error'.format(
+                                generator.__name__, how, n), stream)
+                        break
+                    best = seconds if best is None else min(best, seconds)
+                if best is None:
+                    break
+                per_byte.append((n, stream, best / len(stream)))
+                if best > args.slow and args.record:
+                    record(args.record, '{}-{}-{}-slow'.format(
+                        generator.__name__, how, n), stream)
+
+            if len(per_byte) < 2:
+                continue
+            growth = per_byte[-1][2] / max(per_byte[0][2], 1e-9)
+            linear = growth <= args.slack
+            print('{:<18} {:<7} {:>10.3f} us/KB at {:>7}  {:>10.3f} us/KB at {:>7}  x{:.1f}{}'.format(
+                generator.__name__, how, per_byte[0][2] * 1024e6,
+                per_byte[0][0], per_byte[-1][2] * 1024e6, per_byte[-1][0],
+                growth, '' if linear else '  NONLINEAR'))
+            if not linear:
+                failed = True
+                if args.record:
+                    n, stream, _ = per_byte[-1]
+                    record(args.record, '{}-{}-{}-nonlinear'.format(
+                        generator.__name__, how, n), stream)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
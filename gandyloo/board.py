@@ -1,6 +1,11 @@
 from array import array
 
-class Board:
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class Board(object):
     '''Class representing a (client-side) gandyloo board.
     Access individual items like so:
         board[x, y]
@@ -15,6 +20,8 @@ class Board:
     # that many surrounding mines.
     # A _tiles entry of 9 represents an Untouched tile;
     # A _tiles entry of 10 represents a Flagged tile.
+    # If _shared is True, _tiles may be referenced by other boards
+    # (see snapshot()) and must be copied before it is written to.
 
     def __init__(self, width, height):
         '''Create a new, entirely untouched board.'''
@@ -23,6 +30,39 @@ class Board:
         self.width = width
         self.height = height
         self._tiles = array('B', [9]*(width*height))
+        self._shared = False
+
+    def snapshot(self):
+        '''Return a new Board with the same contents as this one.
+        The two boards share their tiles until either one is written to,
+        at which point the written board makes its own copy; so taking a
+        snapshot is cheap no matter how large the board is.
+        '''
+        self._shared = True
+        return Board._from_tiles(self.width, self.height, self._tiles,
+                shared=True)
+
+    @classmethod
+    def _from_tiles(cls, width, height, tiles, shared=False):
+        '''Create a board that uses tiles (laid out like _tiles) directly,
+        without copying.'''
+        assert width > 0 and height > 0
+        assert len(tiles) == width*height
+
+        result = cls.__new__(cls)
+        result.width = width
+        result.height = height
+        result._tiles = tiles
+        result._shared = shared
+        return result
+
+    def _unshare(self):
+        '''Make sure this board owns its _tiles, copying them if needed.'''
+        if self._shared:
+            # (A slice copies in C; array('B', tiles) would copy one tile
+            # at a time on Python 2.)
+            self._tiles = self._tiles[:]
+            self._shared = False
 
     def __getitem__(self, idx):
         assert self.in_bounds(idx)
@@ -39,6 +79,7 @@ class Board:
     def __setitem__(self, idx, val):
         assert self.in_bounds(idx)
         x, y = idx
+        self._unshare()
 
         if isinstance(val, Dug):
             self._tiles[x + y*self.width] = val.surrounding
@@ -72,3 +113,141 @@ class Flagged(Tile):
     def __eq__(self, other):
         return isinstance(other, Flagged)
 
+
+# Thumbnails: boards shrunk to a few characters, for watching many at once.
+# Each thumbnail cell summarizes a block of tiles as one of these values.
+THUMB_LEVELS = 4    # 0 (nothing dug) to THUMB_LEVELS (everything dug)
+THUMB_FLAGGED = THUMB_LEVELS + 1    # mostly flagged, with nothing dug
+
+def _block_bounds(length, cells):
+    '''Split range(length) into cells blocks, as (start, end) pairs. If
+    there are more cells than tiles, blocks repeat tiles.'''
+    bounds = []
+    for n in range(cells):
+        start = min(n * length // cells, length - 1)
+        bounds.append((start, max((n + 1) * length // cells, start + 1)))
+    return bounds
+
+def thumbnail(board, columns, rows):
+    '''Shrink board to columns by rows cells. Return an array of
+    columns*rows values, laid out like _tiles: for each cell, the fraction
+    of its tiles dug, from 0 to THUMB_LEVELS (rounded, but only 0 if none
+    are dug and THUMB_LEVELS if all are), or THUMB_FLAGGED if no tiles are
+    dug and most are flagged.
+    '''
+    width = board.width
+    tiles = board._tiles
+    x_bounds = _block_bounds(width, columns)
+    result = array('B')
+    for y_start, y_end in _block_bounds(board.height, rows):
+        untouched = [0] * columns
+        flagged = [0] * columns
+        for y in range(y_start, y_end):
+            row = y * width
+            for n, (x_start, x_end) in enumerate(x_bounds):
+                block = tiles[row + x_start:row + x_end]
+                untouched[n] += block.count(9)
+                flagged[n] += block.count(10)
+
+        for n, (x_start, x_end) in enumerate(x_bounds):
+            total = (x_end - x_start) * (y_end - y_start)
+            dug = total - untouched[n] - flagged[n]
+            if dug == 0:
+                result.append(THUMB_FLAGGED if 2 * flagged[n] > total else 0)
+            elif dug == total:
+                result.append(THUMB_LEVELS)
+            else:
+                level = (THUMB_LEVELS * dug + total // 2) // total
+                result.append(min(max(level, 1), THUMB_LEVELS - 1))
+    return result
+
+
+# Optional NumPy integration, for analyzing many boards at once.
+# Arrays are indexed [y, x] and hold raw tile values, as in Board._tiles.
+
+UNTOUCHED = 9
+FLAGGED = 10
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError('NumPy is required for array support')
+
+def as_array(board, writable=False):
+    '''Return a (height, width) uint8 NumPy array viewing board's tiles,
+    without copying them.
+    If writable is True, writes to the array change the board. Don't keep
+    a writable array around across board.snapshot() calls, or the
+    snapshots will see the writes too.
+    '''
+    _require_numpy()
+    if writable:
+        board._unshare()
+    result = numpy.frombuffer(board._tiles, dtype=numpy.uint8)
+    result = result.reshape(board.height, board.width)
+    if not writable:
+        result.flags.writeable = False
+    return result
+
+def new_array(width, height):
+    '''Create a new, entirely untouched Board, and return (board, array)
+    where array is a writable (height, width) view of its tiles, as from
+    as_array(board, writable=True). Fill the array in place to build a
+    board without copying; tile values aren't checked, so keep them to
+    0-10.
+    '''
+    _require_numpy()
+    board = Board(width, height)
+    return board, as_array(board, writable=True)
+
+def from_array(tiles):
+    '''Create a Board from a (height, width) uint8 NumPy array of tile
+    values. The tiles are copied into the board's own array, so the board
+    works everywhere other boards do, and later changes to tiles don't
+    affect it; use as_array() on the result for a view of it. To build a
+    large board without the copy, fill the array from new_array() instead.
+    '''
+    _require_numpy()
+    tiles = numpy.asarray(tiles)
+    if tiles.ndim != 2 or tiles.dtype != numpy.uint8:
+        raise ValueError('Expected a 2-dimensional uint8 array')
+    if tiles.size and tiles.max() > FLAGGED:
+        raise ValueError('Invalid tile value')
+
+    height, width = tiles.shape
+    result, view = new_array(width, height)
+    view[...] = tiles
+    return result
+
+def tile_counts(board):
+    '''Return an array of length 11; entry n is the number of tiles on
+    the board with value n (so [0:9] count Dug tiles by number,
+    [UNTOUCHED] counts Untouched tiles and [FLAGGED] Flagged ones).'''
+    _require_numpy()
+    return numpy.bincount(as_array(board).ravel(), minlength=FLAGGED+1)
+
+def neighbor_sums(values):
+    '''Given a 2-dimensional array, return an array of the same shape
+    where each entry is the sum of the (up to 8) entries around it.'''
+    _require_numpy()
+    values = numpy.asarray(values, dtype=numpy.int32)
+    height, width = values.shape
+    padded = numpy.zeros((height+2, width+2), dtype=numpy.int32)
+    padded[1:-1, 1:-1] = values
+
+    result = numpy.zeros((height, width), dtype=numpy.int32)
+    for dy in (0, 1, 2):
+        for dx in (0, 1, 2):
+            if (dx, dy) != (1, 1):
+                result += padded[dy:dy+height, dx:dx+width]
+    return result
+
+def inconsistent_tiles(board):
+    '''Return a (height, width) boolean array marking Dug tiles whose
+    number is larger than the number of Untouched and Flagged tiles
+    around them - i.e. that claim more mines than could be there.'''
+    tiles = as_array(board)
+    unknown = neighbor_sums(tiles >= UNTOUCHED)
+    return (tiles < UNTOUCHED) & (tiles > unknown)
+
+def is_consistent(board):
+    return not inconsistent_tiles(board).any()
@@ -0,0 +1,251 @@
+'''Load a server with many short sessions.
+
+Each session connects, waits for the HELLO, optionally looks at the board,
+says bye and disconnects. Sessions are started at a steady rate, with a
+limit on how many are in flight at once:
+
+    python -m gandyloo.churn --server localhost --port 4444 \
+        --rate 200 --in-flight 100 --duration 30 --report churn.json
+
+Times to connect, to HELLO and to the first board (measured from the start
+of the session) are recorded in a gandyloo.report.RunReport, as latencies
+named 'connect', 'hello' and 'first_board'.
+'''
+import random
+
+from twisted.internet import task
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.endpoints import connectProtocol
+
+from gandyloo import instrument, message
+from gandyloo.connection import Backoff, MinesweeperClient
+from gandyloo.report import RunReport
+
+class _Session(object):
+    '''Event sink for one session.'''
+
+    def __init__(self, runner):
+        self.runner = runner
+        self.started = runner.clock.seconds()
+        self.client = MinesweeperClient(self,
+                runner.report.connection_stats())
+        self.done = False
+        self.timed_out = False
+        self.timeout = runner.clock.callLater(runner.timeout, self._time_out)
+        self.connecting = None
+
+    def _elapsed(self):
+        return self.runner.clock.seconds() - self.started
+
+    def connected(self, client):
+        self.runner.report.latency('connect', self._elapsed())
+
+    def response(self, resp):
+        t = type(resp)
+        if t == message.HelloResp:
+            self.runner.report.latency('hello', self._elapsed())
+            self.runner._backoff.reset()
+            if self.runner.look:
+                self.client.command(message.LookCommand())
+            else:
+                self._finish()
+        elif t == message.BoardResp and not self.done:
+            self.runner.report.latency('first_board', self._elapsed())
+            self._finish()
+        elif t == message.CloseResp:
+            self._closed()
+
+    def _finish(self):
+        self.done = True
+        self.runner.completed += 1
+        self.client.command(message.ByeCommand())
+        self.client.transport.loseConnection()
+
+    def _time_out(self):
+        self.timeout = None
+        self.timed_out = True
+        self.runner.timeouts += 1
+        if self.client.transport is not None:
+            self.client.transport.abortConnection()
+        else:
+            self.connecting.cancel()
+
+    def failed(self, failure):
+        if not self.timed_out:
+            self.runner.failures += 1
+            self.runner._connect_failed()
+        self._closed()
+
+    def _closed(self):
+        if self.timeout is not None:
+            self.timeout.cancel()
+            self.timeout = None
+        self.runner._session_closed(self)
+
+
+class ChurnRunner(object):
+    '''Starts sessions on endpoint (an IStreamClientEndpoint) at rate
+    sessions per second, with at most max_in_flight open at once, for
+    duration seconds. Sessions that take longer than timeout seconds are
+    aborted.
+
+    When a connection can't be made (as while the server restarts), no
+    sessions are started for a while, growing exponentially from
+    retry_delay to max_retry_delay seconds until a HELLO arrives again
+    (see connection.Backoff). Sessions due meanwhile are skipped rather
+    than made up afterwards.
+
+    Attributes:
+        started, completed, failures, timeouts, skipped: session counts.
+            Failures are connections that couldn't be made.
+        report: the RunReport everything is recorded in.
+        done:   a Deferred that fires when the run is over and every
+            session has closed.
+    '''
+
+    # Seconds between checks for sessions to start.
+    TICK = 0.01
+
+    def __init__(self, clock, endpoint, rate, max_in_flight, duration,
+            look=True, timeout=10.0, report=None, retry_delay=0.5,
+            max_retry_delay=30.0):
+        self.clock = clock
+        self.endpoint = endpoint
+        self.rate = rate
+        self.max_in_flight = max_in_flight
+        self.duration = duration
+        self.look = look
+        self.timeout = timeout
+        self.report = report or RunReport(
+                {'mode': 'churn', 'rate': rate,
+                    'max_in_flight': max_in_flight, 'duration': duration,
+                    'look': look},
+                clock=clock.seconds)
+
+        self.started = 0
+        self.completed = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.in_flight = set()
+
+        self._backoff = Backoff(retry_delay, max_retry_delay,
+                random.Random(0))
+        # While backing off, when to start sessions again.
+        self._resume_at = None
+
+        self._began = None
+        self._ticker = task.LoopingCall(self._tick)
+        self._ticker.clock = clock
+        self._drain = None
+        self.done = None
+
+    def start(self):
+        self._began = self.clock.seconds()
+        self.done = self._ticker.start(self.TICK)
+        self.done.addCallback(lambda _: self._drained())
+        return self.done
+
+    def _tick(self):
+        now = self.clock.seconds()
+        elapsed = now - self._began
+        if elapsed >= self.duration:
+            self._ticker.stop()
+            return
+
+        # Start as many sessions as we're behind by, if there's room.
+        target = int(elapsed * self.rate) - self.skipped
+        if self._resume_at is not None:
+            if now < self._resume_at:
+                self.skipped += max(target - self.started, 0)
+                return
+            self._resume_at = None
+        while self.started < target and len(self.in_flight) < self.max_in_flight:
+            self._start_session()
+
+    def _start_session(self):
+        self.started += 1
+        session = _Session(self)
+        self.in_flight.add(session)
+        session.connecting = connectProtocol(self.endpoint, session.client)
+        session.connecting.addCallbacks(session.connected, session.failed)
+
+    def _connect_failed(self):
+        if self._resume_at is None:
+            self.report.retried()
+            self._resume_at = (self.clock.seconds()
+                    + self._backoff.next_delay())
+
+    def _session_closed(self, session):
+        self.in_flight.discard(session)
+        if self._drain is not None and not self.in_flight:
+            drain, self._drain = self._drain, None
+            drain.callback(self)
+
+    def _drained(self):
+        '''Return a Deferred that fires when every session has closed.'''
+        self.report.finish()
+        if not self.in_flight:
+            return succeed(self)
+        self._drain = Deferred()
+        return self._drain
+
+    def summary(self):
+        '''Return a dict of session counts, the rate sessions completed
+        at, and the report's latency percentiles.'''
+        result = self.report.to_dict()
+        return {
+            'started': self.started,
+            'completed': self.completed,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'skipped': self.skipped,
+            'connections_per_sec': self.completed / result['duration'],
+            'latency': dict((name, dict((k, v) for k, v in entry.items()
+                if k != 'samples'))
+                for name, entry in result['latency'].items()),
+        }
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Load a minesweeper server with many short sessions.')
+    parser.add_argument('--server', default='localhost', help='The server to connect to [default: localhost]')
+    parser.add_argument('--port', default=4444, type=int, help='The port to connect to [default: 4444]')
+    parser.add_argument('--rate', default=50.0, type=float, help='Sessions to start per second [default: 50]')
+    parser.add_argument('--in-flight', default=100, type=int, help='Maximum sessions open at once [default: 100]')
+    parser.add_argument('--duration', default=10.0, type=float, help='Seconds to start sessions for [default: 10]')
+    parser.add_argument('--no-look', action='store_true', help="Say bye right after the HELLO, without looking at the board")
+    parser.add_argument('--timeout', default=10.0, type=float, help='Seconds before a session is aborted [default: 10]')
+    parser.add_argument('--report', default=None, help='Write a JSON report to this file')
+    parser.add_argument('--csv', default=None, help='Write a CSV time series to this file')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.start_profiling(args)
+
+    from twisted.internet import reactor
+    from twisted.internet.endpoints import TCP4ClientEndpoint
+
+    endpoint = TCP4ClientEndpoint(reactor, args.server, args.port)
+    runner = ChurnRunner(reactor, endpoint, args.rate, args.in_flight,
+            args.duration, look=not args.no_look, timeout=args.timeout)
+
+    def finished(runner):
+        summary = runner.summary()
+        print('{started} started, {completed} completed, {failures} failed, {timeouts} timed out'.format(**summary))
+        print('{:.1f} connections/sec'.format(summary['connections_per_sec']))
+        for name in ('connect', 'hello', 'first_board'):
+            if name in summary['latency']:
+                entry = summary['latency'][name]
+                print('{:<12} p50 {:8.2f} ms  p90 {:8.2f} ms  p99 {:8.2f} ms  max {:8.2f} ms'.format(
+                    name, entry['p50'] * 1000, entry['p90'] * 1000,
+                    entry['p99'] * 1000, entry['max'] * 1000))
+        if args.report:
+            runner.report.write(args.report, args.csv)
+        reactor.stop()
+
+    reactor.callWhenRunning(lambda: runner.start().addCallback(finished))
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,202 @@
-from twisted.internet.protocol import Protocol
-from gandyloo import parse
+import random
+
+from twisted.internet.protocol import Protocol, ReconnectingClientFactory
+from gandyloo import parse, message, instrument
 
 class MinesweeperClient(Protocol):
     '''Represents a connection to a server using twisted's Protocol framework.
     Created with an event sink, where parsed events (subclasses of
     gandyloo.message.Response) are fired. Sink should have a method
     self.response(resp).
+    If stats (a gandyloo.stats.ConnectionStats) is given, traffic on the
+    connection is recorded in it.
     '''
 
-    def __init__(self, event_sink):
+    def __init__(self, event_sink, stats=None):
         self.buffer = ""
         self.hello_received = False
         self.size = None
         self.event_sink = event_sink
+        self.stats = stats
+        # From the last parse.NotReadyError: how long the buffer must get,
+        # and whether a newline must arrive, before the message at its
+        # start could be complete. Until then there's no point parsing.
+        self._needed = 0
+        self._needs_newline = False
+        # Data received since, not yet added to the buffer: adding each
+        # piece as it comes would copy the buffer every time.
+        self._pending = []
+        self._pending_length = 0
+        self._pending_newline = False
+        # True while handing out responses.
+        self._dispatching = False
 
+    @instrument.timed('client.data_received')
     def dataReceived(self, data):
-        self.buffer += data
-
-        if not self.hello_received:
-            try:
-                resp, self.buffer = parse.parse_start(self.buffer, first=True)
-            except parse.NotReadyError:
-                return # Haven't received enough data yet
-            self.hello_received = True
-            self.size = resp.size
-            self.event_sink.response(resp)
+        instrument.count('bytes', len(data))
+        if self.stats is not None:
+            self.stats.data_received(len(data))
+
+        self._pending.append(data)
+        self._pending_length += len(data)
+        if '\n' in data or '\r' in data:
+            self._pending_newline = True
+        if self._dispatching:
+            # The event sink sent a command, and the answer came straight
+            # back. The loop below will get to it, in order.
+            return
+
+        self._dispatching = True
+        try:
+            while self._pending and self._ready():
+                self._parse_pending()
+        finally:
+            self._dispatching = False
+        self._update_buffered()
+
+    def _ready(self):
+        '''Return True if the message at the start of the buffer could be
+        complete, with what's pending. Without this, a message arriving in
+        many pieces would be rescanned from the start for every piece.
+        Past the line limit, parse anyway so that it's rejected.'''
+        length = len(self.buffer) + self._pending_length
+        if length < self._needed:
+            return False
+        return (not self._needs_newline or self._pending_newline
+                or length > parse.MAX_LINE_LENGTH)
+
+    def _parse_pending(self):
+        self.buffer += ''.join(self._pending)
+        self._pending = []
+        self._pending_length = 0
+        self._pending_newline = False
+        # What this pass may have to look at; it should add up to a small
+        # multiple of the bytes received, however they arrive.
+        instrument.count('parse_bytes', len(self.buffer))
+
+        responses = []
+        pos = 0
         try:
+            if not self.hello_received:
+                resp, pos = self._parse_at(pos, first=True)
+                self.hello_received = True
+                self.size = resp.size
+                responses.append(resp)
             while True:
-                resp, self.buffer = parse.parse_start(self.buffer, self.size)
+                resp, pos = self._parse_at(pos)
+                responses.append(resp)
+        except parse.NotReadyError as e:
+            # Haven't received enough data yet
+            self.buffer = self.buffer[e.start:]
+            self._needed = e.needed - e.start
+            self._needs_newline = e.needs_newline
+        except parse.InvalidResponseError:
+            self.buffer = self.buffer[pos:]
+            raise
+        finally:
+            # Only hand out responses once the buffer is up to date.
+            for resp in responses:
+                instrument.count('messages')
                 self.event_sink.response(resp)
-        except parse.NotReadyError:
-            return
+
+    def _parse_at(self, pos, first=False):
+        '''Parse a message from position pos of the buffer; return it and
+        the position after it.'''
+        instrument.count('parse_attempts')
+        if self.stats is None:
+            return parse.parse_at(self.buffer, pos, self.size, first)
+
+        start = self.stats.clock()
+        try:
+            resp, pos = parse.parse_at(self.buffer, pos, self.size, first)
+        except parse.InvalidResponseError as e:
+            self.stats.parse_error(e)
+            raise
+        self.stats.response_received(resp, self.stats.clock() - start)
+        return resp, pos
+
+    def _update_buffered(self):
+        if self.stats is not None:
+            self.stats.buffered = len(self.buffer) + self._pending_length
 
     def command(self, command):
+        if self.stats is not None:
+            self.stats.command_sent(command)
         self.transport.write(command.render())
 
-    def clientConnectionLost(self, connection, reason):
+    def connectionLost(self, reason):
+        if self.stats is not None:
+            self.stats.connection_lost()
         self.event_sink.response(message.CloseResp(reason))
 
 
+class Backoff(object):
+    '''Delays between attempts to reconnect, growing exponentially with
+    random jitter; the schedule twisted's ReconnectingClientFactory uses,
+    for clients that manage their own connections (such as a
+    scenario.Population's users).
+
+    Arguments:
+        initial: seconds before the first retry.
+        maximum: the most seconds between retries.
+        rng:     a random.Random for the jitter.
+    '''
+    factor = ReconnectingClientFactory.factor
+    jitter = ReconnectingClientFactory.jitter
+
+    def __init__(self, initial=1.0, maximum=30.0, rng=random):
+        self.initial = initial
+        self.maximum = maximum
+        self.rng = rng
+        self.reset()
+
+    def reset(self):
+        '''Start again from the initial delay, e.g. once connected.'''
+        self.delay = self.initial
+        self.retries = 0
+
+    def next_delay(self):
+        '''Return the seconds to wait before the next retry.'''
+        delay = max(self.rng.normalvariate(self.delay,
+            self.delay * self.jitter), 0.0)
+        self.delay = min(self.delay * self.factor, self.maximum)
+        self.retries += 1
+        return delay
+
+
+class MinesweeperClientFactory(ReconnectingClientFactory):
+    '''Makes MinesweeperClients that fire events at event_sink.
+    If reconnect is True, it reconnects whenever the connection is lost
+    or fails, waiting exponentially longer between attempts (see
+    twisted's ReconnectingClientFactory); the wait is reset once a HELLO
+    is received. Otherwise it connects once.
+    Use it as a command receiver to send commands to the current
+    connection; commands sent while disconnected are dropped.
+    '''
+
+    maxDelay = 30
+
+    def __init__(self, event_sink, stats=None, reconnect=True):
+        self.event_sink = event_sink
+        self.stats = stats
+        self.client = None
+        self.reconnect = reconnect
+        self.continueTrying = reconnect
+
+    def buildProtocol(self, addr):
+        self.client = MinesweeperClient(self, self.stats)
+        self.client.factory = self
+        return self.client
+
+    def response(self, resp):
+        if type(resp) == message.HelloResp:
+            self.resetDelay()
+            # (resetDelay turns retrying back on.)
+            self.continueTrying = self.reconnect
+        elif type(resp) == message.CloseResp:
+            self.client = None
+        self.event_sink.response(resp)
+
+    def command(self, command):
+        if self.client is not None:
+            self.client.command(command)
@@ -0,0 +1,224 @@
+import binascii
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+from gandyloo import board
+
+# Tiles are 0-10 (see board.Board), so two fit in a byte: the tile at an
+# even index goes in the high nibble, the one after it in the low nibble.
+# That is the order of the hex digits of the packed bytes, so packing is
+# translating each tile to its hex digit and unhexlifying, all in C.
+
+_HEX_DIGITS = b'0123456789abcdef'
+# Tile -> its hex digit, and back.
+_TO_HEX = bytearray(range(256))
+_FROM_HEX = bytearray(range(256))
+for _n, _digit in enumerate(bytearray(_HEX_DIGITS)):
+    _TO_HEX[_n] = _digit
+    _FROM_HEX[_digit] = _n
+_TO_HEX = bytes(_TO_HEX)
+_FROM_HEX = bytes(_FROM_HEX)
+
+def pack(b):
+    '''Pack a board's tiles into an array of ceil(width*height/2) bytes.'''
+    digits = _to_bytes(b._tiles).translate(_TO_HEX)
+    if len(digits) % 2:
+        digits += b'0'
+    return _from_bytes('B', binascii.unhexlify(digits))
+
+def unpack(packed, width, height):
+    '''Create a new board from the output of pack().'''
+    count = width*height
+    if len(packed) != (count + 1) // 2:
+        raise ValueError('Packed board has the wrong size')
+
+    digits = binascii.hexlify(_to_bytes(packed))[:count]
+    return board.Board._from_tiles(width, height,
+            _from_bytes('B', digits.translate(_FROM_HEX)))
+
+# Boards are compared as bytes in blocks of this many tiles, so that
+# unchanged stretches are skipped at C speed.
+_DIFF_BLOCK = 64
+
+def diff_tiles(old, new):
+    '''Return an array of the indices at which two equally sized tile
+    arrays (e.g. Board._tiles) differ.'''
+    assert len(old) == len(new)
+    changed = array('I')
+    old = _to_bytes(old)
+    new = _to_bytes(new)
+    if old == new:
+        return changed
+
+    count = len(new)
+    for start in range(0, count, _DIFF_BLOCK):
+        if old[start:start + _DIFF_BLOCK] != new[start:start + _DIFF_BLOCK]:
+            end = min(start + _DIFF_BLOCK, count)
+            changed.extend(i for i in range(start, end) if old[i] != new[i])
+    return changed
+
+
+class BoardHistory(object):
+    '''Every version of a board seen over a session, stored compactly.
+    Versions are numbered from 0 in the order they were append()ed, and
+    history[version] returns a new Board with that version's contents.
+
+    Every keyframe_interval-th version is stored whole (packed, see
+    pack()); the rest are stored as the tiles that changed since the
+    previous version, and their old values XORed with their new ones. A
+    version with many changes is stored as a keyframe instead, as that
+    is smaller.
+    '''
+
+    _MAGIC = b'GLH1'
+    _HEADER = struct.Struct('<4sIII')
+    _DELTA = struct.Struct('<I')
+
+    def __init__(self, width, height, keyframe_interval=64):
+        assert width > 0 and height > 0
+        assert keyframe_interval > 0
+
+        self.width = width
+        self.height = height
+        self.keyframe_interval = keyframe_interval
+
+        # Parallel lists, one entry per version. For keyframes, _keyframes
+        # holds the packed board and _deltas holds None; otherwise
+        # _keyframes holds None and _deltas holds (indices, xors).
+        self._keyframes = []
+        self._deltas = []
+        # Sorted versions of the keyframes.
+        self._keyframe_versions = []
+
+        # Tiles of the latest version, to diff the next one against.
+        self._last = None
+
+    def __len__(self):
+        return len(self._deltas)
+
+    def append(self, b):
+        '''Record a new version of the board. Returns its version number.'''
+        assert (b.width, b.height) == (self.width, self.height)
+        version = len(self)
+        # (Slicing copies in C; array('B', tiles) copies one tile at a
+        # time on Python 2.)
+        tiles = b._tiles[:]
+
+        since_keyframe = version - (self._keyframe_versions[-1]
+                if self._keyframe_versions else 0)
+        if self._last is None or since_keyframe >= self.keyframe_interval:
+            self._add_keyframe(b)
+        else:
+            indices = diff_tiles(self._last, tiles)
+            # Each change costs 5 bytes, a keyframe 1 per 2 tiles.
+            if 10*len(indices) >= len(tiles):
+                self._add_keyframe(b)
+            else:
+                xors = array('B', [self._last[i] ^ tiles[i] for i in indices])
+                self._keyframes.append(None)
+                self._deltas.append((indices, xors))
+
+        self._last = tiles
+        return version
+
+    def _add_keyframe(self, b):
+        self._keyframe_versions.append(len(self))
+        self._keyframes.append(pack(b))
+        self._deltas.append(None)
+
+    def __getitem__(self, version):
+        if version < 0:
+            version += len(self)
+        if not 0 <= version < len(self):
+            raise IndexError('No such version')
+
+        keyframe = self._keyframe_versions[
+                bisect_right(self._keyframe_versions, version) - 1]
+        result = unpack(self._keyframes[keyframe], self.width, self.height)
+
+        tiles = result._tiles
+        for v in range(keyframe + 1, version + 1):
+            indices, xors = self._deltas[v]
+            for i, x in zip(indices, xors):
+                tiles[i] ^= x
+        return result
+
+    def save(self, f):
+        '''Write this history to the binary file-like object f.'''
+        f.write(BoardHistory._HEADER.pack(BoardHistory._MAGIC,
+            self.width, self.height, self.keyframe_interval))
+        for packed, delta in zip(self._keyframes, self._deltas):
+            if delta is None:
+                f.write(b'K')
+                f.write(_to_bytes(packed))
+            else:
+                indices, xors = delta
+                f.write(b'D')
+                f.write(BoardHistory._DELTA.pack(len(indices)))
+                f.write(_to_bytes(_little_endian(indices)))
+                f.write(_to_bytes(xors))
+
+    @classmethod
+    def load(cls, f):
+        '''Read a history written by save() from the binary file-like
+        object f.'''
+        magic, width, height, keyframe_interval = cls._HEADER.unpack(
+                _read_exactly(f, cls._HEADER.size))
+        if magic != cls._MAGIC:
+            raise ValueError('Not a board history')
+
+        result = cls(width, height, keyframe_interval)
+        packed_size = (width*height + 1) // 2
+        while True:
+            kind = f.read(1)
+            if not kind:
+                break
+            if kind == b'K':
+                packed = _from_bytes('B', _read_exactly(f, packed_size))
+                result._keyframe_versions.append(len(result))
+                result._keyframes.append(packed)
+                result._deltas.append(None)
+            elif kind == b'D':
+                count, = cls._DELTA.unpack(_read_exactly(f, cls._DELTA.size))
+                indices = _little_endian(_from_bytes('I',
+                    _read_exactly(f, 4*count)))
+                xors = _from_bytes('B', _read_exactly(f, count))
+                result._keyframes.append(None)
+                result._deltas.append((indices, xors))
+            else:
+                raise ValueError('Corrupt board history')
+
+        if len(result):
+            result._last = result[-1]._tiles
+        return result
+
+
+def _to_bytes(arr):
+    # tobytes() was called tostring() before Python 3.2.
+    if hasattr(arr, 'tobytes'):
+        return arr.tobytes()
+    return arr.tostring()
+
+def _from_bytes(typecode, data):
+    result = array(typecode)
+    if hasattr(result, 'frombytes'):
+        result.frombytes(data)
+    else:
+        result.fromstring(data)
+    return result
+
+def _little_endian(arr):
+    '''Convert between native and little-endian byte order.'''
+    assert arr.itemsize == 4
+    if sys.byteorder == 'big':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr
+
+def _read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated board history')
+    return data
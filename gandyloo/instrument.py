@@ -0,0 +1,180 @@
+'''Stage timers, counters and profiling for finding out where time goes.
+
+The hot paths (parsing, relaying and rendering) are wrapped in named
+stage timers with @timed, and count() keeps named counters. Both do
+nothing but check a flag until enable() is called, so they stay in
+place permanently. Times are inclusive: a stage that calls another
+stage includes its time.
+
+Tools take a --profile option (see add_arguments and start_profiling)
+that turns the timers on, runs cProfile or a sampling profiler, and
+dumps the results when the process exits.
+'''
+import atexit
+import functools
+import signal
+import sys
+import time
+
+# perf_counter is more precise, where there is one.
+clock = getattr(time, 'perf_counter', time.time)
+
+enabled = False
+
+# Stage name -> [calls, total seconds].
+_stages = {}
+# Counter name -> count.
+_counters = {}
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    _stages.clear()
+    _counters.clear()
+
+def timed(name):
+    '''Decorator timing every call of a function as the stage name.'''
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, clock() - start)
+        return wrapper
+    return decorate
+
+def record(name, seconds):
+    '''Record one call of stage name, which took seconds.'''
+    stage = _stages.get(name)
+    if stage is None:
+        stage = _stages[name] = [0, 0.0]
+    stage[0] += 1
+    stage[1] += seconds
+
+def count(name, n=1):
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+def summary():
+    '''Return (stages, counters): stages maps stage names to dicts of
+    calls, total and mean seconds and seconds per message received;
+    counters maps counter names to counts.'''
+    messages = _counters.get('messages', 0)
+    stages = {}
+    for name, (calls, total) in _stages.items():
+        stages[name] = {
+            'calls': calls,
+            'total': total,
+            'mean': total / calls,
+            'per_message': total / messages if messages else None,
+        }
+    return stages, dict(_counters)
+
+def format_summary():
+    stages, counters = summary()
+    lines = ['{:<24} {:>10} {:>12} {:>12} {:>12}'.format(
+        'stage', 'calls', 'total s', 'mean us', 'us/message')]
+    for name in sorted(stages, key=lambda n: -stages[n]['total']):
+        stage = stages[name]
+        per_message = stage['per_message']
+        lines.append('{:<24} {:>10} {:>12.4f} {:>12.2f} {:>12}'.format(
+            name, stage['calls'], stage['total'], stage['mean'] * 1e6,
+            '-' if per_message is None
+                else '{:.2f}'.format(per_message * 1e6)))
+    for name in sorted(counters):
+        lines.append('{:<24} {:>10}'.format(name, counters[name]))
+    return '\n'.join(lines)
+
+
+class Sampler(object):
+    '''A statistical profiler: every interval seconds of CPU time, records
+    the stack of the running thread. Needs a Unix with SIGPROF.'''
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        # Stack (tuple of 'file:function' strings, outermost first) ->
+        # number of samples.
+        self.stacks = {}
+        self.samples = 0
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}'.format(code.co_filename, code.co_name))
+            frame = frame.f_back
+        stack = tuple(reversed(stack))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def dump(self, f):
+        '''Write the samples in the "collapsed stacks" format flame graph
+        tools read: one 'outer;...;inner count' line per stack.'''
+        for stack, n in sorted(self.stacks.items(), key=lambda s: -s[1]):
+            f.write('{} {}\n'.format(';'.join(stack), n))
+
+
+def add_arguments(parser):
+    '''Add --profile and --profile-output options to an argparse parser.'''
+    parser.add_argument('--profile', choices=['stages', 'cprofile', 'sample'], default=None,
+            help='Time stages, and optionally profile with cProfile or stack sampling; results are written on exit')
+    parser.add_argument('--profile-output', default=None,
+            help='File for cProfile stats (pstats format) or sampled stacks (collapsed format) [default: print a summary to stderr]')
+
+def start_profiling(args):
+    '''Start profiling as asked for by the options from add_arguments, and
+    arrange for the results to be written when the process exits.'''
+    if args.profile is None:
+        return
+    enable()
+
+    profiler = sampler = None
+    if args.profile == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif args.profile == 'sample':
+        sampler = Sampler()
+        sampler.start()
+
+    def dump():
+        disable()
+        if profiler is not None:
+            profiler.disable()
+            if args.profile_output:
+                profiler.dump_stats(args.profile_output)
+            else:
+                import pstats
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats(
+                        'cumulative').print_stats(30)
+        if sampler is not None:
+            sampler.stop()
+            if args.profile_output:
+                with open(args.profile_output, 'w') as f:
+                    sampler.dump(f)
+            else:
+                sys.stderr.write('{} samples; top stacks:\n'.format(
+                    sampler.samples))
+                for stack, n in sorted(sampler.stacks.items(),
+                        key=lambda s: -s[1])[:10]:
+                    sys.stderr.write('{:6} {}\n'.format(n, stack[-1]))
+        sys.stderr.write(format_summary() + '\n')
+    atexit.register(dump)
@@ -0,0 +1,442 @@
+'''Socket-free sessions: an in-process server, in-memory transports and a
+virtual clock.
+
+Connecting MinesweeperClients to a MinesweeperServer through a
+LoopbackEndpoint runs whole sessions without the kernel, and with a
+VirtualClock, without waiting either: simulated time jumps straight from
+one scheduled call to the next. Runs are deterministic, so they are good
+for measuring the client's own CPU cost:
+
+    clock = loopback.VirtualClock()
+    server = loopback.MinesweeperServerFactory(loopback.Game(100, 100))
+    endpoint = loopback.LoopbackEndpoint(clock, server, latency=0.001)
+    runner = churn.ChurnRunner(clock, endpoint, ...)
+    runner.start()
+    clock.run()
+
+Anything taking an IStreamClientEndpoint and a clock works the same way.
+'''
+import heapq
+import itertools
+import random
+
+from twisted.internet import error
+from twisted.internet.address import IPv4Address
+from twisted.internet.base import DelayedCall
+from twisted.internet.defer import fail, succeed
+from twisted.internet.protocol import Factory, Protocol
+from twisted.internet.task import deferLater
+from twisted.python import failure
+
+
+class VirtualClock(object):
+    '''A deterministic clock (an IReactorTime) for simulations. Like
+    twisted's task.Clock, time only moves when told to, but scheduled calls
+    are kept in a heap, so thousands of connections' timers stay cheap, and
+    run() moves time straight to each call in turn. Calls due at the same
+    time run in the order they were scheduled.
+    '''
+
+    def __init__(self, now=0.0):
+        self.rightNow = now
+        # (time, sequence number, DelayedCall). Cancelled and rescheduled
+        # calls are left in place, and skipped when they come up.
+        self._heap = []
+        self._sequence = itertools.count()
+
+    def seconds(self):
+        return self.rightNow
+
+    def callLater(self, delay, func, *args, **kw):
+        call = DelayedCall(self.rightNow + delay, func, args, kw,
+                self._cancelled, self._push, seconds=self.seconds)
+        self._push(call)
+        return call
+
+    def _push(self, call):
+        heapq.heappush(self._heap, (call.time, next(self._sequence), call))
+
+    def _cancelled(self, call):
+        pass
+
+    def _next(self):
+        '''Return the next call due, leaving it in the heap, or None.'''
+        heap = self._heap
+        while heap:
+            when, _, call = heap[0]
+            if call.active() and when == call.time:
+                if not call.delayed_time:
+                    return call
+                # Pushed back with delay() or reset(); reschedule it.
+                heapq.heappop(heap)
+                call.activate_delay()
+                self._push(call)
+            else:
+                heapq.heappop(heap)
+        return None
+
+    def getDelayedCalls(self):
+        calls = []
+        seen = set()
+        for when, _, call in sorted(self._heap):
+            if (call.active() and when == call.time
+                    and id(call) not in seen):
+                seen.add(id(call))
+                calls.append(call)
+        return calls
+
+    def _run_due(self):
+        count = 0
+        while True:
+            call = self._next()
+            if call is None or call.getTime() > self.rightNow:
+                return count
+            heapq.heappop(self._heap)
+            call.called = 1
+            call.func(*call.args, **call.kw)
+            count += 1
+
+    def advance(self, amount):
+        '''Move time on by amount seconds, running the calls due.'''
+        self.rightNow += amount
+        return self._run_due()
+
+    def pump(self, timings):
+        for amount in timings:
+            self.advance(amount)
+
+    def run(self, until=None):
+        '''Run scheduled calls until there are none left or, if until is
+        given, until the time is until. Don't leave until out if anything
+        repeats forever (a LoopingCall, say). Return the number of calls
+        run.'''
+        count = 0
+        while True:
+            call = self._next()
+            if call is None:
+                break
+            when = call.getTime()
+            if until is not None and when > until:
+                break
+            self.rightNow = max(self.rightNow, when)
+            count += self._run_due()
+        if until is not None:
+            self.rightNow = max(self.rightNow, until)
+        return count
+
+
+class LoopbackTransport(object):
+    '''One end of an in-memory connection, made by connect(). Writes are
+    collected and delivered to the other end's protocol together, latency
+    seconds after the first of them, much like TCP.
+
+    Attributes:
+        bytes_written: bytes written to this end so far.
+    '''
+
+    disconnecting = False
+
+    def __init__(self, clock, protocol, host, peer, latency):
+        self.clock = clock
+        self.protocol = protocol
+        self.host = host
+        self.peer = peer
+        self.latency = latency
+        self.other = None
+        self.connected = True
+        self.bytes_written = 0
+        self._buffer = []
+        self._delivery = None
+
+    def getHost(self):
+        return self.host
+
+    def getPeer(self):
+        return self.peer
+
+    def write(self, data):
+        if self.disconnecting or not self.connected or not data:
+            return
+        self._buffer.append(data)
+        self.bytes_written += len(data)
+        if self._delivery is None:
+            self._delivery = self.clock.callLater(self.latency, self._deliver)
+
+    def writeSequence(self, data):
+        for d in data:
+            self.write(d)
+
+    def _deliver(self):
+        self._delivery = None
+        if not self.connected:
+            return
+        data = self._buffer[0][:0].join(self._buffer)
+        self._buffer = []
+        self.other.protocol.dataReceived(data)
+        if self.disconnecting and not self._buffer:
+            self._close(error.ConnectionDone())
+
+    def loseConnection(self):
+        '''Close the connection once everything written is delivered.'''
+        if self.disconnecting or not self.connected:
+            return
+        self.disconnecting = True
+        if self._delivery is None:
+            self.clock.callLater(self.latency, self._close,
+                    error.ConnectionDone())
+
+    def abortConnection(self):
+        '''Close the connection now, dropping anything not yet delivered.'''
+        if self.connected:
+            self.clock.callLater(0, self._close, error.ConnectionLost())
+
+    def _close(self, reason):
+        # Close both ends; the other end sees a clean close too, if this
+        # one was.
+        for end in (self, self.other):
+            if not end.connected:
+                continue
+            end.connected = False
+            end._buffer = []
+            if end._delivery is not None:
+                end._delivery.cancel()
+                end._delivery = None
+            end.protocol.connectionLost(failure.Failure(reason))
+
+    # The rest of ITransport and IProducer, which do nothing here.
+    def registerProducer(self, producer, streaming):
+        pass
+
+    def unregisterProducer(self):
+        pass
+
+    def pauseProducing(self):
+        pass
+
+    def resumeProducing(self):
+        pass
+
+    def stopProducing(self):
+        self.loseConnection()
+
+def connect(clock, client, server, latency=0.0, port=0):
+    '''Connect protocols client and server with a pair of
+    LoopbackTransports, server first. Return (client transport, server
+    transport).'''
+    client_address = IPv4Address('TCP', '127.0.0.1', 50000 + port)
+    server_address = IPv4Address('TCP', '127.0.0.1', 4444)
+    client_end = LoopbackTransport(clock, client, client_address,
+            server_address, latency)
+    server_end = LoopbackTransport(clock, server, server_address,
+            client_address, latency)
+    client_end.other, server_end.other = server_end, client_end
+    server.makeConnection(server_end)
+    client.makeConnection(client_end)
+    return client_end, server_end
+
+class LoopbackEndpoint(object):
+    '''An IStreamClientEndpoint connecting, without sockets, to protocols
+    made by server_factory. Connections are made connect_delay seconds
+    after they are asked for, as a TCP handshake would take; cancelling
+    the Deferred before then abandons the connection. restart() simulates
+    the server restarting.
+
+    Attributes:
+        connections: the number of connections made.
+        refused:     the number of connections refused.
+    '''
+
+    def __init__(self, clock, server_factory, latency=0.0, connect_delay=0.0):
+        self.clock = clock
+        self.server_factory = server_factory
+        self.latency = latency
+        self.connect_delay = connect_delay
+        self.connections = 0
+        self.refused = 0
+        self.listening = True
+        # Client ends of connections, some perhaps closed, pruned now and
+        # then.
+        self._ends = []
+        self._prune_at = 1024
+
+    def connect(self, factory):
+        if self.connect_delay:
+            return deferLater(self.clock, self.connect_delay,
+                    self._connect, factory)
+        try:
+            return succeed(self._connect(factory))
+        except error.ConnectionRefusedError:
+            return fail()
+
+    def _connect(self, factory):
+        if not self.listening:
+            self.refused += 1
+            raise error.ConnectionRefusedError()
+        self.connections += 1
+        address = IPv4Address('TCP', '127.0.0.1', 4444)
+        client = factory.buildProtocol(address)
+        server = self.server_factory.buildProtocol(address)
+        client_end, server_end = connect(self.clock, client, server,
+                self.latency, self.connections % 10000)
+
+        self._ends.append(client_end)
+        if len(self._ends) >= self._prune_at:
+            self._ends = [end for end in self._ends if end.connected]
+            self._prune_at = max(1024, 2 * len(self._ends))
+        return client
+
+    def restart(self, downtime):
+        '''Drop every connection, and refuse new ones for downtime
+        seconds, as if the server had been restarted.'''
+        self.listening = False
+        ends, self._ends = self._ends, []
+        for end in ends:
+            if end.connected:
+                end.abortConnection()
+        self.clock.callLater(downtime, self._listen)
+
+    def _listen(self):
+        self.listening = True
+
+
+class Game(object):
+    '''A multiplayer minesweeper game, as played by the 6.005 server.
+
+    Arguments:
+        width, height: the board's size.
+        density:       the chance of each tile having a mine.
+        seed:          seeds the mine layout.
+    '''
+
+    def __init__(self, width, height, density=0.1, seed=0):
+        self.width = width
+        self.height = height
+        rng = random.Random(seed)
+        self.mines = bytearray(1 if rng.random() < density else 0
+                for _ in range(width * height))
+        # What players see: '-', 'F', ' ' or a count, per tile.
+        self.tiles = ['-'] * (width * height)
+        self.players = 0
+        # Bumped on every change, so renders can be reused until then.
+        self.version = 0
+        self._rendered = None
+        self._rendered_version = None
+
+    def render(self):
+        '''Return the board as the server sends it.'''
+        if self._rendered_version != self.version:
+            width = self.width
+            tiles = self.tiles
+            self._rendered = ''.join(
+                    ' '.join(tiles[y * width:(y + 1) * width]) + '\r\n'
+                    for y in range(self.height))
+            self._rendered_version = self.version
+        return self._rendered
+
+    def _neighbors(self, x, y):
+        for ny in range(max(y - 1, 0), min(y + 2, self.height)):
+            for nx in range(max(x - 1, 0), min(x + 2, self.width)):
+                if (nx, ny) != (x, y):
+                    yield nx, ny
+
+    def _count(self, x, y):
+        return sum(self.mines[ny * self.width + nx]
+                for nx, ny in self._neighbors(x, y))
+
+    def dig(self, x, y):
+        '''Dig (x, y). Return True if there was a mine there.'''
+        i = y * self.width + x
+        if self.tiles[i] != '-':
+            return False
+        boom = bool(self.mines[i])
+        if boom:
+            self.mines[i] = 0
+            # Counts of dug neighbors change with the mine gone.
+            for nx, ny in self._neighbors(x, y):
+                if self.tiles[ny * self.width + nx] not in '-F':
+                    self._reveal(nx, ny)
+
+        todo = [(x, y)]
+        while todo:
+            x, y = todo.pop()
+            count = self._reveal(x, y)
+            if count == 0:
+                todo.extend((nx, ny) for nx, ny in self._neighbors(x, y)
+                        if self.tiles[ny * self.width + nx] == '-')
+        self.version += 1
+        return boom
+
+    def _reveal(self, x, y):
+        count = self._count(x, y)
+        self.tiles[y * self.width + x] = str(count) if count else ' '
+        return count
+
+    def flag(self, x, y, flagged=True):
+        i = y * self.width + x
+        old, new = ('-', 'F') if flagged else ('F', '-')
+        if self.tiles[i] == old:
+            self.tiles[i] = new
+            self.version += 1
+
+
+class MinesweeperServer(Protocol):
+    '''One player's connection to a Game.'''
+
+    HELP = ('Commands: look, dig X Y, flag X Y, deflag X Y, help, '
+            'bye.\r\n')
+
+    def __init__(self, game):
+        self.game = game
+        self.buffer = ''
+
+    def connectionMade(self):
+        game = self.game
+        game.players += 1
+        self.transport.write(("Welcome to Minesweeper. Board: {} columns by "
+            "{} rows. Players: {} including you. Type 'help' for help.\r\n"
+            ).format(game.width, game.height, game.players))
+
+    def connectionLost(self, reason):
+        self.game.players -= 1
+
+    def dataReceived(self, data):
+        lines = (self.buffer + data).split('\n')
+        self.buffer = lines.pop()
+        for line in lines:
+            self.line_received(line.strip())
+            if self.transport.disconnecting:
+                return
+
+    def line_received(self, line):
+        words = line.split()
+        game = self.game
+        if words == ['look']:
+            self.transport.write(game.render())
+        elif words == ['help']:
+            self.transport.write(self.HELP)
+        elif words == ['bye']:
+            self.transport.loseConnection()
+        elif len(words) == 3 and words[0] in ('dig', 'flag', 'deflag'):
+            try:
+                x, y = int(words[1]), int(words[2])
+            except ValueError:
+                x = y = -1
+            if not (0 <= x < game.width and 0 <= y < game.height):
+                self.transport.write(game.render())
+            elif words[0] == 'dig' and game.dig(x, y):
+                self.transport.write('BOOM!\r\n')
+            else:
+                if words[0] != 'dig':
+                    game.flag(x, y, words[0] == 'flag')
+                self.transport.write(game.render())
+        else:
+            self.transport.write(self.HELP)
+
+class MinesweeperServerFactory(Factory):
+    '''Makes MinesweeperServers, all playing game.'''
+
+    def __init__(self, game):
+        self.game = game
+
+    def buildProtocol(self, addr):
+        return MinesweeperServer(self.game)
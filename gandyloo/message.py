@@ -1,4 +1,7 @@
 import re
+from collections import OrderedDict
+
+from gandyloo import instrument
 
 class MessageRelay(object):
     '''A class to pass around commands to the server and responses from
@@ -17,10 +20,12 @@ class MessageRelay(object):
     def add_response_receiver(self, receiver):
         self.response_receivers.append(receiver)
 
+    @instrument.timed('relay.command')
     def command(self, command):
         for receiver in self.command_receivers:
             receiver.command(command)
 
+    @instrument.timed('relay.response')
     def response(self, response):
         for receiver in self.response_receivers:
             receiver.response(response)
@@ -28,47 +33,122 @@ class MessageRelay(object):
 class Command(object):
     '''A command to send to the minecraft server.
     Must have a method render() to turn into a gandyloo-compatible
-    command message.
+    command message, and a name: the command's first word.
+    Commands are immutable, so they can be shared and sent any number of
+    times.
     '''
+    __slots__ = ()
+    name = None
 
     def render(self):
         pass
 
 class LookCommand(Command):
+    __slots__ = ()
+    name = 'look'
+
     def render(self):
         return 'look\n'
 
 class HelpCommand(Command):
+    __slots__ = ()
+    name = 'help'
+
     def render(self):
         return 'help\n'
 
 class ByeCommand(Command):
-    def render(self):
-        return 'bye\n'
-
-class DigCommand(Command):
-    def __init__(self, target):
-        assert len(target) == 2
-        self.target = target
+    __slots__ = ()
+    name = 'bye'
 
     def render(self):
-        return 'dig {} {}\n'.format(*self.target)
-
-class FlagCommand(Command):
-    def __init__(self, target):
-        assert len(target) == 2
-        self.target = target
+        return 'bye\n'
 
-    def render(self):
-        return 'flag {} {}\n'.format(*self.target)
+class TileCommand(Command):
+    '''A command on the tile at target, (x, y). The rendered command is
+    cached, so sending the same command again doesn't re-format it.'''
+    __slots__ = ('target', '_line')
 
-class DeflagCommand(Command):
     def __init__(self, target):
         assert len(target) == 2
         self.target = target
+        self._line = None
 
     def render(self):
-        return 'deflag {} {}\n'.format(*self.target)
+        line = self._line
+        if line is None:
+            line = self._line = '{} {} {}\n'.format(self.name, *self.target)
+        return line
+
+class DigCommand(TileCommand):
+    __slots__ = ()
+    name = 'dig'
+
+class FlagCommand(TileCommand):
+    __slots__ = ()
+    name = 'flag'
+
+class DeflagCommand(TileCommand):
+    __slots__ = ()
+    name = 'deflag'
+
+class CommandTable(object):
+    '''Shared commands for the tiles of a board of a given size, created
+    and rendered the first time they are asked for. Use command_table()
+    to get the table for a size.
+    Only commands that have been asked for are kept, up to MAX_COMMANDS
+    of each kind; beyond that, the oldest are dropped one at a time and
+    made again as needed.'''
+
+    MAX_COMMANDS = 4096
+
+    def __init__(self, size):
+        self.width, self.height = size
+        # Command class -> OrderedDict of tile index (as in
+        # board._tiles) -> command, oldest first. Hits don't reorder it:
+        # that would cost more, on Python 2, than making a new command.
+        self._commands = {}
+
+    def _get(self, command_class, target):
+        commands = self._commands.get(command_class)
+        if commands is None:
+            commands = self._commands[command_class] = OrderedDict()
+
+        x, y = target
+        assert 0 <= x < self.width and 0 <= y < self.height
+        index = x + y*self.width
+        command = commands.get(index)
+        if command is None:
+            if len(commands) >= self.MAX_COMMANDS:
+                commands.popitem(last=False)
+            command = commands[index] = command_class((x, y))
+            command.render()
+        return command
+
+    def dig(self, target):
+        return self._get(DigCommand, target)
+
+    def flag(self, target):
+        return self._get(FlagCommand, target)
+
+    def deflag(self, target):
+        return self._get(DeflagCommand, target)
+
+# Size -> CommandTable, shared by every connection in the process; the
+# least recently used tables are dropped beyond MAX_COMMAND_TABLES.
+MAX_COMMAND_TABLES = 8
+_command_tables = OrderedDict()
+
+def command_table(size):
+    '''Return the CommandTable for boards of size (width, height).'''
+    table = _command_tables.pop(size, None)
+    if table is None:
+        table = CommandTable(size)
+        while len(_command_tables) >= MAX_COMMAND_TABLES:
+            _command_tables.popitem(last=False)
+    # (Re-)inserted as the most recently used.
+    _command_tables[size] = table
+    return table
 
 
 class Response(object):
@@ -83,25 +163,33 @@ class Response(object):
         size:     if this response is a HELLO, the (width, height) of the
                   map given by the HELLO.
     '''
+    __slots__ = ()
 
 class HelpResp(Response):
+    __slots__ = ('contents',)
+
     def __init__(self, contents):
         self.contents = contents
 
 class BoomResp(Response):
-    pass
+    __slots__ = ()
 
 class HelloResp(Response):
+    __slots__ = ('size', 'players')
+
     def __init__(self, size, players):
         self.size = size
         self.players = players
 
 class BoardResp(Response):
+    __slots__ = ('board',)
+
     def __init__(self, board):
         self.board = board
 
 class CloseResp(Response):
     '''Represents the connection from the server closing.'''
+    __slots__ = ('reason',)
+
     def __init__(self, reason):
         self.reason = reason
-
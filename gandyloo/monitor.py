@@ -0,0 +1,116 @@
+'''Watching many connections at once.
+
+A Monitor keeps the latest state of any number of connections, and
+thumbnails of their boards (see board.thumbnail) for display. Like
+verify.Recorder, monitor.connection(conn_id) returns an object to add as
+a command and response receiver for each connection; a
+scenario.Population takes the monitor as a watcher and does this itself.
+
+Keeping up costs little per response: a board only counts as changed if
+its tiles differ from the last one's, and thumbnails are recomputed when
+they are drawn, only for boards that changed since. The gandymonitor.py
+script shows a Monitor's thumbnails in a grid.
+'''
+from collections import OrderedDict
+
+from gandyloo import board, message
+
+class Tail(object):
+    '''The state of one watched connection.
+
+    Attributes:
+        conn_id: the id the connection was added with.
+        state:   'wait' before the first board, then 'board' or 'boom'
+                 after each BOARD or BOOM; 'closed' once closed.
+        board:   the latest board, or None.
+        version: incremented whenever state or board changes.
+    '''
+    __slots__ = ('monitor', 'conn_id', 'state', 'board', 'version',
+            '_thumbnail', '_thumbnail_key')
+
+    def __init__(self, monitor, conn_id):
+        self.monitor = monitor
+        self.conn_id = conn_id
+        self.state = 'wait'
+        self.board = None
+        self.version = 0
+        self._thumbnail = None
+        self._thumbnail_key = None
+
+    def command(self, command):
+        pass
+
+    def response(self, resp):
+        t = type(resp)
+        if t == message.BoardResp:
+            old = self.board
+            self.board = resp.board
+            # Cached boards share their tiles, so unchanged boards are
+            # usually caught by the identity check.
+            if (self.state == 'board' and old is not None
+                    and (old._tiles is resp.board._tiles
+                        or old._tiles == resp.board._tiles)):
+                return
+            self.state = 'board'
+        elif t == message.BoomResp:
+            self.state = 'boom'
+        elif t == message.CloseResp:
+            self.state = 'closed'
+            self.monitor._closed(self)
+        else:
+            return
+        self.version += 1
+        self.monitor.version += 1
+
+    def thumbnail(self, columns, rows):
+        '''Return board.thumbnail() of the latest board, or None if there
+        isn't one, recomputing it only if the board has changed.'''
+        if self.board is None:
+            return None
+        key = (self.version, columns, rows)
+        if key != self._thumbnail_key:
+            self._thumbnail = board.thumbnail(self.board, columns, rows)
+            self._thumbnail_key = key
+            self.monitor.thumbnails_computed += 1
+        return self._thumbnail
+
+class Monitor(object):
+    '''Tails of connections, in the order they were added.
+
+    Arguments:
+        keep_closed: how many closed connections to keep showing; older
+                     ones are dropped.
+
+    Attributes:
+        tails:   OrderedDict of connection id -> Tail.
+        version: incremented whenever any tail changes, so displays can
+                 skip redrawing when nothing has.
+        thumbnails_computed: how many thumbnails have been computed.
+    '''
+
+    def __init__(self, keep_closed=0):
+        self.keep_closed = keep_closed
+        self.tails = OrderedDict()
+        self.version = 0
+        self.thumbnails_computed = 0
+        self._closed_ids = []
+
+    def connection(self, conn_id):
+        '''Return the Tail for connection conn_id, to add as a command and
+        response receiver.'''
+        tail = Tail(self, conn_id)
+        self.tails[conn_id] = tail
+        self.version += 1
+        return tail
+
+    def _closed(self, tail):
+        self._closed_ids.append(tail.conn_id)
+        while len(self._closed_ids) > self.keep_closed:
+            self.tails.pop(self._closed_ids.pop(0), None)
+
+    def counts(self):
+        '''Return a dict of state -> number of tails in that state.'''
+        result = {}
+        for tail in self.tails.values():
+            result[tail.state] = result.get(tail.state, 0) + 1
+        return result
@@ -1,18 +1,31 @@
 import re
+from array import array
+from collections import OrderedDict
 
-from gandyloo import message, board
+from gandyloo import message, board, instrument
 
 _NEWLINE = re.compile(r'\r\n?|\n')
+# Any number of newlines; skipped between messages.
+_NEWLINES = re.compile(r'[\r\n]*')
+
+# Hard limits on what a server may send, so that a broken or hostile one
+# can't make a connection buffer and rescan without bound. Anything past
+# them raises InvalidResponseError.
+# The longest line (HELLO, BOOM, help message or board row) accepted.
+MAX_LINE_LENGTH = 1 << 16
+# The longest BOARD frame accepted; HELLOs announcing boards with longer
+# frames, or rows longer than MAX_LINE_LENGTH, are rejected.
+MAX_FRAME_LENGTH = 1 << 25
 
 class ResponseParsers:
     HELLO = re.compile(r'Welcome to Minesweeper. '
-            + r'Board: ([0-9]+) columns by ([0-9]+) rows. '
-            + r'Players: ([0-9]+) including you. '
+            + r'Board: ([0-9]{1,9}) columns by ([0-9]{1,9}) rows. '
+            + r'Players: ([0-9]{1,9}) including you. '
             + r"Type 'help' for help.(?:\r\n?|\n)")
     BOOM = re.compile(r'BOOM!(\r\n?|\n)')
-    BOARD = re.compile(r'(([0-8F -] )*[0-8F -](\r\n?|\n))+')
     HELP = re.compile(r'[^\r\n]+(\r\n?|\n)')
 
+@instrument.timed('parse.parse_start')
 def parse_start(buf, size=None, first=False):
     '''Extract a message from the start of a string.
     raise NotReadyError if the string does not contain an entire message.
@@ -23,85 +36,207 @@ def parse_start(buf, size=None, first=False):
         first: if this is the first message received (i.e. it should be a
                HELLO).
     '''
-    
-    while buf.startswith('\n') or buf.startswith('\r'):
-        buf = buf[1:]
-    
-    if not _NEWLINE.search(buf):
-        raise NotReadyError()
+    resp, end = parse_at(buf, 0, size, first)
+    return resp, buf[end:]
+
+@instrument.timed('parse.parse_at')
+def parse_at(buf, pos=0, size=None, first=False):
+    '''Like parse_start, but extract the message starting at position pos
+    of buf, and return (Response, position just after it). A buffer holding
+    many messages can be parsed without copying the rest of it after each
+    one.
+    '''
+    pos = _NEWLINES.match(buf, pos).end()
+
+    # A newline can end no more than MAX_LINE_LENGTH + 2 characters in.
+    newline = _NEWLINE.search(buf, pos, pos + MAX_LINE_LENGTH + 2)
+    if newline is None or newline.start() - pos > MAX_LINE_LENGTH:
+        if len(buf) - pos > MAX_LINE_LENGTH:
+            raise InvalidResponseError('Line too long',
+                    buf[pos:pos + 80] + '...')
+        raise NotReadyError(pos, len(buf) + 1, needs_newline=True)
 
     # First message; must be a HELLO.
     if first:
-        hello_match = ResponseParsers.HELLO.match(buf)
+        hello_match = ResponseParsers.HELLO.match(buf, pos)
         if hello_match:
             size = (int(hello_match.group(1)), int(hello_match.group(2)))
             players = int(hello_match.group(3))
-            return message.HelloResp(size, players), buf[hello_match.end():]
+            check_size(size)
+            return message.HelloResp(size, players), hello_match.end()
         else:
-            raise InvalidResponseError('HELLO does not match spec', buf)
+            raise InvalidResponseError('HELLO does not match spec',
+                    buf[pos:newline.end()])
 
-    boom_match = ResponseParsers.BOOM.match(buf)
+    boom_match = ResponseParsers.BOOM.match(buf, pos)
     if boom_match:
-        return message.BoomResp(), buf[boom_match.end():]
-
-    board_match = ResponseParsers.BOARD.match(buf)
-    if board_match:
-        width, height = size
-        contents = board_match.group(0)
-        lines = contents.splitlines(True) # keep newlines
-        if len(lines) < height:
-            # We haven't received the full board
-            raise NotReadyError()
+        return message.BoomResp(), boom_match.end()
 
+    board_end = scan_board(buf, size, pos)
+    if board_end is not None:
         # We may have received multiple boards; only take
         # the first one.
-        contents = ''.join(lines[:height])
+        contents = buf[pos:board_end]
+        board = board_cache.get(contents, size)
+        return message.BoardResp(board), board_end
 
-        board = parse_board(contents, size)
-        return message.BoardResp(board), buf[len(contents):]
-
-    help_match = ResponseParsers.HELP.match(buf)
+    help_match = ResponseParsers.HELP.match(buf, pos, newline.end())
     if help_match:
         contents = help_match.group(0)
-        return message.HelpResp(contents), buf[help_match.end():]
+        return message.HelpResp(contents), help_match.end()
+
+    raise InvalidResponseError("No match on response (this should be impossible)",
+            buf[pos:newline.end()])
+
+def check_size(size):
+    '''raise InvalidResponseError unless boards of size (width, height)
+    are within the limits.'''
+    width, height = size
+    if width < 1 or height < 1:
+        raise InvalidResponseError('Empty board', size)
+    if 2*width - 1 > MAX_LINE_LENGTH or (2*width + 1)*height > MAX_FRAME_LENGTH:
+        raise InvalidResponseError('Board too large', size)
+
+
+# One row of a board, of any width. Unlike matching a whole frame with one
+# regex, this can't backtrack: after each tile comes either a space and
+# another tile, or the end of the row.
+_BOARD_ROW = re.compile(r'[0-8F -](?: [0-8F -])*(\r\n?|\n)')
+
+@instrument.timed('parse.scan_board')
+def scan_board(buf, size, start=0):
+    '''Find the BOARD frame at position start of buf, in one pass over it.
+    return the position just after the frame (including its last newline),
+    or None if there isn't a board there.
+    raise NotReadyError if the frame hasn't been received completely, and
+    InvalidResponseError if it has the wrong shape.
+
+    Arguments:
+        size: (width, height) of expected boards.
+    '''
+    width, height = size
+    row_length = 2*width - 1
+    buf_length = len(buf)
+    pos = start
+
+    for y in range(height):
+        if y == 0:
+            # The first line decides whether this is a board at all, so
+            # look at all of it.
+            row = _BOARD_ROW.match(buf, pos)
+            if row is None:
+                if _NEWLINE.search(buf, pos) is None:
+                    raise NotReadyError(start, buf_length + 1,
+                            needs_newline=True)
+                return None
+        else:
+            # A correct row and its newline end row_length + 2 characters
+            # in at the latest; don't look any further than that.
+            row = _BOARD_ROW.match(buf, pos, pos + row_length + 2)
+            if row is None:
+                if (buf_length - pos <= row_length
+                        and _NEWLINE.search(buf, pos) is None):
+                    # The rest of the frame is at least a row and a
+                    # newline per row to go.
+                    raise NotReadyError(start,
+                            pos + (height - y)*(row_length + 1))
+                raise InvalidResponseError('Wrong size board',
+                        buf[start:pos + row_length + 2])
+
+        if row.start(1) - pos != row_length:
+            raise InvalidResponseError('Wrong size board',
+                    buf[start:row.end()])
+        pos = row.end()
 
-    raise InvalidResponseError("No match on response (this should be impossible)", buf)
+    return pos
 
+_TILE_VALUES = dict((str(n), n) for n in range(9))
+_TILE_VALUES.update({' ': 0, '-': 9, 'F': 10})
 
+@instrument.timed('parse.parse_board')
 def parse_board(board_contents, expected_size):
-    '''Parse a board into a message.BoardResp object.
-    board_contents must match message.BoardResp.regex.'''
+    '''Parse a BOARD frame (e.g. as found by scan_board) into a
+    board.Board.'''
     lines = board_contents.splitlines()
-    if lines[-1] == '':
-        lines = lines[:-1]
 
     width, height = expected_size
 
     if len(lines) != height:
         raise InvalidResponseError('Wrong size board', board_contents)
 
-    result = board.Board(width, height)
-
-    for (y, line) in enumerate(lines):
+    tiles = array('B')
+    for line in lines:
         line_tiles = line[::2]
         if len(line_tiles) != width:
             raise InvalidResponseError('Wrong size board', board_contents)
 
-        for (x, tile) in enumerate(line_tiles):
-            if tile == '-':
-                result[x, y] = board.Untouched()
-            elif tile == 'F':
-                result[x, y] = board.Flagged()
-            elif tile == ' ':
-                result[x, y] = board.Dug(0)
-            else:
-                try:
-                    result[x, y] = board.Dug(int(tile))
-                except:
-                    raise InvalidResponseError('Invalid tile',
-                            board_contents)
+        try:
+            tiles.extend(map(_TILE_VALUES.__getitem__, line_tiles))
+        except KeyError:
+            raise InvalidResponseError('Invalid tile', board_contents)
+
+    return board.Board._from_tiles(width, height, tiles)
+
+
+class BoardCache(object):
+    '''A cache of parsed boards, keyed by the raw text of their BOARD
+    frames.
+    In multiplayer every client receives the same frames, so parsing
+    each one once and handing out snapshots (see board.Board.snapshot)
+    saves a parse per connection per update.
+    Least recently used boards are evicted once the cache holds more than
+    max_bytes of frames and tiles.
+    '''
+
+    # Rough per-entry bookkeeping cost, in bytes.
+    ENTRY_OVERHEAD = 256
+
+    def __init__(self, max_bytes=16*1024*1024):
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
 
-    return result
+    def get(self, board_contents, expected_size):
+        '''Return a snapshot of board_contents parsed as a board of
+        expected_size, parsing it only if it isn't already cached.
+        Raises InvalidResponseError like parse_board; invalid boards
+        are not cached.
+        '''
+        key = (board_contents, expected_size)
+        cached = self._entries.pop(key, None)
+        if cached is not None:
+            self.hits += 1
+            # Re-insert to mark as most recently used.
+            self._entries[key] = cached
+            return cached.snapshot()
+
+        self.misses += 1
+        result = parse_board(board_contents, expected_size)
+
+        cost = self._cost(key, result)
+        if cost <= self.max_bytes:
+            self._entries[key] = result
+            self.bytes_used += cost
+            while self.bytes_used > self.max_bytes:
+                old_key, old_board = self._entries.popitem(last=False)
+                self.bytes_used -= self._cost(old_key, old_board)
+
+        return result.snapshot()
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes_used = 0
+
+    def _cost(self, key, result):
+        return len(key[0]) + len(result._tiles) + BoardCache.ENTRY_OVERHEAD
+
+# Shared by every connection in the process.
+board_cache = BoardCache()
 
 
 class InvalidResponseError(Exception):
@@ -114,5 +249,18 @@ class InvalidResponseError(Exception):
 
 
 class NotReadyError(Exception):
-    pass
+    '''Raised when a buffer doesn't hold a whole message yet. The
+    attributes say when it's worth trying again:
+        start:         where the incomplete message starts (after any
+                       newlines before it).
+        needed:        how long the buffer must be, at least, to hold the
+                       whole message.
+        needs_newline: if another newline must arrive first.
+    '''
+
+    def __init__(self, start=0, needed=0, needs_newline=False):
+        Exception.__init__(self)
+        self.start = start
+        self.needed = needed
+        self.needs_newline = needs_newline
 
@@ -0,0 +1,134 @@
+'''Keeping a multiplayer board fresh by polling with look.
+
+The server only sends a board in answer to a command, so other players'
+moves go unseen until this player does something. An AdaptivePoller sends
+look commands in the background: often while the board keeps changing,
+exponentially less often while it doesn't, never while another command is
+waiting for its response, and never so often that the boards sent back
+would exceed a bandwidth budget. For example:
+
+    poller = polling.AdaptivePoller(reactor, relay)
+    relay.add_command_receiver(poller)
+    relay.add_response_receiver(poller)
+'''
+from gandyloo import message
+
+_LOOK = message.LookCommand()
+
+def board_bytes(size):
+    '''The number of bytes in a BOARD message for a board of size (width,
+    height).'''
+    width, height = size
+    return (2 * width + 1) * height
+
+class AdaptivePoller(object):
+    '''Sends looks to command_sink as a connection's board needs them. Add
+    it as a command and response receiver for the connection, so it sees
+    every command sent (including its own) and every response.
+
+    Arguments:
+        clock:         an IReactorTime, such as the reactor.
+        min_interval:  seconds between looks while the board is changing.
+        max_interval:  the most seconds between looks, however long the
+                       board has been unchanged.
+        backoff:       how much longer to wait after each look that finds
+                       the board unchanged.
+        max_bandwidth: bytes per second of boards that looks may bring in;
+                       on large boards this is what limits polling.
+
+    Attributes:
+        interval: the current seconds between looks, before the bandwidth
+                  limit.
+        polls:    the number of looks sent.
+        skipped:  the number of looks skipped because a command was in
+                  flight.
+    '''
+
+    def __init__(self, clock, command_sink, min_interval=0.25,
+            max_interval=8.0, backoff=2.0, max_bandwidth=32768):
+        assert 0 < min_interval <= max_interval and backoff >= 1
+        self.clock = clock
+        self.command_sink = command_sink
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_bandwidth = max_bandwidth
+
+        self.interval = min_interval
+        self.polls = 0
+        self.skipped = 0
+
+        # Seconds between looks allowed by max_bandwidth.
+        self._bandwidth_interval = 0.0
+        # Commands sent and not yet answered.
+        self._in_flight = 0
+        # True while our own look is in flight.
+        self._polled = False
+        self._last_tiles = None
+        self._call = None
+
+    def next_interval(self):
+        '''Seconds until the next look, limited by max_bandwidth.'''
+        return max(self.interval, self._bandwidth_interval)
+
+    def _schedule(self):
+        if self._call is not None and self._call.active():
+            self._call.reset(self.next_interval())
+        else:
+            self._call = self.clock.callLater(self.next_interval(),
+                    self._poll)
+
+    def _poll(self):
+        self._call = None
+        if self._in_flight:
+            # The response will reschedule us.
+            self.skipped += 1
+            return
+        self.polls += 1
+        self._polled = True
+        self.command_sink.command(_LOOK)
+
+    def command(self, command):
+        if type(command) != message.ByeCommand:
+            self._in_flight += 1
+
+    def response(self, resp):
+        t = type(resp)
+        if t == message.HelloResp:
+            self._bandwidth_interval = (float(board_bytes(resp.size))
+                    / self.max_bandwidth)
+            self.interval = self.min_interval
+            # Anything sent before the connection was made never arrived.
+            self._in_flight = 0
+            self._polled = False
+            self._schedule()
+        elif t == message.CloseResp:
+            self.stop()
+        else:
+            self._in_flight = max(self._in_flight - 1, 0)
+            polled, self._polled = self._polled, False
+            if t == message.BoardResp:
+                self._board_received(resp.board, polled)
+            if not self._in_flight:
+                self._schedule()
+
+    def _board_received(self, board, polled):
+        last, tiles = self._last_tiles, board._tiles
+        # Cached boards share their tiles, so unchanged boards are usually
+        # caught by the identity check.
+        if last is not None and (last is tiles or last == tiles):
+            if polled:
+                self.interval = min(self.interval * self.backoff,
+                        self.max_interval)
+        else:
+            self.interval = self.min_interval
+        self._last_tiles = tiles
+
+    def stop(self):
+        '''Stop polling, until the next HELLO.'''
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        self._in_flight = 0
+        self._polled = False
+        self._last_tiles = None
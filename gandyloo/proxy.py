@@ -0,0 +1,299 @@
+'''A TCP proxy that simulates bad networks between clients and a server.
+
+Run it between gandyloo clients and a server to add latency, jitter,
+bandwidth limits, arbitrary re-chunking of the byte stream and
+connection resets:
+
+    python -m gandyloo.proxy --listen 4445 --server localhost --port 4444 \
+        --latency 80 --jitter 20 --max-chunk 16 --split-newlines 0.5
+
+then point clients at port 4445. Faults are applied independently in
+each direction.
+'''
+import random
+from collections import deque
+
+from twisted.internet import protocol
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+
+from gandyloo import instrument
+
+class Faults(object):
+    '''Network conditions to simulate in one direction of a connection.
+
+    Attributes:
+        latency:        seconds every chunk is delayed by.
+        jitter:         up to this many seconds are randomly added to or
+                        taken from each chunk's latency. Chunks are still
+                        delivered in order.
+        bandwidth:      bytes per second the link can carry, or None for
+                        no limit.
+        max_chunk:      data is split into chunks of random sizes up to
+                        this many bytes, or None to keep chunks as they
+                        were received.
+        split_newlines: probability of splitting each \\r\\n between the
+                        \\r and the \\n.
+        reset_rate:     probability of resetting the connection instead
+                        of delivering each chunk.
+    '''
+
+    def __init__(self, latency=0.0, jitter=0.0, bandwidth=None,
+            max_chunk=None, split_newlines=0.0, reset_rate=0.0):
+        assert latency >= 0 and jitter >= 0
+        assert bandwidth is None or bandwidth > 0
+        assert max_chunk is None or max_chunk > 0
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.max_chunk = max_chunk
+        self.split_newlines = split_newlines
+        self.reset_rate = reset_rate
+
+def rechunk(data, rng, max_chunk=None, split_newlines=0.0):
+    '''Split data into a list of chunks as described by Faults.max_chunk
+    and Faults.split_newlines, using the random.Random rng.'''
+    cuts = []
+    if split_newlines:
+        i = data.find(b'\r\n')
+        while i != -1:
+            if rng.random() < split_newlines:
+                cuts.append(i + 1)
+            i = data.find(b'\r\n', i + 2)
+    cuts.append(len(data))
+
+    chunks = []
+    pos = 0
+    for cut in cuts:
+        while pos < cut:
+            if max_chunk is None:
+                end = cut
+            else:
+                end = min(cut, pos + rng.randint(1, max_chunk))
+            chunks.append(data[pos:end])
+            pos = end
+    return chunks
+
+class FaultyLink(object):
+    '''One direction of a proxied connection. Data given to send() is
+    passed to deliver() later, according to faults.
+
+    Arguments:
+        faults:  the Faults to apply.
+        clock:   an IReactorTime to schedule deliveries with.
+        rng:     a random.Random.
+        deliver: called with each chunk of data when it arrives.
+        close:   called once everything sent before close() has arrived.
+        reset:   called if the link decides to reset the connection.
+    '''
+
+    def __init__(self, faults, clock, rng, deliver, close, reset):
+        self.faults = faults
+        self.clock = clock
+        self.rng = rng
+        self._deliver = deliver
+        self._close = close
+        self._reset = reset
+
+        # When the link will be done transmitting what it's been sent.
+        self._free_at = 0.0
+        # When the last chunk sent will arrive.
+        self._last_arrival = 0.0
+
+        # (arrival time, function, args) for everything in flight, in order;
+        # and the timer for the first one.
+        self._in_flight = deque()
+        self._timer = None
+        self.closed = False
+
+    def send(self, data):
+        if self.closed:
+            return
+        faults = self.faults
+        for chunk in rechunk(data, self.rng, faults.max_chunk,
+                faults.split_newlines):
+            if faults.reset_rate and self.rng.random() < faults.reset_rate:
+                self.abort()
+                self._reset()
+                return
+            self._schedule(self._arrival(len(chunk)), self._deliver, chunk)
+
+    def close(self):
+        '''Stop accepting data, and close once the data in flight arrives.'''
+        if self.closed:
+            return
+        self.closed = True
+        self._schedule(max(self._last_arrival, self.clock.seconds()),
+                self._close)
+
+    def abort(self):
+        '''Close immediately, dropping any data in flight.'''
+        self.closed = True
+        self._in_flight.clear()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _arrival(self, size):
+        now = self.clock.seconds()
+        faults = self.faults
+
+        sent = max(now, self._free_at)
+        if faults.bandwidth is not None:
+            sent += float(size) / faults.bandwidth
+        self._free_at = sent
+
+        delay = faults.latency
+        if faults.jitter:
+            delay = max(0.0, delay + self.rng.uniform(-faults.jitter,
+                faults.jitter))
+
+        # Like TCP, never deliver out of order.
+        self._last_arrival = max(self._last_arrival, sent + delay)
+        return self._last_arrival
+
+    def _schedule(self, when, func, *args):
+        self._in_flight.append((when, func, args))
+        if self._timer is None:
+            self._start_timer()
+
+    def _start_timer(self):
+        when = self._in_flight[0][0]
+        self._timer = self.clock.callLater(
+                max(0.0, when - self.clock.seconds()), self._arrive)
+
+    def _arrive(self):
+        # Timers firing at the same time may run in any order, so a
+        # single timer delivers everything that's due, in order.
+        self._timer = None
+        # The timer was for the first item; it's due even if rounding says
+        # otherwise.
+        due = max(self.clock.seconds(), self._in_flight[0][0])
+        while self._in_flight and self._in_flight[0][0] <= due:
+            when, func, args = self._in_flight.popleft()
+            func(*args)
+        if self._in_flight:
+            self._start_timer()
+
+
+class _ProxyEnd(protocol.Protocol):
+    '''One side of a proxied connection. Data it receives is sent to the
+    other side through a FaultyLink.'''
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.peer = None
+        self.link = None
+
+    def dataReceived(self, data):
+        self.proxy.bytes_proxied += len(data)
+        self.link.send(data)
+
+    def connectionLost(self, reason):
+        if self.link is not None:
+            self.link.close()
+
+    def _reset(self):
+        '''Reset both sides of the connection.'''
+        self.proxy.resets += 1
+        for end in (self, self.peer):
+            end.link.abort()
+            end.transport.abortConnection()
+
+class _ClientSide(_ProxyEnd):
+    '''The side facing a client; connects to the server when the client
+    connects.'''
+
+    disconnected = False
+
+    def connectionMade(self):
+        self.proxy.connections += 1
+        # Hold on to the client's data until the server is connected.
+        self.transport.pauseProducing()
+        d = connectProtocol(self.proxy.upstream, _ProxyEnd(self.proxy))
+        d.addCallbacks(self._upstream_connected,
+                lambda failure: self.transport.loseConnection())
+
+    def _upstream_connected(self, server):
+        if self.disconnected:
+            server.transport.loseConnection()
+            return
+
+        self.peer = server
+        server.peer = self
+        rng = random.Random(self.proxy.rng.random())
+        self.link = self.proxy.make_link(self.proxy.to_server, rng,
+                server, self)
+        server.link = self.proxy.make_link(self.proxy.to_client, rng,
+                self, server)
+        self.transport.resumeProducing()
+
+    def connectionLost(self, reason):
+        self.disconnected = True
+        _ProxyEnd.connectionLost(self, reason)
+
+
+class FaultProxy(protocol.ServerFactory):
+    '''A factory for proxied connections to upstream, an IStreamClientEndpoint.
+    to_server and to_client are the Faults to apply to data going in each
+    direction. Given a seed, the faults injected are reproducible as long
+    as connections are made in the same order.
+
+    Counts of connections, resets and bytes proxied are kept in the
+    attributes of those names.
+    '''
+
+    def __init__(self, reactor, upstream, to_server, to_client, seed=None):
+        self.reactor = reactor
+        self.upstream = upstream
+        self.to_server = to_server
+        self.to_client = to_client
+        self.rng = random.Random(seed)
+
+        self.connections = 0
+        self.resets = 0
+        self.bytes_proxied = 0
+
+    def buildProtocol(self, addr):
+        return _ClientSide(self)
+
+    def make_link(self, faults, rng, destination, source):
+        return FaultyLink(faults, self.reactor, rng,
+                destination.transport.write,
+                destination.transport.loseConnection,
+                source._reset)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Proxy that injects network faults between minesweeper clients and a server.')
+    parser.add_argument('--listen', default=4445, type=int, help='The port to listen on [default: 4445]')
+    parser.add_argument('--server', default='localhost', help='The server to connect to [default: localhost]')
+    parser.add_argument('--port', default=4444, type=int, help='The port to connect to [default: 4444]')
+    parser.add_argument('--latency', default=0.0, type=float, help='One-way latency, in milliseconds [default: 0]')
+    parser.add_argument('--jitter', default=0.0, type=float, help='Random variation in latency, in milliseconds [default: 0]')
+    parser.add_argument('--bandwidth', default=None, type=float, help='Bandwidth in each direction, in bytes/sec [default: unlimited]')
+    parser.add_argument('--max-chunk', default=None, type=int, help='Split data into random chunks of at most this many bytes [default: no splitting]')
+    parser.add_argument('--split-newlines', default=0.0, type=float, help='Probability of splitting each \\r\\n [default: 0]')
+    parser.add_argument('--reset-rate', default=0.0, type=float, help='Probability of resetting the connection per chunk [default: 0]')
+    parser.add_argument('--seed', default=None, type=int, help='Random seed, for reproducible runs')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.start_profiling(args)
+
+    from twisted.internet import reactor
+    from twisted.internet.endpoints import TCP4ServerEndpoint
+
+    faults = Faults(latency=args.latency / 1000.0,
+            jitter=args.jitter / 1000.0,
+            bandwidth=args.bandwidth,
+            max_chunk=args.max_chunk,
+            split_newlines=args.split_newlines,
+            reset_rate=args.reset_rate)
+    upstream = TCP4ClientEndpoint(reactor, args.server, args.port)
+    proxy = FaultProxy(reactor, upstream, faults, faults, args.seed)
+
+    TCP4ServerEndpoint(reactor, args.listen).listen(proxy)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+'''Machine-readable reports of load runs, and comparisons between them.
+
+A RunReport collects throughput, latency and error statistics from every
+connection in a run; give each connection's ConnectionStats the report
+(see connection_stats()). When the run is done, write() saves a JSON
+summary and a CSV time series.
+
+Two reports can be compared from the command line:
+
+    python -m gandyloo.report compare old.json new.json
+
+which exits with status 1 if the new run has a statistically significant
+throughput or latency regression.
+'''
+import csv
+import json
+import math
+import random
+import time
+
+from gandyloo import parse, stats
+
+# Version of the JSON report format.
+FORMAT_VERSION = 1
+
+PERCENTILES = (50, 90, 99)
+
+class RunReport(object):
+    '''Statistics about a load run.
+
+    Arguments:
+        config:      a JSON-compatible dict describing the run (server,
+                     number of connections, ...), saved with the report.
+        clock:       function returning the current time in seconds.
+        interval:    seconds per entry in the time series.
+        sample_size: how many latencies to keep per command, for
+                     percentiles and comparisons. Beyond that, a uniform
+                     random sample is kept.
+    '''
+
+    def __init__(self, config=None, clock=time.time, interval=1.0,
+            sample_size=10000, seed=0):
+        self.config = config or {}
+        self.clock = clock
+        self.interval = interval
+        self.sample_size = sample_size
+        self._rng = random.Random(seed)
+
+        self.started = clock()
+        self.finished = None
+
+        self.messages = 0
+        self.bytes_received = 0
+        self.commands = 0
+        # Connections retried after a delay (see gandyloo.scenario).
+        self.retries = 0
+        # Cause -> count.
+        self.errors = {}
+        # Scenario step name -> count of failed checks (see
+        # gandyloo.scenario).
+        self.step_failures = {}
+
+        # [messages, bytes, commands, errors] per interval.
+        self._series = []
+        # Command name -> [count, total seconds, max seconds, samples].
+        self._latencies = {}
+
+    def connection_stats(self, **kwargs):
+        '''Return a new ConnectionStats that records into this report.'''
+        return stats.ConnectionStats(clock=self.clock, report=self, **kwargs)
+
+    def _bucket(self):
+        index = int((self.clock() - self.started) / self.interval)
+        while len(self._series) <= index:
+            self._series.append([0, 0, 0, 0])
+        return self._series[index]
+
+    def data_received(self, nbytes):
+        self.bytes_received += nbytes
+        self._bucket()[1] += nbytes
+
+    def command_sent(self, command):
+        self.commands += 1
+        self._bucket()[2] += 1
+
+    def response_received(self, resp):
+        self.messages += 1
+        self._bucket()[0] += 1
+
+    def latency(self, command_name, seconds):
+        entry = self._latencies.get(command_name)
+        if entry is None:
+            entry = self._latencies[command_name] = [0, 0.0, 0.0, []]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+        # Reservoir sampling.
+        samples = entry[3]
+        if len(samples) < self.sample_size:
+            samples.append(seconds)
+        else:
+            i = self._rng.randrange(entry[0])
+            if i < self.sample_size:
+                samples[i] = seconds
+
+    def error(self, error):
+        if isinstance(error, parse.InvalidResponseError):
+            cause = error.cause
+        else:
+            cause = type(error).__name__
+        self.errors[cause] = self.errors.get(cause, 0) + 1
+        self._bucket()[3] += 1
+
+    def step_failed(self, step_name):
+        self.step_failures[step_name] = self.step_failures.get(step_name, 0) + 1
+
+    def retried(self):
+        self.retries += 1
+
+    def finish(self):
+        '''Mark the run as finished; otherwise it ends when reported.'''
+        self.finished = self.clock()
+
+    def to_dict(self):
+        finished = self.finished if self.finished is not None else self.clock()
+        duration = max(finished - self.started, 1e-9)
+
+        latency = {}
+        for name, (count, total, worst, samples) in self._latencies.items():
+            entry = {'count': count, 'mean': total / count, 'max': worst}
+            for p in PERCENTILES:
+                entry['p{}'.format(p)] = stats.percentile(samples, p)
+            entry['samples'] = samples
+            latency[name] = entry
+
+        return {
+            'format_version': FORMAT_VERSION,
+            'config': self.config,
+            'started': self.started,
+            'duration': duration,
+            'interval': self.interval,
+            'totals': {
+                'messages': self.messages,
+                'bytes_received': self.bytes_received,
+                'commands': self.commands,
+                'errors': sum(self.errors.values()),
+                'retries': self.retries,
+            },
+            'throughput': {
+                'messages_per_sec': self.messages / duration,
+                'bytes_received_per_sec': self.bytes_received / duration,
+                'commands_per_sec': self.commands / duration,
+            },
+            'timeseries': [{'t': i * self.interval, 'messages': m,
+                'bytes': b, 'commands': c, 'errors': e}
+                for i, (m, b, c, e) in enumerate(self._series)],
+            'latency': latency,
+            'errors': dict(self.errors),
+            'step_failures': dict(self.step_failures),
+        }
+
+    def write(self, json_path, csv_path=None):
+        '''Write the report as JSON to json_path, and its time series as
+        CSV to csv_path if given.'''
+        report = self.to_dict()
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        if csv_path is not None:
+            write_timeseries_csv(report, csv_path)
+        return report
+
+def write_timeseries_csv(report, path):
+    interval = report['interval']
+    with open(path, 'w') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['t', 'messages', 'bytes', 'commands', 'errors',
+            'messages_per_sec', 'bytes_per_sec'])
+        for row in report['timeseries']:
+            writer.writerow([row['t'], row['messages'], row['bytes'],
+                row['commands'], row['errors'],
+                row['messages'] / interval, row['bytes'] / interval])
+
+def load(path):
+    with open(path) as f:
+        report = json.load(f)
+    if report.get('format_version') != FORMAT_VERSION:
+        raise ValueError('Unsupported report format: ' + path)
+    return report
+
+
+# Statistics for comparing runs. Both tests use the normal approximation,
+# which is fine for the sample sizes load runs produce.
+
+def _p_value(z):
+    '''Two-sided p-value of a standard normal test statistic.'''
+    return math.erfc(abs(z) / math.sqrt(2))
+
+def welch_z(a, b):
+    '''Welch's t statistic for the difference in means of samples a and b
+    (positive if b's mean is larger).'''
+    na, nb = len(a), len(b)
+    if na < 2 or nb < 2:
+        return 0.0
+    mean_a, mean_b = float(sum(a)) / na, float(sum(b)) / nb
+    var_a = sum((x - mean_a) ** 2 for x in a) / (na - 1)
+    var_b = sum((x - mean_b) ** 2 for x in b) / (nb - 1)
+    se = math.sqrt(var_a / na + var_b / nb)
+    if se == 0:
+        return 0.0 if mean_a == mean_b else math.copysign(float('inf'),
+                mean_b - mean_a)
+    return (mean_b - mean_a) / se
+
+def mann_whitney_z(a, b):
+    '''Mann-Whitney U statistic, normalized, for samples a and b (positive
+    if b's values tend to be larger).'''
+    na, nb = len(a), len(b)
+    if not na or not nb:
+        return 0.0
+    pooled = sorted([(x, 0) for x in a] + [(x, 1) for x in b])
+
+    # Sum the ranks of b, averaging the ranks of ties.
+    rank_sum_b = 0.0
+    tie_term = 0.0
+    i = 0
+    while i < len(pooled):
+        j = i
+        while j < len(pooled) and pooled[j][0] == pooled[i][0]:
+            j += 1
+        rank = (i + j + 1) / 2.0
+        rank_sum_b += rank * sum(1 for k in range(i, j) if pooled[k][1])
+        ties = j - i
+        tie_term += ties ** 3 - ties
+        i = j
+
+    n = na + nb
+    u = rank_sum_b - nb * (nb + 1) / 2.0
+    mean = na * nb / 2.0
+    var = na * nb / 12.0 * ((n + 1) - tie_term / (n * (n - 1)))
+    if var <= 0:
+        return 0.0
+    return (u - mean) / math.sqrt(var)
+
+def compare(old, new, alpha=0.01, min_change=0.05):
+    '''Compare two reports (as returned by load()). Return a list of
+    findings, one per metric, as dicts with keys:
+        metric, old, new: the metric and its value in each report.
+        change:     relative change from old to new.
+        p_value:    probability of a difference this large by chance.
+        regression: True if new is worse by at least min_change, with
+                    p_value below alpha.
+    Throughput compares per-interval message counts; latency compares
+    each command's latency samples.
+    '''
+    findings = []
+
+    def finding(metric, old_value, new_value, z, worse):
+        change = ((new_value - old_value) / old_value if old_value
+                else 0.0)
+        p = _p_value(z)
+        findings.append({
+            'metric': metric,
+            'old': old_value,
+            'new': new_value,
+            'change': change,
+            'p_value': p,
+            'regression': (p < alpha and worse(change)
+                and abs(change) >= min_change),
+        })
+
+    old_rates = _rates(old)
+    new_rates = _rates(new)
+    finding('messages_per_sec', old['throughput']['messages_per_sec'],
+            new['throughput']['messages_per_sec'],
+            welch_z(old_rates, new_rates), lambda change: change < 0)
+
+    for name in sorted(set(old['latency']) & set(new['latency'])):
+        old_samples = old['latency'][name]['samples']
+        new_samples = new['latency'][name]['samples']
+        z = mann_whitney_z(old_samples, new_samples)
+        for p in PERCENTILES:
+            key = 'p{}'.format(p)
+            finding('latency.{}.{}'.format(name, key),
+                    old['latency'][name][key], new['latency'][name][key], z,
+                    lambda change: change > 0)
+
+    return findings
+
+def _rates(report):
+    '''Messages per second in each full interval of a report's time
+    series. The last interval is usually partial, so it is left out.'''
+    interval = report['interval']
+    series = report['timeseries'][:-1]
+    return [row['messages'] / interval for row in series]
+
+
+def main():
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='Work with gandyloo load run reports.')
+    subparsers = parser.add_subparsers(dest='action')
+    compare_parser = subparsers.add_parser('compare', help='Compare two reports, and exit with status 1 on a regression')
+    compare_parser.add_argument('old', help='The baseline report')
+    compare_parser.add_argument('new', help='The report to check')
+    compare_parser.add_argument('--alpha', default=0.01, type=float, help='Significance level [default: 0.01]')
+    compare_parser.add_argument('--min-change', default=0.05, type=float, help='Smallest relative change counted as a regression [default: 0.05]')
+    args = parser.parse_args()
+
+    if args.action != 'compare':
+        parser.error('an action is required')
+
+    findings = compare(load(args.old), load(args.new), args.alpha,
+            args.min_change)
+    for f in findings:
+        print('{:<28} {:>12.6g} {:>12.6g} {:>+8.1%}  p={:.4f}{}'.format(
+            f['metric'], f['old'], f['new'], f['change'], f['p_value'],
+            '  REGRESSION' if f['regression'] else ''))
+    sys.exit(1 if any(f['regression'] for f in findings) else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,553 @@
+'''Scenario-driven load tests.
+
+A scenario describes how one kind of player behaves: a list of weighted
+Steps (each sending a command, and optionally checking the response) and
+a think time to wait between steps. For example:
+
+    class Spectator(scenario.Scenario):
+        steps = [
+            scenario.Step('look', 9, scenario.look,
+                expect=message.BoardResp),
+            scenario.Step('help', 1, scenario.help, expect=message.HelpResp),
+        ]
+        think_time = scenario.exponential(2.0)
+
+A Population runs a mix of scenarios across many connections, recording
+everything in a gandyloo.report.RunReport. Failed checks are counted per
+step in the report's step_failures. From the command line:
+
+    python -m gandyloo.scenario --users 1000 --mix spectator=60,digger=40
+
+Scenarios can also come from your own modules, as module:Class=percent.
+'''
+import importlib
+import random
+from array import array
+from bisect import bisect_right
+
+from twisted.internet.defer import Deferred
+from twisted.internet.endpoints import connectProtocol
+
+from gandyloo import history, instrument, message, verify
+from gandyloo.connection import Backoff, MinesweeperClient
+from gandyloo.report import RunReport
+
+# Think time distributions: functions that, given a random.Random, return
+# a number of seconds.
+
+def constant(seconds):
+    return lambda rng: seconds
+
+def uniform(low, high):
+    return lambda rng: rng.uniform(low, high)
+
+def exponential(mean):
+    return lambda rng: rng.expovariate(1.0 / mean)
+
+# Commands for steps: functions that, given a VirtualUser, return the
+# command to send, or None to skip the step this time.
+
+_LOOK = message.LookCommand()
+_HELP = message.HelpCommand()
+
+# Tile value -> that value as a byte, to search tiles for.
+_TILE_BYTES = [history._to_bytes(array('B', [n])) for n in range(11)]
+
+def look(user):
+    return _LOOK
+
+def help(user):
+    return _HELP
+
+def dig_untouched(user):
+    target = user.random_tile(9)
+    return None if target is None else user.commands.dig(target)
+
+def flag_untouched(user):
+    target = user.random_tile(9)
+    return None if target is None else user.commands.flag(target)
+
+def deflag_flagged(user):
+    target = user.random_tile(10)
+    return None if target is None else user.commands.deflag(target)
+
+# Checks for steps: functions that, given a VirtualUser and the response
+# to the step's command, return False if the response is wrong.
+
+def board_size_matches(user, resp):
+    board = resp.board
+    return (board.width, board.height) == user.size
+
+
+class Step(object):
+    '''One thing a scenario's users do.
+
+    Arguments:
+        name:    identifies the step in reports.
+        weight:  how often the step is chosen, relative to the others.
+        command: a function of the user returning the Command to send (see
+                 look, dig_untouched, ...), or None to skip the step.
+        expect:  a Response class, or tuple of them, the response must be
+                 an instance of; or None to accept anything.
+        check:   a function of the user and the response returning False
+                 if the response is wrong, or None.
+    '''
+    __slots__ = ('name', 'weight', 'command', 'expect', 'check')
+
+    def __init__(self, name, weight, command, expect=None, check=None):
+        assert weight > 0
+        self.name = name
+        self.weight = weight
+        self.command = command
+        self.expect = expect
+        self.check = check
+
+    def accepts(self, user, resp):
+        if self.expect is not None and not isinstance(resp, self.expect):
+            return False
+        return self.check is None or self.check(user, resp) is not False
+
+class Scenario(object):
+    '''Subclass this, setting steps and think_time, to define a scenario.
+    think_time is a distribution (see constant, uniform and exponential)
+    of seconds to wait after each response before the next step.
+    '''
+    steps = []
+    think_time = constant(1.0)
+
+    @classmethod
+    def _cumulative_weights(cls):
+        # Computed once per class; choosing a step is then a bisection.
+        weights = cls.__dict__.get('_weights')
+        if weights is None:
+            weights = []
+            total = 0
+            for step in cls.steps:
+                total += step.weight
+                weights.append(total)
+            cls._weights = weights
+        return weights
+
+    @classmethod
+    def think(cls, rng):
+        '''Return the seconds to wait before the next step.'''
+        # Taken from the class __dict__, so that on Python 2 a plain
+        # function isn't turned into an unbound method.
+        for klass in cls.__mro__:
+            if 'think_time' in klass.__dict__:
+                return klass.__dict__['think_time'](rng)
+
+    @classmethod
+    def choose_step(cls, rng):
+        weights = cls._cumulative_weights()
+        return cls.steps[bisect_right(weights, rng.random() * weights[-1])]
+
+
+class Spectator(Scenario):
+    '''Mostly looks at the board.'''
+    steps = [
+        Step('look', 19, look, expect=message.BoardResp,
+            check=board_size_matches),
+        Step('help', 1, help, expect=message.HelpResp),
+    ]
+    think_time = exponential(1.0)
+
+class Digger(Scenario):
+    '''Digs as fast as it can.'''
+    steps = [
+        Step('dig', 9, dig_untouched,
+            expect=(message.BoardResp, message.BoomResp)),
+        Step('look', 1, look, expect=message.BoardResp),
+    ]
+    think_time = uniform(0.0, 0.1)
+
+class Flagger(Scenario):
+    '''Flags and deflags tiles.'''
+    steps = [
+        Step('flag', 1, flag_untouched, expect=message.BoardResp),
+        Step('deflag', 1, deflag_flagged, expect=message.BoardResp),
+    ]
+    think_time = uniform(0.1, 0.5)
+
+class HelpSpammer(Scenario):
+    '''Asks for help over and over.'''
+    steps = [
+        Step('help', 1, help, expect=message.HelpResp),
+    ]
+    think_time = constant(0.0)
+
+SCENARIOS = {
+    'spectator': Spectator,
+    'digger': Digger,
+    'flagger': Flagger,
+    'helper': HelpSpammer,
+}
+
+
+class VirtualUser(object):
+    '''One connection running a scenario; the event sink of its
+    MinesweeperClient.
+
+    Attributes:
+        size:     (width, height) of the board, once the HELLO arrives.
+        board:    the latest board received, or None.
+        commands: the message.CommandTable for the board.
+    '''
+
+    # How many random tiles random_tile() tries before scanning.
+    TRIES = 4
+    # Seconds added to the think time after a step is skipped for want of
+    # a tile to act on, doubling with each skip in a row up to MAX_IDLE;
+    # so users with nothing to do don't spin.
+    IDLE = 0.05
+    MAX_IDLE = 5.0
+
+    def __init__(self, population, scenario, rng, conn_id, backoff):
+        self.population = population
+        self.scenario = scenario
+        self.rng = rng
+        self.conn_id = conn_id
+        # Delays before reconnecting, kept from one connection to the
+        # next; see Population.
+        self.backoff = backoff
+        self.client = MinesweeperClient(self,
+                population.report.connection_stats())
+        # Command and response receivers from the population's watchers.
+        self.watching = [watcher.connection(conn_id)
+                for watcher in population.watchers]
+
+        self.size = None
+        self.board = None
+        self.commands = None
+        self.state = 'wait'
+
+        self._step = None
+        self._next = None
+        self._skips = 0
+        # (tiles, their bytes) for the last board random_tile() scanned.
+        self._scanned = (None, None)
+        self.closed = False
+
+    def random_tile(self, tile):
+        '''Return the coordinates of a random tile with the value tile (as
+        in board.Board._tiles), or None if there are none. Before the
+        first board, returns any tile.'''
+        width, height = self.size
+        if self.board is None:
+            return (self.rng.randrange(width), self.rng.randrange(height))
+        tiles = self.board._tiles
+        count = width * height
+        for _ in range(self.TRIES):
+            i = self.rng.randrange(count)
+            if tiles[i] == tile:
+                return (i % width, i // width)
+
+        # The tile is rare: scan for one, at C speed, from a random place.
+        # Unchanged boards share their tiles, so this mostly reuses the
+        # last scan's bytes.
+        scanned, data = self._scanned
+        if scanned is not tiles:
+            data = history._to_bytes(tiles)
+            self._scanned = (tiles, data)
+        needle = _TILE_BYTES[tile]
+        start = self.rng.randrange(count)
+        i = data.find(needle, start)
+        if i < 0:
+            i = data.find(needle, 0, start)
+        if i < 0:
+            return None
+        return (i % width, i // width)
+
+    def response(self, resp):
+        for watching in self.watching:
+            watching.response(resp)
+        t = type(resp)
+        if t == message.HelloResp:
+            self.size = resp.size
+            self.commands = message.command_table(resp.size)
+            self.backoff.reset()
+            if not self.population.running:
+                # Connected after the population was stopped.
+                self.disconnect()
+                return
+            self._think()
+            return
+        if t == message.CloseResp:
+            self.closed = True
+            self.cancel()
+            self.population._user_closed(self)
+            return
+
+        if t == message.BoardResp:
+            self.board = resp.board
+            self.state = 'board'
+        elif t == message.BoomResp:
+            self.state = 'boom'
+
+        step = self._step
+        if step is not None:
+            self._step = None
+            if not step.accepts(self, resp):
+                self.population.report.step_failed(step.name)
+            self._think()
+
+    def _think(self):
+        if self.population.running:
+            delay = self.scenario.think(self.rng)
+            if self._skips:
+                delay += min(self.IDLE * 2 ** min(self._skips, 16),
+                        self.MAX_IDLE)
+            self._next = self.population.clock.callLater(delay,
+                    self._run_step)
+
+    @instrument.timed('scenario.step')
+    def _run_step(self):
+        self._next = None
+        step = self.scenario.choose_step(self.rng)
+        command = step.command(self)
+        if command is None:
+            self._skips += 1
+            self._think()
+            return
+        self._skips = 0
+        self._step = step
+        self.client.command(command)
+        for watching in self.watching:
+            watching.command(command)
+
+    def cancel(self):
+        '''Stop taking steps.'''
+        if self._next is not None:
+            self._next.cancel()
+            self._next = None
+
+    def disconnect(self):
+        self.cancel()
+        if self.client.transport is not None and not self.closed:
+            self.client.command(message.ByeCommand())
+            self.client.transport.loseConnection()
+
+
+def assign(mix, users):
+    '''Given mix, a list of (scenario, percentage) pairs, return a list of
+    users scenarios with the scenarios in those proportions, interleaved.'''
+    total = float(sum(percentage for scenario, percentage in mix))
+    result = []
+    counts = [0] * len(mix)
+    for n in range(users):
+        # Pick the scenario furthest behind its share.
+        behind = [(n + 1) * percentage / total - counts[i]
+                for i, (scenario, percentage) in enumerate(mix)]
+        i = behind.index(max(behind))
+        counts[i] += 1
+        result.append(mix[i][0])
+    return result
+
+class Population(object):
+    '''Runs users virtual users on endpoint (an IStreamClientEndpoint),
+    with scenarios mixed as given by mix, a list of (Scenario subclass,
+    percentage) pairs. Users are started evenly over ramp seconds. If
+    respawn is True, users whose connections close are replaced.
+
+    watchers are objects with a connection(conn_id) method returning a
+    command and response receiver, such as a verify.Recorder or a
+    monitor.Monitor; every user's commands and responses are passed to
+    them. Connection ids count up from 0.
+
+    A user whose connection closes after its HELLO is replaced at once.
+    One whose connection closes before the HELLO (as when the server is
+    restarting) is replaced after a delay that grows exponentially, from
+    retry_delay up to max_retry_delay seconds, until a HELLO arrives
+    again (see connection.Backoff). Connections that can't be made are
+    retried the same way, even if respawn is False, so every user keeps
+    trying until stop().
+
+    Attributes:
+        users:  the VirtualUsers currently connected or connecting.
+        report: the RunReport everything is recorded in.
+    '''
+
+    def __init__(self, clock, endpoint, mix, users, ramp=0.0, respawn=True,
+            seed=None, report=None, watchers=(), retry_delay=0.5,
+            max_retry_delay=30.0):
+        self.clock = clock
+        self.endpoint = endpoint
+        self.mix = mix
+        self.respawn = respawn
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.watchers = list(watchers)
+        self.rng = random.Random(seed)
+        self.report = report or RunReport({
+            'mode': 'scenario',
+            'users': users,
+            'mix': dict((scenario.__name__, percentage)
+                for scenario, percentage in mix),
+            'ramp': ramp,
+        }, clock=clock.seconds)
+
+        self._scenarios = assign(mix, users)
+        self._ramp = ramp
+        self.users = set()
+        self.running = False
+        # Calls to _start_user that are waiting to happen.
+        self._starting = set()
+        self._done = None
+        self._next_id = 0
+
+    def start(self):
+        self.running = True
+        count = len(self._scenarios)
+        for n, scenario in enumerate(self._scenarios):
+            backoff = Backoff(self.retry_delay, self.max_retry_delay,
+                    random.Random(self.rng.random()))
+            self._start_later(self._ramp * n / count, scenario, backoff)
+
+    def run(self, duration):
+        '''Start, and stop after duration seconds. Returns a Deferred that
+        fires with the report once every user has disconnected.'''
+        self.start()
+        self._done = Deferred()
+        self.clock.callLater(duration, self.stop)
+        return self._done
+
+    def _start_later(self, delay, scenario, backoff):
+        def start():
+            self._starting.discard(call)
+            self._start_user(scenario, backoff)
+        call = self.clock.callLater(delay, start)
+        self._starting.add(call)
+
+    def _start_user(self, scenario, backoff):
+        if not self.running:
+            return
+        user = VirtualUser(self, scenario, random.Random(self.rng.random()),
+                self._next_id, backoff)
+        self._next_id += 1
+        self.users.add(user)
+        d = connectProtocol(self.endpoint, user.client)
+        d.addErrback(self._connect_failed, user)
+
+    def _connect_failed(self, failure, user):
+        self.report.error(failure.value)
+        for watching in user.watching:
+            watching.response(message.CloseResp(failure))
+        self.users.discard(user)
+        if self.running:
+            # The user never got going, so this isn't a respawn: keep
+            # trying until stopped.
+            self.report.retried()
+            self._start_later(user.backoff.next_delay(), user.scenario,
+                    user.backoff)
+        self._check_done()
+
+    def _user_closed(self, user):
+        self.users.discard(user)
+        if self.running and self.respawn:
+            if user.size is None:
+                # Closed before the HELLO; don't hammer the server.
+                self.report.retried()
+                self._start_later(user.backoff.next_delay(), user.scenario,
+                        user.backoff)
+            else:
+                self._start_user(user.scenario, user.backoff)
+        self._check_done()
+
+    def stop(self):
+        '''Stop all users, disconnecting them.'''
+        self.running = False
+        for call in self._starting:
+            call.cancel()
+        self._starting = set()
+        for user in list(self.users):
+            user.disconnect()
+        self._check_done()
+
+    def _check_done(self):
+        if not self.running and not self.users and self._done is not None:
+            self.report.finish()
+            done, self._done = self._done, None
+            done.callback(self.report)
+
+
+def parse_mix(text):
+    '''Parse a mix like "spectator=60,digger=40" (or "module:Class=40")
+    into a list of (Scenario subclass, percentage) pairs.'''
+    mix = []
+    for item in text.split(','):
+        name, _, percentage = item.partition('=')
+        if ':' in name:
+            module, _, attr = name.partition(':')
+            scenario = getattr(importlib.import_module(module), attr)
+        else:
+            scenario = SCENARIOS[name]
+        mix.append((scenario, float(percentage or 1)))
+    return mix
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a scenario load test against a minesweeper server.')
+    parser.add_argument('--server', default='localhost', help='The server to connect to [default: localhost]')
+    parser.add_argument('--port', default=4444, type=int, help='The port to connect to [default: 4444]')
+    parser.add_argument('--users', default=100, type=int, help='Number of virtual users [default: 100]')
+    parser.add_argument('--mix', default='spectator=50,digger=30,flagger=15,helper=5',
+            help='Scenarios and their percentages, as name=percent,...; names are {} or module:Class [default: spectator=50,digger=30,flagger=15,helper=5]'.format(', '.join(sorted(SCENARIOS))))
+    parser.add_argument('--duration', default=30.0, type=float, help='Seconds to run for [default: 30]')
+    parser.add_argument('--ramp', default=5.0, type=float, help='Seconds over which to start users [default: 5]')
+    parser.add_argument('--no-respawn', action='store_true', help="Don't replace users whose connections close")
+    parser.add_argument('--seed', default=None, type=int, help='Random seed, for reproducible runs')
+    parser.add_argument('--report', default=None, help='Write a JSON report to this file')
+    parser.add_argument('--csv', default=None, help='Write a CSV time series to this file')
+    parser.add_argument('--verify', action='store_true', help='Check, as the run goes, that every user sees a consistent board (see gandyloo.verify)')
+    parser.add_argument('--log', default=None, help='Record every command and response to this file, for checking later with gandyloo.verify')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.start_profiling(args)
+
+    from twisted.internet import reactor
+    from twisted.internet.endpoints import TCP4ClientEndpoint
+
+    endpoint = TCP4ClientEndpoint(reactor, args.server, args.port)
+    handlers = []
+    checker = log = None
+    if args.verify:
+        checker = verify.ConsistencyChecker()
+        handlers.append(checker.feed)
+    if args.log:
+        log = open(args.log, 'w')
+        handlers.append(verify.LogWriter(log))
+    watchers = [verify.Recorder(handlers, reactor.seconds)] if handlers else []
+    population = Population(reactor, endpoint, parse_mix(args.mix),
+            args.users, args.ramp, not args.no_respawn, args.seed,
+            watchers=watchers)
+
+    def finished(report):
+        summary = report.to_dict()
+        print('{:.1f} messages/sec, {:.1f} commands/sec, {} errors'.format(
+            summary['throughput']['messages_per_sec'],
+            summary['throughput']['commands_per_sec'],
+            summary['totals']['errors']))
+        for name, entry in sorted(summary['latency'].items()):
+            print('{:<8} p50 {:8.2f} ms  p99 {:8.2f} ms'.format(name,
+                entry['p50'] * 1000, entry['p99'] * 1000))
+        for name, count in sorted(summary['step_failures'].items()):
+            print('{} failed checks in step {}'.format(count, name))
+        if checker is not None:
+            for v in checker.violations:
+                print('{t:.6f} conn {conn}: {kind} at {tile}: {detail}'.format(
+                    **v))
+            print('{} boards checked, {} violations'.format(
+                checker.boards_checked, checker.violation_count))
+        if log is not None:
+            log.close()
+        if args.report:
+            report.write(args.report, args.csv)
+        reactor.stop()
+
+    reactor.callWhenRunning(
+            lambda: population.run(args.duration).addCallback(finished))
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import math
+import time
+from collections import deque
+
+from gandyloo import message
+
+def percentile(values, p):
+    '''Return the p-th percentile (0 <= p <= 100) of a nonempty sequence,
+    using the nearest-rank method: the smallest value that at least p
+    percent of the values are less than or equal to.'''
+    assert values
+    ordered = sorted(values)
+    rank = int(math.ceil(p * len(ordered) / 100.0))
+    return ordered[max(rank - 1, 0)]
+
+class ConnectionStats(object):
+    '''Running statistics about a single connection to a server, cheap
+    enough to keep permanently.
+    Pass one to MinesweeperClient, which calls data_received,
+    command_sent, response_received and connection_lost; the same
+    ConnectionStats can be kept across reconnects (e.g. by a
+    MinesweeperClientFactory). Call render_time yourself if
+    you're drawing boards. sample() summarizes the statistics since the
+    last time it was called.
+
+    Round-trip times are measured from sending a command to receiving a
+    response, relying on the server answering commands in order.
+    '''
+
+    def __init__(self, clock=time.time, window=1000, report=None):
+        '''Arguments:
+            clock:  function returning the current time in seconds.
+            window: how many recent round-trip times to keep for
+                    computing percentiles.
+            report: a gandyloo.report.RunReport to also record everything
+                    in, or None.
+        '''
+        self.clock = clock
+        self.report = report
+
+        # Totals over the life of the connection.
+        self.messages = 0
+        self.bytes = 0
+
+        # Most recent measurements, in seconds; None if there are none.
+        self.last_rtt = None
+        self.last_parse_time = None
+        self.last_render_time = None
+
+        # Bytes received but not yet parsed into a message.
+        self.buffered = 0
+
+        self.rtts = deque(maxlen=window)
+
+        # (send time, command) of commands that haven't been answered yet.
+        self._pending = deque()
+
+        self._last_sample = (clock(), 0, 0)
+
+    def data_received(self, nbytes):
+        self.bytes += nbytes
+        if self.report is not None:
+            self.report.data_received(nbytes)
+
+    def command_sent(self, command):
+        if self.report is not None:
+            self.report.command_sent(command)
+        # The server hangs up on bye rather than answering it.
+        if not isinstance(command, message.ByeCommand):
+            self._pending.append((self.clock(), command))
+
+    def response_received(self, resp, parse_time):
+        '''Record a response, which took parse_time seconds to parse.'''
+        self.messages += 1
+        if isinstance(resp, message.BoardResp):
+            self.last_parse_time = parse_time
+        if self.report is not None:
+            self.report.response_received(resp)
+        if self._pending and not isinstance(resp, message.HelloResp):
+            sent, command = self._pending.popleft()
+            self.last_rtt = self.clock() - sent
+            self.rtts.append(self.last_rtt)
+            if self.report is not None:
+                self.report.latency(command.name, self.last_rtt)
+
+    def connection_lost(self):
+        '''Forget the commands sent on a connection that has closed; they
+        will never be answered.'''
+        self._pending.clear()
+        self.buffered = 0
+
+    def parse_error(self, error):
+        '''Record an exception raised while parsing a response.'''
+        if self.report is not None:
+            self.report.error(error)
+
+    def render_time(self, seconds):
+        self.last_render_time = seconds
+
+    def sample(self):
+        '''Return a dict summarizing the connection:
+            messages_per_sec, bytes_per_sec: rates since the last sample.
+            last_rtt, p99_rtt: round-trip times, in seconds.
+            parse_time: time to parse the last board, in seconds.
+            render_time: time to render the last frame, in seconds.
+            buffered: bytes received but not yet parsed.
+        Times are None if nothing has been measured yet.
+        '''
+        now = self.clock()
+        then, messages, nbytes = self._last_sample
+        elapsed = max(now - then, 1e-9)
+        self._last_sample = (now, self.messages, self.bytes)
+
+        return {
+            'messages_per_sec': (self.messages - messages) / elapsed,
+            'bytes_per_sec': (self.bytes - nbytes) / elapsed,
+            'last_rtt': self.last_rtt,
+            'p99_rtt': percentile(self.rtts, 99) if self.rtts else None,
+            'parse_time': self.last_parse_time,
+            'render_time': self.last_render_time,
+            'buffered': self.buffered,
+        }
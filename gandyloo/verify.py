@@ -0,0 +1,321 @@
+'''Checking that a server stays consistent with many players on one board.
+
+A Recorder turns the commands and responses of any number of connections
+into a stream of timestamped events (plain dicts). Events can be written
+to a log with LogWriter and checked later with check_log, or fed straight
+to a ConsistencyChecker as they happen. Either way the checker works in
+one pass, with memory proportional to the board size and number of
+connections rather than the length of the run.
+
+For example, to check a multiplayer run as it goes:
+
+    checker = verify.ConsistencyChecker()
+    recorder = verify.Recorder([checker.feed])
+    for n, relay in enumerate(relays):
+        connection = recorder.connection(n)
+        relay.add_command_receiver(connection)
+        relay.add_response_receiver(connection)
+'''
+import binascii
+import json
+import time
+from collections import deque
+
+from gandyloo import board, history, message
+
+class Recorder(object):
+    '''Records commands and responses as events, and passes each event to
+    every function in handlers.
+
+    Events are dicts with these keys:
+        t:    the time of the event, from clock.
+        conn: the id of the connection the event happened on.
+        type: 'command', 'hello', 'board', 'boom' or 'help'.
+    'command' events also have 'command' (e.g. 'dig') and, for commands on
+    a tile, 'target' ([x, y]). 'hello' events have 'size' ([width,
+    height]); 'board' events have 'tiles', an array of the board's tiles
+    (see board.Board._tiles).
+    '''
+
+    def __init__(self, handlers, clock=time.time):
+        self.handlers = handlers
+        self.clock = clock
+
+    def connection(self, conn_id):
+        '''Return an object to add as both a command and response receiver
+        of the relay for connection conn_id.'''
+        return _ConnectionRecorder(self, conn_id)
+
+    def record(self, event):
+        for handler in self.handlers:
+            handler(event)
+
+class _ConnectionRecorder(object):
+    def __init__(self, recorder, conn_id):
+        self.recorder = recorder
+        self.conn_id = conn_id
+
+    def _event(self, kind, **fields):
+        fields['t'] = self.recorder.clock()
+        fields['conn'] = self.conn_id
+        fields['type'] = kind
+        self.recorder.record(fields)
+
+    def command(self, command):
+        if hasattr(command, 'target'):
+            self._event('command', command=command.name,
+                    target=list(command.target))
+        else:
+            self._event('command', command=command.name)
+
+    def response(self, resp):
+        t = type(resp)
+        if t == message.BoardResp:
+            self._event('board', tiles=resp.board._tiles)
+        elif t == message.HelloResp:
+            self._event('hello', size=list(resp.size))
+        elif t == message.BoomResp:
+            self._event('boom')
+        elif t == message.HelpResp:
+            self._event('help')
+
+
+class LogWriter(object):
+    '''Writes events to the text file f, one JSON object per line. Boards
+    are stored packed (see history.pack), in hex.'''
+
+    def __init__(self, f):
+        self.f = f
+        self._sizes = {}
+
+    def __call__(self, event):
+        if event['type'] == 'hello':
+            self._sizes[event['conn']] = event['size']
+        if event['type'] == 'board':
+            width, height = self._sizes[event['conn']]
+            packed = history.pack(board.Board._from_tiles(width, height,
+                event['tiles']))
+            event = dict(event, tiles=binascii.hexlify(
+                history._to_bytes(packed)).decode('ascii'))
+        self.f.write(json.dumps(event) + '\n')
+
+def read_log(f):
+    '''Generate the events in a log written by LogWriter.'''
+    sizes = {}
+    for line in f:
+        event = json.loads(line)
+        if event['type'] == 'hello':
+            sizes[event['conn']] = event['size']
+        elif event['type'] == 'board':
+            width, height = sizes[event['conn']]
+            packed = history._from_bytes('B',
+                    binascii.unhexlify(event['tiles'].encode('ascii')))
+            event['tiles'] = history.unpack(packed, width, height)._tiles
+        yield event
+
+def check_log(f, max_violations=100):
+    '''Check the log in the text file f; return the ConsistencyChecker.'''
+    checker = ConsistencyChecker(max_violations)
+    for event in read_log(f):
+        checker.feed(event)
+    return checker
+
+
+class ConsistencyChecker(object):
+    '''Checks, one event at a time, that every connection's boards could
+    have come from a single server board that all players' commands were
+    applied to in some order. Events must be fed in the order they
+    happened.
+
+    Violations found are recorded as dicts with keys 't', 'conn', 'kind',
+    'tile' ((x, y)) and 'detail'. Only the first max_violations are kept;
+    violation_count counts them all. The kinds are:
+        'reverted':    a dug tile became untouched or flagged.
+        'changed':     a dug tile's number changed (other than going down
+                       after a BOOM, when the server removes a mine).
+        'disagree':    two connections saw different numbers on a tile.
+        'lost update': a board was missing a dug tile that had already
+                       been seen dug before the board was asked for.
+        'unexplained': a tile was dug or flagged without anyone having
+                       dug or flagged it (or a neighboring 0 being dug).
+    '''
+
+    # A _known entry meaning no connection has seen the tile dug.
+    UNKNOWN = 255
+
+    def __init__(self, max_violations=100):
+        self.max_violations = max_violations
+        self.violations = []
+        self.violation_count = 0
+        self.boards_checked = 0
+
+        self.size = None
+        # The number last seen on each dug tile, by any connection.
+        self._known = None
+        # (time, index) of each tile, in the order they were first seen
+        # dug. Each connection has a position in this list, up to which
+        # its boards must all have the tiles dug.
+        self._first_dug = []
+        # Tiles anyone has sent dig and flag commands for.
+        self._dug = set()
+        self._flagged = set()
+        self._booms = 0
+
+        # Per connection: the last board's tiles, the number of BOOMs
+        # seen when it was received, the send times of unanswered
+        # commands and the position in _first_dug.
+        self._last = {}
+        self._booms_at = {}
+        self._pending = {}
+        self._checked_dug = {}
+
+    @property
+    def ok(self):
+        return self.violation_count == 0
+
+    def feed(self, event):
+        kind = event['type']
+        conn = event['conn']
+        if kind == 'command':
+            self._command(event)
+        elif kind == 'hello':
+            self._hello(event)
+        elif kind == 'board':
+            self._board(event)
+        else:
+            # BOOM and HELP answer a command too.
+            pending = self._pending.get(conn)
+            if pending:
+                pending.popleft()
+            if kind == 'boom':
+                self._booms += 1
+
+    def _hello(self, event):
+        size = tuple(event['size'])
+        if self.size is None:
+            self.size = size
+            width, height = size
+            self._known = bytearray([self.UNKNOWN]) * (width*height)
+        elif size != self.size:
+            self._violation(event, 'disagree', None,
+                    'HELLO size {} differs from {}'.format(size, self.size))
+        self._pending.setdefault(event['conn'], deque())
+
+    def _command(self, event):
+        conn = event['conn']
+        command = event['command']
+        if command != 'bye':
+            self._pending.setdefault(conn, deque()).append(event['t'])
+
+        if 'target' in event and self.size is not None:
+            x, y = event['target']
+            width, height = self.size
+            if 0 <= x < width and 0 <= y < height:
+                if command == 'dig':
+                    self._dug.add(x + y*width)
+                elif command == 'flag':
+                    self._flagged.add(x + y*width)
+
+    def _board(self, event):
+        conn = event['conn']
+        tiles = event['tiles']
+        width, height = self.size
+        self.boards_checked += 1
+
+        pending = self._pending.setdefault(conn, deque())
+        asked_at = pending.popleft() if pending else event['t']
+
+        last = self._last.get(conn)
+        if last is None:
+            last = board.Board(width, height)._tiles
+        for i in history.diff_tiles(last, tiles):
+            self._check_change(event, tiles, i, last[i], tiles[i])
+
+        # Everything seen dug before this board was asked for must be on
+        # it. Tiles that were checked on earlier boards can't have been
+        # undug since without a 'reverted' violation.
+        position = self._checked_dug.get(conn, 0)
+        first_dug = self._first_dug
+        while position < len(first_dug) and first_dug[position][0] < asked_at:
+            i = first_dug[position][1]
+            if tiles[i] > 8:
+                self._violation(event, 'lost update', i,
+                        'tile was dug at {}'.format(first_dug[position][0]))
+            position += 1
+        self._checked_dug[conn] = position
+
+        self._last[conn] = tiles
+        self._booms_at[conn] = self._booms
+
+    def _check_change(self, event, tiles, i, old, new):
+        conn = event['conn']
+        if old <= 8:
+            if new > 8:
+                self._violation(event, 'reverted', i,
+                        '{} became {}'.format(old, new))
+            elif not self._boom_decrease(conn, old, new):
+                self._violation(event, 'changed', i,
+                        '{} became {}'.format(old, new))
+        elif new == 10:
+            if i not in self._flagged:
+                self._violation(event, 'unexplained', i, 'nobody flagged it')
+        elif new <= 8 and i not in self._dug and not self._near_zero(tiles, i):
+            self._violation(event, 'unexplained', i, 'nobody dug it')
+
+        # Compare newly dug tiles with what other connections saw; changes
+        # to tiles already dug were checked above.
+        if new <= 8:
+            known = self._known[i]
+            if known == self.UNKNOWN:
+                self._first_dug.append((event['t'], i))
+            elif (old > 8 and known != new
+                    and not self._boom_decrease(conn, known, new)):
+                self._violation(event, 'disagree', i,
+                        'seen as {} elsewhere'.format(known))
+            self._known[i] = new
+
+    def _boom_decrease(self, conn, old, new):
+        '''Whether a number going from old to new can be explained by a
+        mine being removed by a BOOM since conn's last board.'''
+        return new < old and self._booms > self._booms_at.get(conn, 0)
+
+    def _near_zero(self, tiles, i):
+        '''Whether tile i is next to a dug 0, so could have been dug by
+        the server clearing around it.'''
+        width, height = self.size
+        x, y = i % width, i // width
+        for ny in range(max(0, y-1), min(height, y+2)):
+            for nx in range(max(0, x-1), min(width, x+2)):
+                if tiles[nx + ny*width] == 0:
+                    return True
+        return False
+
+    def _violation(self, event, kind, i, detail):
+        self.violation_count += 1
+        if len(self.violations) < self.max_violations:
+            tile = None
+            if i is not None:
+                tile = (i % self.size[0], i // self.size[0])
+            self.violations.append({'t': event['t'], 'conn': event['conn'],
+                'kind': kind, 'tile': tile, 'detail': detail})
+
+
+def main():
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='Check a recorded multiplayer log for inconsistent server behavior.')
+    parser.add_argument('log', help='The log file, as written by verify.LogWriter')
+    parser.add_argument('--max-violations', default=100, type=int, help='How many violations to report [default: 100]')
+    args = parser.parse_args()
+
+    with open(args.log) as f:
+        checker = check_log(f, args.max_violations)
+
+    for v in checker.violations:
+        print('{t:.6f} conn {conn}: {kind} at {tile}: {detail}'.format(**v))
+    print('{} boards checked, {} violations'.format(checker.boards_checked,
+        checker.violation_count))
+    sys.exit(0 if checker.ok else 1)
+
+if __name__ == '__main__':
+    main()
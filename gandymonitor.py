@@ -0,0 +1,191 @@
+#!/usr/bin/env python2
+'''Watch a scenario load test: a grid of thumbnails, one per connection.'''
+import urwid
+
+from gandyloo import monitor, scenario, instrument
+
+# The characters and colors thumbnail cells are drawn with, indexed by
+# board.thumbnail() value: untouched, partly dug (three levels), dug,
+# flagged.
+THUMB_CHARS = '-.:+ F'
+
+class Palette:
+    '''Colors available to use.
+    GRAY is for connections waiting for a board, and for closed ones.
+    BOOM is for connections that have just had a BOOM.
+    CAPTION is for the captions of connections with a board.
+    UNTOUCHED, PARTIAL, DUG and FLAGGED are for thumbnail cells.
+    '''
+    GRAY = 'gray'
+    BOOM = 'boom'
+    CAPTION = 'caption'
+    UNTOUCHED = 'untouched'
+    PARTIAL = 'partial'
+    DUG = 'dug'
+    FLAGGED = 'flagged'
+
+PALETTE = [
+        (Palette.GRAY, 'light gray', 'dark gray'),
+        (Palette.BOOM, 'black,bold', 'dark red'),
+        (Palette.CAPTION, 'white,bold', ''),
+        (Palette.UNTOUCHED, 'dark gray', 'white'),
+        (Palette.PARTIAL, 'dark blue', 'light gray'),
+        (Palette.DUG, 'black', ''),
+        (Palette.FLAGGED, 'dark red,bold', 'white'),
+]
+
+THUMB_ATTRS = [Palette.UNTOUCHED, Palette.PARTIAL, Palette.PARTIAL,
+        Palette.PARTIAL, Palette.DUG, Palette.FLAGGED]
+
+CAPTION_ATTRS = {
+    'wait': Palette.GRAY,
+    'board': Palette.CAPTION,
+    'boom': Palette.BOOM,
+    'closed': Palette.GRAY,
+}
+
+def runs(attrs):
+    '''Run-length encode a list of attributes, as urwid canvases want.'''
+    result = []
+    for attr in attrs:
+        if result and result[-1][0] == attr:
+            result[-1] = (attr, result[-1][1] + 1)
+        else:
+            result.append((attr, 1))
+    return result
+
+class MonitorGrid(urwid.Widget):
+    '''Shows the tails of a gandyloo.monitor.Monitor as a grid of
+    thumbnails, each thumb_size (columns, rows) with a caption line above.
+    As many tails are shown as fit, oldest first. Only tails whose boards
+    changed since the last render have their thumbnails recomputed; call
+    _invalidate() to have it redrawn.
+    '''
+    _sizing = frozenset({'box'})
+    _selectable = False
+
+    def __init__(self, monitor, thumb_size):
+        self.monitor = monitor
+        self.thumb_size = thumb_size
+        # How many tails the last render showed.
+        self.shown = 0
+
+    @instrument.timed('monitor.render')
+    def render(self, size, focus=False):
+        cols, rows = size
+        tw, th = self.thumb_size
+        across = max(cols // (tw + 1), 1)
+        down = max(rows // (th + 1), 1)
+        tails = list(self.monitor.tails.values())[:across * down]
+        self.shown = len(tails)
+
+        result_strings = []
+        result_attrs = []
+        for start in range(0, len(tails), across):
+            line_strings = [''] * (th + 1)
+            line_attrs = [[] for _ in range(th + 1)]
+            for tail in tails[start:start + across]:
+                caption = str(tail.conn_id)[:tw].ljust(tw) + ' '
+                line_strings[0] += caption
+                line_attrs[0] += [CAPTION_ATTRS[tail.state]] * tw + [None]
+
+                thumb = tail.thumbnail(tw, th)
+                for y in range(th):
+                    if thumb is None:
+                        line_strings[y + 1] += '#' * tw + ' '
+                        line_attrs[y + 1] += [Palette.GRAY] * tw + [None]
+                        continue
+                    row = thumb[y * tw:(y + 1) * tw]
+                    line_strings[y + 1] += ''.join(
+                            [THUMB_CHARS[v] for v in row]) + ' '
+                    if tail.state == 'boom':
+                        line_attrs[y + 1] += [Palette.BOOM] * tw + [None]
+                    else:
+                        line_attrs[y + 1] += ([THUMB_ATTRS[v] for v in row]
+                                + [None])
+            result_strings += line_strings
+            result_attrs += line_attrs
+
+        result_strings = [s[:cols].ljust(cols) for s in result_strings[:rows]]
+        result_attrs = [runs((a + [None] * cols)[:cols])
+                for a in result_attrs[:rows]]
+        while len(result_strings) < rows:
+            result_strings.append(' ' * cols)
+            result_attrs.append([(None, cols)])
+
+        return urwid.TextCanvas(result_strings, result_attrs, maxcol=cols,
+                check_width=True)
+
+def status_line(monitor, grid):
+    counts = monitor.counts()
+    return u'{} connections: {} board, {} BOOM, {} waiting, {} closed; showing {}'.format(
+            len(monitor.tails), counts.get('board', 0),
+            counts.get('boom', 0), counts.get('wait', 0),
+            counts.get('closed', 0), grid.shown)
+
+def handle_exit(key):
+    if type(key) == str:
+        if key.lower() in ('q', 'ctrl c', 'ctrl d'):
+            raise urwid.ExitMainLoop()
+
+# Final setup
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a scenario load test against a 6.005 minesweeper server, and watch its connections.")
+    parser.add_argument('--server', default='localhost', help='The server to connect to [default: localhost]')
+    parser.add_argument('--port', default='4444', type=int, help='The port to connect to [default: 4444]')
+    parser.add_argument('--loopback', default=None, metavar='WxH', help="Instead of connecting to a server, run an in-process one with a board this size")
+    parser.add_argument('--users', default=50, type=int, help='Number of virtual users [default: 50]')
+    parser.add_argument('--mix', default='spectator=50,digger=30,flagger=20', help='Scenarios and their percentages, as for gandyloo.scenario [default: spectator=50,digger=30,flagger=20]')
+    parser.add_argument('--ramp', default=5.0, type=float, help='Seconds over which to start users [default: 5]')
+    parser.add_argument('--seed', default=None, type=int, help='Random seed')
+    parser.add_argument('--fps', default=2.0, type=float, help='Screen updates per second [default: 2]')
+    parser.add_argument('--thumbnail', default='16x6', metavar='WxH', help='Thumbnail size in characters [default: 16x6]')
+    parser.add_argument('--keep-closed', default=20, type=int, help='Closed connections to keep showing [default: 20]')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.start_profiling(args)
+
+    from twisted.internet import reactor
+
+    if args.loopback:
+        from gandyloo import loopback
+        width, height = (int(n) for n in args.loopback.split('x'))
+        endpoint = loopback.LoopbackEndpoint(reactor,
+                loopback.MinesweeperServerFactory(
+                    loopback.Game(width, height, seed=args.seed or 0)),
+                latency=0.001)
+    else:
+        from twisted.internet.endpoints import TCP4ClientEndpoint
+        endpoint = TCP4ClientEndpoint(reactor, args.server, args.port)
+
+    mon = monitor.Monitor(keep_closed=args.keep_closed)
+    population = scenario.Population(reactor, endpoint,
+            scenario.parse_mix(args.mix), args.users, args.ramp,
+            seed=args.seed, watchers=[mon])
+
+    thumb_size = tuple(int(n) for n in args.thumbnail.split('x'))
+    grid = MonitorGrid(mon, thumb_size)
+    status = urwid.Text(u'')
+    frame = urwid.Frame(urwid.LineBox(grid, 'Gandyloo monitor'),
+            footer=status)
+
+    loop = urwid.MainLoop(frame, PALETTE, unhandled_input=handle_exit)
+    loop.screen.set_terminal_properties(colors=16)
+    loop.event_loop = urwid.TwistedEventLoop(reactor)
+
+    # Redraw at most fps times a second, and only if something changed.
+    drawn = [None]
+    def refresh(loop, user_data):
+        if mon.version != drawn[0]:
+            drawn[0] = mon.version
+            grid._invalidate()
+            status.set_text(status_line(mon, grid))
+        loop.set_alarm_in(1.0 / args.fps, refresh)
+    loop.set_alarm_in(0, refresh)
+
+    reactor.callWhenRunning(population.start)
+    try:
+        loop.run()
+    finally:
+        population.stop()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python2
 import urwid
 
-from gandyloo import board, parse, message
+from gandyloo import board, parse, message, stats, instrument, polling
 
 def clamp(n, minn, maxn):
     return max(min(maxn, n), minn)
@@ -21,10 +21,14 @@ class MinesweeperMapMinimap(object):
     widget.
     '''
 
-    def __init__(self, command_sink):
+    def __init__(self, command_sink, stats=None):
         # To send user commands to.
         self.command_sink = command_sink
 
+        # A gandyloo.stats.ConnectionStats to record render times in, or
+        # None.
+        self.stats = stats
+
         # The pre-HELLO size of the board.
         self.board_size = (1, 1)
 
@@ -181,12 +185,23 @@ class MinesweeperMapMinimap(object):
             self.map._invalidate()
         elif type(resp) == message.BoardResp:
             assert self.board_size == (resp.board.width, resp.board.height)
+            # Background looks mostly bring back the same board, which the
+            # board cache hands out with the same tiles; no need to redraw.
+            unchanged = (self.state == 'board'
+                    and self.board._tiles is resp.board._tiles)
             self.board = resp.board
             self.state = 'board'
-            self.map._invalidate()
+            if not unchanged:
+                self.map._invalidate()
         elif type(resp) == message.BoomResp:
             self.state = 'boom'
             self.map._invalidate()
+        elif type(resp) == message.CloseResp:
+            # Wait for a board from the next connection, if any. The
+            # server hangs up right after a BOOM, which stays on screen.
+            if self.state != 'boom':
+                self.state = 'wait'
+                self.map._invalidate()
 
     def _dig(self):
         '''Dig at the current selected tile, if it can be dug.'''
@@ -194,15 +209,17 @@ class MinesweeperMapMinimap(object):
 
         tiletype = type(self.board[self.selected])
         if tiletype == board.Untouched:
-            self.command_sink.command(message.DigCommand(self.selected))
+            self.command_sink.command(
+                    message.command_table(self.board_size).dig(self.selected))
 
     def _flag(self):
         assert self.state == 'board'
         tiletype = type(self.board[self.selected])
+        commands = message.command_table(self.board_size)
         if tiletype == board.Untouched:
-            self.command_sink.command(message.FlagCommand(self.selected))
+            self.command_sink.command(commands.flag(self.selected))
         elif tiletype == board.Flagged:
-            self.command_sink.command(message.DeflagCommand(self.selected))
+            self.command_sink.command(commands.deflag(self.selected))
 
     # The widgets.
     class Map(urwid.Widget):
@@ -286,7 +303,17 @@ class MinesweeperMapMinimap(object):
             
             return self.model.aperture_selected
 
+        @instrument.timed('map.render')
         def render(self, size, focus=False):
+            if self.model.stats is None:
+                return self._render(size, focus)
+
+            start = self.model.stats.clock()
+            result = self._render(size, focus)
+            self.model.stats.render_time(self.model.stats.clock() - start)
+            return result
+
+        def _render(self, size, focus=False):
             self.model.resize_aperture(size)
 
             if self.model.state == 'wait':
@@ -346,6 +373,7 @@ class MinesweeperMapMinimap(object):
         def __init__(self, model):
             self.model = model
 
+        @instrument.timed('minimap.render')
         def render(self, size, focus=False):
             assert not focus
             
@@ -391,6 +419,34 @@ class MinesweeperMapMinimap(object):
                     maxcol=mmw,
                     check_width=True)
 
+class StatsPanel(urwid.WidgetWrap):
+    '''Shows live statistics about the connection, from a
+    gandyloo.stats.ConnectionStats. Call update() periodically to refresh
+    it.'''
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.text = urwid.Text(u'')
+        urwid.WidgetWrap.__init__(self, urwid.Filler(self.text, 'top'))
+        self.update()
+
+    def update(self):
+        sample = self.stats.sample()
+        self.text.set_text(u'\n'.join([
+            u'Messages/sec:  {:.1f}'.format(sample['messages_per_sec']),
+            u'Bytes/sec:     {:.0f}'.format(sample['bytes_per_sec']),
+            u'Last RTT:      ' + format_seconds(sample['last_rtt']),
+            u'p99 RTT:       ' + format_seconds(sample['p99_rtt']),
+            u'Parse/board:   ' + format_seconds(sample['parse_time']),
+            u'Render/frame:  ' + format_seconds(sample['render_time']),
+            u'Buffered:      {} bytes'.format(sample['buffered']),
+        ]))
+
+def format_seconds(seconds):
+    if seconds is None:
+        return u'-'
+    return u'{:.2f} ms'.format(seconds * 1000)
+
 class Palette:
     '''Colors available to use.
     GRAY is just gray.
@@ -427,6 +483,23 @@ def handle_exit(key):
         if key.lower() in ('q', 'ctrl c', 'ctrl d'):
             raise urwid.ExitMainLoop()
 
+def toggle_box(pile, box, key):
+    '''Return an unhandled_input function that shows and hides box at the
+    bottom of pile when key is pressed, and otherwise handles exiting.'''
+    def handle_input(pressed):
+        if type(pressed) == str and pressed.lower() == key:
+            widgets = [w for (w, options) in pile.contents]
+            if box in widgets:
+                del pile.contents[widgets.index(box)]
+            else:
+                pile.contents.append((box, pile.options('weight', .3)))
+            return
+        handle_exit(pressed)
+    return handle_input
+
+# Seconds between updates of the statistics panel.
+STATS_INTERVAL = 1.0
+
 HELP_MESSAGE = u'''Welcome to the gandyloo minesweeper interface!
 
 Controls:
@@ -452,6 +525,12 @@ Controls:
         - f
         - 2
 
+    - To show statistics:
+        - i
+
+    Other players' moves show up as the
+    board is looked at in the background.
+
     - To quit:
         - q
         - ctrl-c
@@ -468,22 +547,39 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="6.005 compatible minesweeper client.")
     parser.add_argument('--server', default='localhost', help='The server to connect to [default: localhost]')
     parser.add_argument('--port', default='4444', type=int, help='The port to connect to [default: 4444]')
+    parser.add_argument('--reconnect', action='store_true', help='Reconnect, with exponential backoff, whenever the connection closes or fails (e.g. when the server restarts); by default a BOOM or bye ends the game')
+    parser.add_argument('--no-poll', action='store_true', help="Don't look at the board in the background to see other players' moves")
+    parser.add_argument('--poll-min', default=0.25, type=float, help='Seconds between background looks while the board is changing [default: 0.25]')
+    parser.add_argument('--poll-max', default=8.0, type=float, help='Most seconds between background looks while it is not [default: 8]')
+    parser.add_argument('--poll-bandwidth', default=32768, type=int, help='Most bytes/sec of boards background looks may bring in [default: 32768]')
+    instrument.add_arguments(parser)
     args = parser.parse_args()
+    instrument.start_profiling(args)
 
-    from gandyloo.connection import MinesweeperClient
+    from gandyloo.connection import MinesweeperClientFactory
     from twisted.internet import reactor
-    from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
 
     relay = message.MessageRelay()
 
-    model = MinesweeperMapMinimap(relay)
+    connection_stats = stats.ConnectionStats()
+
+    model = MinesweeperMapMinimap(relay, connection_stats)
 
-    client = MinesweeperClient(relay)
+    # With --reconnect, reconnects if the server restarts.
+    factory = MinesweeperClientFactory(relay, connection_stats,
+            reconnect=args.reconnect)
+    reactor.connectTCP(args.server, args.port, factory)
 
-    point = TCP4ClientEndpoint(reactor, args.server, args.port)
-    d = connectProtocol(point, client)
+    relay.add_command_receiver(factory)
+
+    # Keeps the board fresh as other players play. It sees responses
+    # before the model, so it counts the look the model sends on HELLO.
+    if not args.no_poll:
+        poller = polling.AdaptivePoller(reactor, relay, args.poll_min,
+                args.poll_max, max_bandwidth=args.poll_bandwidth)
+        relay.add_command_receiver(poller)
+        relay.add_response_receiver(poller)
 
-    relay.add_command_receiver(client)
     relay.add_response_receiver(model)
 
     minimap = urwid.LineBox(model.minimap, "Minimap")
@@ -492,9 +588,19 @@ if __name__ == '__main__':
 
     main_map = urwid.LineBox(model.map, "Gandyloo")
 
+    stats_panel = StatsPanel(connection_stats)
+    stats_box = urwid.LineBox(stats_panel, 'Statistics')
+
     core_widget = urwid.Columns([('weight', .7, main_map), ('weight', .3, mini_help_stack)], box_columns=[0])
 
-    loop = urwid.MainLoop(core_widget, PALETTE, unhandled_input=handle_exit)
+    loop = urwid.MainLoop(core_widget, PALETTE,
+            unhandled_input=toggle_box(mini_help_stack, stats_box, 'i'))
     loop.screen.set_terminal_properties(colors=16)
     loop.event_loop = urwid.TwistedEventLoop(reactor)
+
+    def update_stats(loop, user_data):
+        stats_panel.update()
+        loop.set_alarm_in(STATS_INTERVAL, update_stats)
+    loop.set_alarm_in(STATS_INTERVAL, update_stats)
+
     loop.run()
@@ -8,9 +8,10 @@ setup(
         author="James Gilles",
         author_email="jhgilles@mit.edu",
         install_requires=["py>=1.4.30",
-            "pytest>=2.8.2",
+            "pytest>=3.0",
             "Twisted>=15.4.0",
             "urwid>=1.3.1"],
+        extras_require={"numpy": ["numpy"]},
         packages=['gandyloo'],
-        scripts=['gandysweeper.py']
+        scripts=['gandysweeper.py', 'gandymonitor.py']
 )
@@ -1,5 +1,6 @@
+from array import array
 import pytest
-from gandyloo import board
+from gandyloo import board, history
 
 def test_init():
     b = board.Board(10, 10)
@@ -38,3 +39,145 @@ def test_oob():
     with pytest.raises(AssertionError):
         b[57, 100]
 
+
+def test_snapshot():
+    b = board.Board(5, 5)
+    b[1, 1] = board.Dug(2)
+    s = b.snapshot()
+    assert s[1, 1] == board.Dug(2)
+
+    b[2, 2] = board.Flagged()
+    assert b[2, 2] == board.Flagged()
+    assert s[2, 2] == board.Untouched()
+
+    s[3, 3] = board.Dug(0)
+    assert s[3, 3] == board.Dug(0)
+    assert b[3, 3] == board.Untouched()
+
+def test_from_tiles():
+    # Snapshots, parsed boards and unpacked ones are all made this way, so
+    # it has to work for Board and its subclasses on every Python we run.
+    class Sub(board.Board):
+        pass
+    for cls in (board.Board, Sub):
+        b = cls(3, 2)
+        b[2, 1] = board.Flagged()
+        s = b.snapshot()
+        assert type(s) is board.Board
+        t = cls._from_tiles(3, 2, s._tiles, shared=True)
+        assert type(t) is cls
+        assert (t.width, t.height) == (3, 2)
+        assert t[2, 1] == board.Flagged()
+        t[0, 0] = board.Dug(1)
+        assert s[0, 0] == board.Untouched()
+
+def test_array_view():
+    numpy = pytest.importorskip('numpy')
+    b = board.Board(4, 3)
+    b[3, 1] = board.Dug(2)
+    a = board.as_array(b)
+    assert a.shape == (3, 4)
+    assert a[1, 3] == 2
+    assert a[0, 0] == board.UNTOUCHED
+    with pytest.raises(ValueError):
+        a[0, 0] = 1
+
+    # Writable views write through, but not into snapshots.
+    s = b.snapshot()
+    w = board.as_array(b, writable=True)
+    w[2, 0] = board.FLAGGED
+    assert b[0, 2] == board.Flagged()
+    assert s[0, 2] == board.Untouched()
+
+def test_from_array():
+    numpy = pytest.importorskip('numpy')
+    tiles = numpy.full((2, 3), board.UNTOUCHED, dtype=numpy.uint8)
+    tiles[1, 2] = 5
+    b = board.from_array(tiles)
+    assert (b.width, b.height) == (3, 2)
+    assert b[2, 1] == board.Dug(5)
+    assert b[0, 0] == board.Untouched()
+
+    # The board has its own tiles, like any other board.
+    tiles[0, 0] = board.FLAGGED
+    assert b[0, 0] == board.Untouched()
+    assert type(b._tiles) is array
+    assert b._tiles.tolist() == [board.UNTOUCHED] * 5 + [5]
+    assert board.thumbnail(b, 1, 1) == board.thumbnail(b.snapshot(), 1, 1)
+    assert list(history.diff_tiles(b._tiles, board.Board(3, 2)._tiles)) == [5]
+
+    # Non-contiguous arrays work too.
+    b = board.from_array(numpy.arange(6, dtype=numpy.uint8).reshape(3, 2).T)
+    assert b._tiles.tolist() == [0, 2, 4, 1, 3, 5]
+
+    with pytest.raises(ValueError):
+        board.from_array(numpy.zeros((2, 2), dtype=numpy.int64))
+    with pytest.raises(ValueError):
+        board.from_array(numpy.full((2, 2), 11, dtype=numpy.uint8))
+
+def test_new_array():
+    numpy = pytest.importorskip('numpy')
+    b, tiles = board.new_array(3, 2)
+    assert tiles.shape == (2, 3)
+    assert (tiles == board.UNTOUCHED).all()
+
+    # Filling the array fills the board, with no copy.
+    tiles[...] = numpy.arange(6, dtype=numpy.uint8).reshape(2, 3)
+    tiles[1, 2] = board.FLAGGED
+    assert b._tiles.tolist() == [0, 1, 2, 3, 4, board.FLAGGED]
+    assert b[2, 1] == board.Flagged()
+    s = b.snapshot()
+    assert s[1, 1] == board.Dug(4)
+
+def test_without_numpy(monkeypatch):
+    monkeypatch.setattr(board, 'numpy', None)
+    b = board.Board(2, 2)
+    for call in (lambda: board.as_array(b), lambda: board.tile_counts(b),
+            lambda: board.from_array([[0, 0]]), lambda: board.new_array(2, 2),
+            lambda: board.is_consistent(b)):
+        with pytest.raises(ImportError):
+            call()
+
+def test_array_helpers():
+    numpy = pytest.importorskip('numpy')
+    b = board.Board(3, 3)
+    b[0, 0] = board.Dug(1)
+    b[1, 1] = board.Flagged()
+    b[2, 2] = board.Dug(0)
+
+    counts = board.tile_counts(b)
+    assert counts[0] == 1 and counts[1] == 1
+    assert counts[board.UNTOUCHED] == 6
+    assert counts[board.FLAGGED] == 1
+
+    sums = board.neighbor_sums(numpy.ones((3, 3)))
+    assert sums.tolist() == [[3, 5, 3], [5, 8, 5], [3, 5, 3]]
+
+    assert board.is_consistent(b)
+    b[1, 0] = board.Dug(0)
+    b[0, 1] = board.Dug(0)
+    b[0, 0] = board.Dug(2)
+    assert not board.is_consistent(b)
+    assert board.inconsistent_tiles(b).tolist() == [
+            [True, False, False],
+            [False, False, False],
+            [False, False, False]]
+
+def test_thumbnail():
+    b = board.Board(6, 4)
+    for x in range(3):
+        for y in range(4):
+            b[x, y] = board.Dug(0)
+    b[3, 0] = board.Dug(1)
+    b[4, 0] = board.Flagged()
+    b[5, 0] = board.Flagged()
+    b[5, 1] = board.Flagged()
+    # 2x2 cells of 3x2 tiles.
+    assert board.thumbnail(b, 2, 2).tolist() == [
+            board.THUMB_LEVELS, 1,
+            board.THUMB_LEVELS, 0]
+    assert board.thumbnail(b, 6, 4).tolist()[3:6] == [
+            board.THUMB_LEVELS, board.THUMB_FLAGGED, board.THUMB_FLAGGED]
+    # Larger than the board: tiles repeat.
+    assert len(board.thumbnail(b, 12, 8)) == 96
+    assert board.thumbnail(board.Board(1, 1), 3, 2).tolist() == [0] * 6
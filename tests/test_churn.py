@@ -0,0 +1,71 @@
+import pytest
+from gandyloo import churn, loopback
+
+class SilentServer(loopback.MinesweeperServer):
+    '''Never says hello.'''
+    def connectionMade(self):
+        self.game.players += 1
+
+class SilentServerFactory(loopback.MinesweeperServerFactory):
+    def buildProtocol(self, addr):
+        return SilentServer(self.game)
+
+def run(clock, runner, seconds):
+    d = runner.start()
+    results = []
+    d.addCallback(results.append)
+    clock.run(until=seconds)
+    return results
+
+def test_churn():
+    clock = loopback.VirtualClock()
+    game = loopback.Game(2, 1, density=0)
+    endpoint = loopback.LoopbackEndpoint(clock,
+            loopback.MinesweeperServerFactory(game), latency=0.005)
+    runner = churn.ChurnRunner(clock, endpoint, rate=100, max_in_flight=10,
+            duration=2)
+    assert run(clock, runner, 3) == [runner]
+
+    summary = runner.summary()
+    assert 190 <= summary['started'] <= 200
+    assert summary['completed'] == summary['started']
+    assert summary['failures'] == summary['timeouts'] == 0
+    assert 90 < summary['connections_per_sec'] < 110
+    # The HELLO takes one trip; the board a round trip more.
+    assert summary['latency']['hello']['p50'] == pytest.approx(0.005)
+    assert summary['latency']['first_board']['p50'] == pytest.approx(0.015)
+    assert not runner.in_flight
+    assert game.players == 0
+
+def test_churn_in_flight_limit_and_timeout():
+    clock = loopback.VirtualClock()
+    endpoint = loopback.LoopbackEndpoint(clock,
+            SilentServerFactory(loopback.Game(2, 1)), latency=0.01)
+    runner = churn.ChurnRunner(clock, endpoint, rate=100, max_in_flight=5,
+            duration=1, timeout=0.5)
+    assert run(clock, runner, 2) == [runner]
+
+    summary = runner.summary()
+    # Five sessions at a time, each taking half a second to time out.
+    assert summary['started'] == 10
+    assert summary['completed'] == 0
+    assert summary['timeouts'] == 10
+
+def test_churn_backs_off_while_server_restarts():
+    clock = loopback.VirtualClock()
+    endpoint = loopback.LoopbackEndpoint(clock,
+            loopback.MinesweeperServerFactory(loopback.Game(2, 1)),
+            latency=0.005)
+    runner = churn.ChurnRunner(clock, endpoint, rate=100, max_in_flight=10,
+            duration=6)
+    clock.callLater(2, endpoint.restart, 1.0)
+    assert run(clock, runner, 10) == [runner]
+
+    summary = runner.summary()
+    # Only a few connects are tried while the server is down, and the run
+    # carries on once it is back.
+    assert endpoint.refused == summary['failures']
+    assert 0 < endpoint.refused < 20
+    assert summary['skipped'] > 50
+    assert summary['completed'] > 350
+    assert runner.report.retries >= 1
@@ -0,0 +1,149 @@
+import pytest
+from twisted.internet import task, error
+from twisted.python import failure
+from gandyloo import instrument, message, parse, stats
+from gandyloo.connection import MinesweeperClient, MinesweeperClientFactory
+
+class Sink(object):
+    def __init__(self):
+        self.received = []
+
+    def response(self, resp):
+        self.received.append(resp)
+
+class Transport(object):
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+    def writeSequence(self, data):
+        self.written.append(''.join(data))
+
+def test_reconnecting_factory():
+    sink = Sink()
+    factory = MinesweeperClientFactory(sink)
+    factory.clock = task.Clock()
+    factory.delay = 10
+
+    # Commands are dropped while disconnected.
+    factory.command(message.LookCommand())
+
+    client = factory.buildProtocol(None)
+    client.makeConnection(Transport())
+    client.dataReceived("Welcome to Minesweeper. Board: 1 columns by 1 rows. "
+            "Players: 1 including you. Type 'help' for help.\n")
+    assert type(sink.received[0]) == message.HelloResp
+    assert factory.delay == factory.initialDelay
+
+    factory.command(message.LookCommand())
+    assert client.transport.written == ['look\n']
+
+    table = message.command_table((1, 1))
+    client.command(table.dig((0, 0)))
+    client.command(table.flag((0, 0)))
+    assert client.transport.written[1:] == ['dig 0 0\n', 'flag 0 0\n']
+
+    client.connectionLost(failure.Failure(error.ConnectionLost()))
+    assert type(sink.received[1]) == message.CloseResp
+    assert factory.client is None
+
+HELLO = ("Welcome to Minesweeper. Board: 2 columns by 2 rows. "
+        "Players: 1 including you. Type 'help' for help.\r\n")
+
+def test_pieces_parsed_once():
+    sink = Sink()
+    client = MinesweeperClient(sink)
+    client.makeConnection(Transport())
+    instrument.enable()
+    try:
+        instrument.reset()
+        # A byte at a time: only parsed once each line is complete.
+        for c in HELLO + 'Some help.\r\n':
+            client.dataReceived(c)
+        assert instrument.summary()[1]['parse_attempts'] <= 8
+        assert [type(r) for r in sink.received] == [message.HelloResp,
+                message.HelpResp]
+
+        instrument.reset()
+        # A board: only parsed once it could be complete.
+        for c in '- -\r\n- F\r\nBOOM!\r\n':
+            client.dataReceived(c)
+        assert instrument.summary()[1]['parse_attempts'] <= 8
+        assert [type(r) for r in sink.received[2:]] == [message.BoardResp,
+                message.BoomResp]
+        assert client.buffer == ''
+    finally:
+        instrument.disable()
+        instrument.reset()
+
+def test_line_limit():
+    client = MinesweeperClient(Sink())
+    client.makeConnection(Transport())
+    client.dataReceived(HELLO)
+    piece = 'x' * 4096
+    with pytest.raises(parse.InvalidResponseError) as e:
+        for _ in range(parse.MAX_LINE_LENGTH // len(piece) + 1):
+            client.dataReceived(piece)
+    assert e.value.cause == 'Line too long'
+
+def test_responses_after_buffer_update():
+    class Echo(Sink):
+        # Like a server answering synchronously, so that data arrives
+        # while the client is still handing out responses.
+        def response(self, resp):
+            Sink.response(self, resp)
+            if type(resp) == message.HelloResp:
+                client.dataReceived('BOOM!\r\n')
+
+    sink = Echo()
+    client = MinesweeperClient(sink)
+    client.makeConnection(Transport())
+    client.dataReceived(HELLO + 'help\r\n')
+    assert [type(r) for r in sink.received] == [message.HelloResp,
+            message.HelpResp, message.BoomResp]
+
+def test_stats_across_reconnects():
+    now = [0.0]
+    connection_stats = stats.ConnectionStats(lambda: now[0])
+    factory = MinesweeperClientFactory(Sink(), connection_stats)
+    factory.clock = task.Clock()
+
+    client = factory.buildProtocol(None)
+    client.makeConnection(Transport())
+    client.dataReceived(HELLO)
+    factory.command(message.LookCommand())
+    client.connectionLost(failure.Failure(error.ConnectionLost()))
+
+    # The look was never answered; the next connection's help is timed
+    # from when it was sent.
+    now[0] = 5.0
+    client = factory.buildProtocol(None)
+    client.makeConnection(Transport())
+    client.dataReceived(HELLO)
+    factory.command(message.HelpCommand())
+    now[0] = 5.25
+    client.dataReceived('Some help.\r\n')
+    assert list(connection_stats.rtts) == [0.25]
+
+class Connector(object):
+    def __init__(self):
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+
+def test_factory_reconnect_opt_in():
+    for reconnect in (True, False):
+        factory = MinesweeperClientFactory(Sink(), reconnect=reconnect)
+        factory.clock = task.Clock()
+        connector = Connector()
+        client = factory.buildProtocol(None)
+        client.makeConnection(Transport())
+        client.dataReceived(HELLO)
+        client.connectionLost(failure.Failure(error.ConnectionDone()))
+        factory.clientConnectionLost(connector,
+                failure.Failure(error.ConnectionDone()))
+        factory.clock.advance(factory.maxDelay)
+        assert connector.connects == (1 if reconnect else 0)
@@ -0,0 +1,112 @@
+import io
+import random
+import pytest
+from gandyloo import board, history
+
+def random_board(width, height, rng):
+    b = board.Board(width, height)
+    for x, y in ((x,y) for x in range(width) for y in range(height)):
+        b._tiles[x + y*width] = rng.randint(0, 10)
+    return b
+
+def test_pack_unpack():
+    rng = random.Random(0)
+    for width, height in ((1, 1), (3, 3), (10, 7), (40, 37)):
+        b = random_board(width, height, rng)
+        packed = history.pack(b)
+        assert len(packed) == (width*height + 1) // 2
+
+        u = history.unpack(packed, width, height)
+        assert (u.width, u.height) == (width, height)
+        assert u._tiles == b._tiles
+
+    with pytest.raises(ValueError):
+        history.unpack(packed, 41, 37)
+
+    # The format saved files use: high nibble first, odd tile padded.
+    b = board.Board(3, 1)
+    b[0, 0] = board.Flagged()
+    b[1, 0] = board.Dug(3)
+    assert history.pack(b).tolist() == [0xa3, 0x90]
+
+def test_unpacked_boards_are_independent():
+    h = history.BoardHistory(3, 3)
+    b = board.Board(3, 3)
+    b[1, 1] = board.Dug(2)
+    h.append(b)
+    for u in (history.unpack(history.pack(b), 3, 3), h[0]):
+        assert type(u) is board.Board
+        u[1, 1] = board.Flagged()
+        assert u[1, 1] == board.Flagged()
+    assert h[0][1, 1] == board.Dug(2)
+    assert b[1, 1] == board.Dug(2)
+
+def test_diff_tiles():
+    rng = random.Random(1)
+    old = random_board(50, 50, rng)
+    new = old.snapshot()
+    assert list(history.diff_tiles(old._tiles, new._tiles)) == []
+
+    new[3, 0] = board.Flagged()
+    new[49, 49] = board.Dug(7)
+    new[0, 20] = board.Dug(1)
+    expected = sorted(i for i in range(2500) if old._tiles[i] != new._tiles[i])
+    assert list(history.diff_tiles(old._tiles, new._tiles)) == expected
+
+def make_history(versions=200, keyframe_interval=16):
+    rng = random.Random(2)
+    h = history.BoardHistory(30, 20, keyframe_interval)
+    b = board.Board(30, 20)
+    boards = []
+    for v in range(versions):
+        for _ in range(rng.randint(0, 5)):
+            b._tiles[rng.randrange(600)] = rng.randint(0, 10)
+        if v % 50 == 49:
+            b = random_board(30, 20, rng)
+        assert h.append(b) == v
+        boards.append(array_of(b))
+    return h, boards
+
+def array_of(b):
+    return list(b._tiles)
+
+def test_history_random_access():
+    h, boards = make_history()
+    assert len(h) == len(boards)
+    for v in (0, 1, 15, 16, 17, 49, 50, 51, 199, 120, 3):
+        assert array_of(h[v]) == boards[v]
+    assert array_of(h[-1]) == boards[-1]
+    with pytest.raises(IndexError):
+        h[len(boards)]
+
+def test_history_sparse():
+    h = history.BoardHistory(100, 100)
+    b = board.Board(100, 100)
+    h.append(b)
+    b[5, 5] = board.Dug(3)
+    h.append(b)
+    indices, xors = h._deltas[1]
+    assert list(indices) == [505]
+    assert list(xors) == [9 ^ 3]
+
+def test_history_save_load():
+    h, boards = make_history()
+    f = io.BytesIO()
+    h.save(f)
+    f.seek(0)
+    loaded = history.BoardHistory.load(f)
+    assert len(loaded) == len(boards)
+    assert loaded.keyframe_interval == h.keyframe_interval
+    for v in range(len(boards)):
+        assert array_of(loaded[v]) == boards[v]
+
+    # Loaded histories can keep growing.
+    b = loaded[-1]
+    b[0, 0] = board.Flagged()
+    loaded.append(b)
+    assert loaded[-1][0, 0] == board.Flagged()
+
+    with pytest.raises(ValueError):
+        history.BoardHistory.load(io.BytesIO(f.getvalue()[:-1]))
+    with pytest.raises(ValueError):
+        history.BoardHistory.load(io.BytesIO(b'nope' + f.getvalue()[4:]))
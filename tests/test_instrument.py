@@ -0,0 +1,42 @@
+import pytest
+from gandyloo import instrument, parse
+
+@pytest.fixture
+def instrumented():
+    instrument.reset()
+    instrument.enable()
+    yield
+    instrument.disable()
+    instrument.reset()
+
+def test_disabled():
+    instrument.reset()
+    parse.parse_start('BOOM!\n', (1, 1))
+    instrument.count('messages')
+    assert instrument.summary() == ({}, {})
+
+def test_stages(instrumented):
+    parse.board_cache.clear()
+    for _ in range(3):
+        parse.parse_start('- -\n- -\n', (2, 2))
+        instrument.count('messages')
+    parse.parse_start('BOOM!\n', (2, 2))
+    instrument.count('messages', 2)
+
+    stages, counters = instrument.summary()
+    assert counters == {'messages': 5}
+    assert stages['parse.parse_start']['calls'] == 4
+    assert stages['parse.scan_board']['calls'] == 3
+    # Only the first board was parsed; the rest came from the cache.
+    assert stages['parse.parse_board']['calls'] == 1
+
+    start = stages['parse.parse_start']
+    assert start['mean'] == pytest.approx(start['total'] / 4)
+    assert start['per_message'] == pytest.approx(start['total'] / 5)
+    assert 'parse.parse_start' in instrument.format_summary()
+
+def test_timed_exceptions(instrumented):
+    with pytest.raises(parse.NotReadyError):
+        parse.parse_start('- -', (2, 2))
+    stages, counters = instrument.summary()
+    assert stages['parse.parse_start']['calls'] == 1
@@ -0,0 +1,146 @@
+from twisted.internet import task
+from gandyloo import loopback, message, churn, scenario
+from gandyloo.connection import MinesweeperClient
+
+class Sink(object):
+    def __init__(self):
+        self.responses = []
+
+    def response(self, resp):
+        self.responses.append(resp)
+
+def test_virtual_clock_order():
+    clock = loopback.VirtualClock()
+    ran = []
+    clock.callLater(2, ran.append, 'c')
+    clock.callLater(1, ran.append, 'a')
+    clock.callLater(1, ran.append, 'b')
+    cancelled = clock.callLater(1.5, ran.append, 'x')
+    moved = clock.callLater(0.5, ran.append, 'd')
+    cancelled.cancel()
+    moved.reset(5)
+    assert len(clock.getDelayedCalls()) == 4
+
+    assert clock.run(until=3) == 3
+    assert ran == ['a', 'b', 'c']
+    assert clock.seconds() == 3
+    assert clock.run() == 1
+    assert ran == ['a', 'b', 'c', 'd']
+    assert clock.seconds() == 5
+
+def test_virtual_clock_looping_call():
+    clock = loopback.VirtualClock()
+    ticks = []
+    loop = task.LoopingCall(lambda: ticks.append(clock.seconds()))
+    loop.clock = clock
+    loop.start(0.125)
+    clock.run(until=1.0)
+    loop.stop()
+    assert ticks == [i * 0.125 for i in range(9)]
+
+def test_game():
+    game = loopback.Game(3, 2, density=0)
+    game.mines[2] = 1
+    assert game.render() == '- - -\r\n- - -\r\n'
+    game.flag(2, 1)
+    assert game.render() == '- - -\r\n- - F\r\n'
+    # Flood fill stops at the flag and at the mine's neighbors.
+    assert not game.dig(0, 0)
+    assert game.render() == '  1 -\r\n  1 F\r\n'
+    # Digging the mine updates the counts around it.
+    assert game.dig(2, 0)
+    assert game.render() == '     \r\n    F\r\n'
+    game.flag(2, 1, False)
+    assert game.render() == '     \r\n    -\r\n'
+
+def test_session():
+    clock = loopback.VirtualClock()
+    game = loopback.Game(3, 2, density=0)
+    endpoint = loopback.LoopbackEndpoint(clock,
+            loopback.MinesweeperServerFactory(game), latency=0.01)
+    sink = Sink()
+    client = MinesweeperClient(sink)
+    d = endpoint.connect(_Factory(client))
+    assert d.result is client
+    clock.run()
+    hello, = sink.responses
+    assert hello.size == (3, 2)
+    assert hello.players == 1
+
+    for command in [message.LookCommand(), message.HelpCommand(),
+            message.DigCommand((1, 1)), message.ByeCommand()]:
+        client.command(command)
+    clock.run()
+    assert clock.seconds() == 0.03
+    board, help, dug, close = sink.responses[1:]
+    assert board.board._tiles.tolist() == [9] * 6
+    assert type(help) == message.HelpResp
+    assert dug.board._tiles.tolist() == [0] * 6
+    assert type(close) == message.CloseResp
+    assert game.players == 0
+
+class _Factory(object):
+    def __init__(self, protocol):
+        self.protocol = protocol
+
+    def buildProtocol(self, addr):
+        return self.protocol
+
+def test_connect_delay():
+    clock = loopback.VirtualClock()
+    game = loopback.Game(3, 2, density=0)
+    endpoint = loopback.LoopbackEndpoint(clock,
+            loopback.MinesweeperServerFactory(game), latency=0.01,
+            connect_delay=0.1)
+    sink = Sink()
+    connected = []
+    endpoint.connect(_Factory(MinesweeperClient(sink))).addCallback(
+            connected.append)
+    clock.run(until=0.05)
+    assert not connected and endpoint.connections == 0
+    clock.run()
+    assert len(connected) == 1 and game.players == 1
+    assert sink.responses[0].size == (3, 2)
+    assert clock.seconds() == 0.11
+
+    # Cancelled connects are never made.
+    endpoint.connect(_Factory(MinesweeperClient(sink)))
+    failed = []
+    d = endpoint.connect(_Factory(MinesweeperClient(sink)))
+    d.addErrback(failed.append)
+    d.cancel()
+    clock.run()
+    assert len(failed) == 1
+    assert endpoint.connections == 2 and game.players == 2
+
+def test_churn_on_loopback():
+    clock = loopback.VirtualClock()
+    endpoint = loopback.LoopbackEndpoint(clock,
+            loopback.MinesweeperServerFactory(loopback.Game(10, 10)),
+            latency=0.001)
+    runner = churn.ChurnRunner(clock, endpoint, rate=1000, max_in_flight=50,
+            duration=1)
+    results = []
+    runner.start().addCallback(results.append)
+    clock.run()
+    assert results == [runner]
+    summary = runner.summary()
+    assert summary['completed'] == summary['started'] >= 990
+    assert summary['latency']['first_board']['max'] < 0.01
+
+def test_scenario_on_loopback_is_deterministic():
+    def run():
+        clock = loopback.VirtualClock()
+        game = loopback.Game(20, 20, seed=3)
+        endpoint = loopback.LoopbackEndpoint(clock,
+                loopback.MinesweeperServerFactory(game), latency=0.001)
+        population = scenario.Population(clock, endpoint,
+                [(scenario.Digger, 50), (scenario.Flagger, 50)], users=20,
+                seed=3)
+        results = []
+        population.run(2).addCallback(results.append)
+        clock.run()
+        report, = results
+        assert report.to_dict()['step_failures'] == {}
+        return report.messages, game.render()
+    assert run() == run()
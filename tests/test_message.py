@@ -49,3 +49,50 @@ def test_relay():
 
     
 
+
+def test_slots():
+    for obj in (message.LookCommand(), message.DigCommand((1, 2)),
+            message.BoardResp(None), message.HelloResp((1, 1), 1),
+            message.BoomResp()):
+        assert not hasattr(obj, '__dict__')
+
+def test_command_table():
+    table = message.command_table((10, 20))
+    assert message.command_table((10, 20)) is table
+    assert message.command_table((20, 10)) is not table
+
+    dig = table.dig((3, 19))
+    assert isinstance(dig, message.DigCommand)
+    assert dig.target == (3, 19)
+    assert dig.render() == 'dig 3 19\n'
+    assert table.dig((3, 19)) is dig
+    assert table.flag((9, 0)).render() == 'flag 9 0\n'
+    assert table.deflag((0, 0)).render() == 'deflag 0 0\n'
+    assert table.flag((3, 19)) is not dig
+
+    with pytest.raises(AssertionError):
+        table.dig((10, 0))
+
+def test_command_table_bounds(monkeypatch):
+    monkeypatch.setattr(message.CommandTable, 'MAX_COMMANDS', 4)
+    table = message.CommandTable((1000, 1000))
+    first = table.dig((0, 0))
+    assert table.dig((0, 0)) is first
+    # Only commands asked for are kept, and not too many of them.
+    kept = [table.dig((x, 999)) for x in range(3)]
+    # The oldest are dropped one at a time.
+    table.dig((3, 999))
+    assert len(table._commands[message.DigCommand]) == 4
+    assert all(table.dig((x, 999)) is command
+            for x, command in enumerate(kept))
+    assert table.dig((0, 0)) is not first
+    for x in range(10):
+        assert table.dig((x, 999)).target == (x, 999)
+        assert len(table._commands[message.DigCommand]) <= 4
+    assert table.dig((0, 0)).render() == 'dig 0 0\n'
+
+    tables = [message.command_table((n, n)) for n in range(1, 21)]
+    assert len(message._command_tables) == message.MAX_COMMAND_TABLES
+    # Recently used tables are kept.
+    assert message.command_table((20, 20)) is tables[-1]
+    assert message.command_table((1, 1)) is not tables[0]
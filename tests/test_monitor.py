@@ -0,0 +1,64 @@
+from array import array
+from twisted.python import failure
+from gandyloo import board, loopback, message, monitor, scenario
+
+def board_resp(tiles):
+    return message.BoardResp(board.Board._from_tiles(2, 1, array('B', tiles)))
+
+def test_tail_versions():
+    mon = monitor.Monitor()
+    tail = mon.connection(7)
+    assert tail.state == 'wait' and tail.thumbnail(2, 1) is None
+
+    tail.response(message.HelloResp((2, 1), 1))
+    assert tail.version == 0
+    tail.response(board_resp([9, 9]))
+    assert (tail.state, tail.version) == ('board', 1)
+    # The same tiles again aren't a change.
+    tail.response(board_resp([9, 9]))
+    assert tail.version == 1
+    tail.response(board_resp([9, 0]))
+    assert tail.version == 2
+    tail.response(message.BoomResp())
+    tail.response(board_resp([9, 0]))
+    assert (tail.state, tail.version) == ('board', 4)
+    assert mon.version == 5
+
+def test_thumbnails_cached():
+    mon = monitor.Monitor()
+    tail = mon.connection(0)
+    tail.response(board_resp([0, 9]))
+    assert tail.thumbnail(2, 1).tolist() == [board.THUMB_LEVELS, 0]
+    assert tail.thumbnail(2, 1).tolist() == [board.THUMB_LEVELS, 0]
+    assert mon.thumbnails_computed == 1
+    tail.response(board_resp([0, 9]))
+    tail.thumbnail(2, 1)
+    assert mon.thumbnails_computed == 1
+    tail.thumbnail(1, 1)
+    assert mon.thumbnails_computed == 2
+
+def test_keep_closed():
+    mon = monitor.Monitor(keep_closed=1)
+    tails = [mon.connection(n) for n in range(3)]
+    closed = message.CloseResp(failure.Failure(Exception()))
+    tails[0].response(closed)
+    assert list(mon.tails) == [0, 1, 2]
+    tails[2].response(closed)
+    assert list(mon.tails) == [1, 2]
+    assert mon.counts() == {'wait': 1, 'closed': 1}
+
+def test_population_watchers():
+    clock = loopback.VirtualClock()
+    endpoint = loopback.LoopbackEndpoint(clock,
+            loopback.MinesweeperServerFactory(loopback.Game(10, 10)),
+            latency=0.001)
+    mon = monitor.Monitor(keep_closed=10)
+    population = scenario.Population(clock, endpoint,
+            [(scenario.Digger, 1)], users=5, watchers=[mon], seed=1)
+    population.start()
+    clock.run(until=1)
+    assert list(mon.tails) == [0, 1, 2, 3, 4]
+    assert all(tail.board is not None for tail in mon.tails.values())
+    population.stop()
+    clock.run()
+    assert mon.counts() == {'closed': 5}
@@ -1,5 +1,8 @@
+import io
+import os
 import pytest
-from gandyloo import parse, message, board
+from gandyloo import parse, message, board, instrument
+from gandyloo.connection import MinesweeperClient
 
 def test_parse_first():
     resp, new_buf = parse.parse_start("Welcome to Minesweeper. Board: 40 columns by 37 rows. Players: 1 including you. Type 'help' for help.\n", first=True)
@@ -36,6 +39,15 @@ def test_parse_board():
     assert resp.board[1, 1] == board.Dug(8)
     assert resp.board[2, 1] == board.Dug(2)
 
+def test_parse_board_uncached():
+    # parse_board wraps its tiles without copying; the board owns them.
+    b = parse.parse_board('- F -\r\n  8 2\n', (3, 2))
+    assert type(b) is board.Board
+    assert not b._shared
+    assert list(b._tiles) == [9, 10, 9, 0, 8, 2]
+    b[0, 0] = board.Dug(1)
+    assert b[0, 0] == board.Dug(1)
+
 def test_parse_board_wrongsize():
     with pytest.raises(parse.InvalidResponseError):
         parse.parse_start('- -\r-\n', (2,2))
@@ -85,3 +97,168 @@ def test_parse_bufconsume():
     assert resp.board[2, 0] == board.Flagged()
     assert resp.board[3, 0] == board.Dug(8)
     assert resp.board[4, 0] == board.Untouched()
+
+def test_board_cache():
+    cache = parse.BoardCache()
+    frame = '- F -\r\n  8 2\n'
+
+    first = cache.get(frame, (3, 2))
+    second = cache.get(frame, (3, 2))
+    assert cache.misses == 1
+    assert cache.hits == 1
+    assert first is not second
+    assert first._tiles is second._tiles
+
+    # Copy-on-write: writing to one snapshot doesn't affect the others.
+    first[0, 0] = board.Dug(3)
+    assert first[0, 0] == board.Dug(3)
+    assert second[0, 0] == board.Untouched()
+    assert cache.get(frame, (3, 2))[0, 0] == board.Untouched()
+
+    with pytest.raises(parse.InvalidResponseError):
+        cache.get(frame, (2, 2))
+    assert len(cache) == 1
+
+def test_board_cache_eviction():
+    frames = ['{} -\n'.format(i) for i in range(9)]
+    cost = len(frames[0]) + 2 + parse.BoardCache.ENTRY_OVERHEAD
+    cache = parse.BoardCache(max_bytes=cost*3)
+
+    for frame in frames:
+        cache.get(frame, (2, 1))
+    assert len(cache) == 3
+    assert cache.bytes_used <= cache.max_bytes
+
+    # The most recent frames are still cached; older ones were evicted.
+    cache.get(frames[-1], (2, 1))
+    assert cache.hits == 1
+    cache.get(frames[0], (2, 1))
+    assert cache.hits == 1
+
+def test_board_cache_shared():
+    parse.board_cache.clear()
+    frame = '- - 1\n- 2 F\n'
+    boards = [parse.parse_start(frame, (3, 2))[0].board for _ in range(5000)]
+    assert len(parse.board_cache) == 1
+    assert all(b._tiles is boards[0]._tiles for b in boards)
+
+def test_scan_board():
+    assert parse.scan_board('- F -\r\n  8 2\nBOOM!\n', (3, 2)) == 13
+    assert parse.scan_board('- F -\r  8 2\r', (3, 2)) == 12
+    assert parse.scan_board('- F -\n  8 2\r\n- - -\n', (3, 2)) == 13
+    assert parse.scan_board('RTFM\n', (3, 2)) is None
+    assert parse.scan_board('- F- \n', (3, 2)) is None
+
+    # Partial frames
+    for partial in ('- F -\r', '- F -\r\n', '- F -\r\n  8', '- F -\r\n  8 2'):
+        with pytest.raises(parse.NotReadyError):
+            parse.scan_board(partial, (3, 2))
+
+    # Malformed frames
+    for malformed in ('- F - -\n', '- F -\n- -\n', '- F -\n- - - -\n',
+            '- F -\nRTFM!\n', '- F -\n-x- -\n'):
+        with pytest.raises(parse.InvalidResponseError):
+            parse.scan_board(malformed, (3, 2))
+
+def test_parse_wide_board():
+    row = ' '.join('12345678F -'[x % 11] for x in range(2000))
+    frame = '\r\n'.join([row]*3) + '\r\n'
+    parse.board_cache.clear()
+    resp, new_buf = parse.parse_start(frame + 'BOOM!\n', (2000, 3))
+    assert new_buf == 'BOOM!\n'
+    assert resp.board[0, 2] == board.Dug(1)
+    assert resp.board[8, 0] == board.Flagged()
+    assert resp.board[9, 1] == board.Dug(0)
+    assert resp.board[1999, 2] == board.Flagged()
+
+    with pytest.raises(parse.NotReadyError):
+        parse.parse_start(frame[:-1000], (2000, 3))
+
+def test_parse_at():
+    buf = '\r\nBOOM!\r\n\n- -\r\nhelp\n- -'
+    resp, pos = parse.parse_at(buf, 0, (2, 1))
+    assert isinstance(resp, message.BoomResp) and pos == 9
+    resp, pos = parse.parse_at(buf, pos, (2, 1))
+    assert isinstance(resp, message.BoardResp) and pos == 15
+    resp, pos = parse.parse_at(buf, pos, (2, 1))
+    assert isinstance(resp, message.HelpResp) and pos == 20
+    with pytest.raises(parse.NotReadyError) as e:
+        parse.parse_at(buf, pos, (2, 1))
+    assert e.value.start == 20 and e.value.needs_newline
+
+    # A partial board says how much more there must be.
+    with pytest.raises(parse.NotReadyError) as e:
+        parse.parse_at('\n- -\r\n- ', 0, (2, 3))
+    assert e.value.start == 1
+    assert e.value.needed == 6 + 2 * 4 and not e.value.needs_newline
+
+def test_limits():
+    hello = ("Welcome to Minesweeper. Board: {} columns by {} rows. "
+        "Players: 1 including you. Type 'help' for help.\n")
+    for size in ((0, 5), (parse.MAX_LINE_LENGTH, 1),
+            (1000, parse.MAX_FRAME_LENGTH // 1000)):
+        with pytest.raises(parse.InvalidResponseError):
+            parse.parse_start(hello.format(*size), first=True)
+    with pytest.raises(parse.InvalidResponseError):
+        parse.parse_start(hello.format('9' * 100, 1), first=True)
+
+    line = 'x' * parse.MAX_LINE_LENGTH
+    with pytest.raises(parse.NotReadyError):
+        parse.parse_start(line, (1, 1))
+    assert parse.parse_start(line + '\n', (1, 1))[1] == ''
+    with pytest.raises(parse.InvalidResponseError) as e:
+        parse.parse_start(line + 'x', (1, 1))
+    assert e.value.cause == 'Line too long'
+    assert len(e.value.response) < 100
+
+
+# Streams that once made the parser slow (see benchmarks/fuzz_parse.py).
+CORPUS = os.path.join(os.path.dirname(__file__), 'parse_corpus')
+
+def parse_work(stream, chunk):
+    '''Feed stream to a client in pieces of chunk characters; return the
+    parse_bytes and parse_attempts counted.'''
+    client = MinesweeperClient(message.MessageRelay())
+    instrument.enable()
+    try:
+        instrument.reset()
+        try:
+            for i in range(0, len(stream), chunk):
+                client.dataReceived(stream[i:i + chunk])
+        except parse.InvalidResponseError:
+            pass
+        counters = instrument.summary()[1]
+    finally:
+        instrument.disable()
+        instrument.reset()
+    return counters.get('parse_bytes', 0), counters.get('parse_attempts', 0)
+
+def test_corpus():
+    names = sorted(n for n in os.listdir(CORPUS) if n.endswith('.txt'))
+    assert names
+    for name in names:
+        with io.open(os.path.join(CORPUS, name), encoding='latin-1',
+                newline='') as f:
+            stream = str(f.read())
+        for chunk in (len(stream), 1, 7):
+            work, attempts = parse_work(stream, chunk)
+            assert work <= 4 * len(stream), (name, chunk)
+            assert attempts <= 2 * len(stream) // chunk + 4, (name, chunk)
+
+def test_linear():
+    hello = ("Welcome to Minesweeper. Board: 100 columns by {} rows. "
+        "Players: 1 including you. Type 'help' for help.\r\n")
+    row = '- ' * 99 + '-\r\n'
+    streams = [
+        lambda n: hello.format(10) + 'x' * n,
+        lambda n: hello.format(10) + '\r' * n + 'BOOM!\n',
+        lambda n: '\r\n' * (n // 2) + hello.format(10),
+        lambda n: hello.format(n // len(row)) + row * (n // len(row)),
+        lambda n: hello.format(10) + 'BOOM!\r\n' * (n // 7),
+    ]
+    for make in streams:
+        for n in (4000, 32000):
+            stream = make(n)
+            # Quadratic parsing would look at about n * n / 32 bytes.
+            work, _ = parse_work(stream, 16)
+            assert work <= 4 * len(stream)
@@ -0,0 +1,72 @@
+from array import array
+from twisted.internet import task
+from gandyloo import board, message, polling
+
+def make(**kwargs):
+    clock = task.Clock()
+    relay = message.MessageRelay()
+    sent = []
+    poller = polling.AdaptivePoller(clock, relay, **kwargs)
+    relay.add_command_receiver(poller)
+    relay.add_command_receiver(type('Sink', (), {'command':
+        lambda self, c: sent.append(c)})())
+    relay.add_response_receiver(poller)
+    return clock, relay, poller, sent
+
+def board_resp(tiles):
+    return message.BoardResp(board.Board._from_tiles(2, 1, array('B', tiles)))
+
+def test_backoff_and_reset():
+    clock, relay, poller, sent = make(min_interval=1, max_interval=4)
+    relay.response(message.HelloResp((2, 1), 1))
+    intervals = []
+    for tiles in ([9, 9], [9, 9], [9, 9], [9, 9], [9, 9], [0, 9], [0, 9]):
+        before = len(sent)
+        start = clock.seconds()
+        while len(sent) == before:
+            clock.advance(0.25)
+        intervals.append(clock.seconds() - start)
+        relay.response(board_resp(tiles))
+    # The first board is new; then unchanged boards back off up to the
+    # maximum, until the board changes.
+    assert intervals == [1, 1, 2, 4, 4, 4, 1]
+    assert poller.interval == 2
+    assert poller.polls == 7
+    assert all(type(c) == message.LookCommand for c in sent)
+
+def test_skips_while_in_flight():
+    clock, relay, poller, sent = make(min_interval=1)
+    relay.response(message.HelloResp((2, 1), 1))
+    relay.command(message.DigCommand((0, 0)))
+    clock.advance(5)
+    assert poller.skipped == 1
+    assert len(sent) == 1
+    # The answer to the dig is fresh, so the next look waits a full
+    # interval after it.
+    relay.response(board_resp([0, 9]))
+    clock.advance(0.9)
+    assert len(sent) == 1
+    clock.advance(0.1)
+    assert type(sent[-1]) == message.LookCommand
+
+def test_bandwidth_limit():
+    clock, relay, poller, sent = make(min_interval=0.1, max_bandwidth=1000)
+    relay.response(message.HelloResp((100, 50), 1))
+    assert polling.board_bytes((100, 50)) == 10050
+    assert poller.next_interval() == 10.05
+    clock.advance(10)
+    assert not sent
+    clock.advance(0.1)
+    assert len(sent) == 1
+
+def test_close_stops():
+    clock, relay, poller, sent = make(min_interval=1)
+    relay.response(message.HelloResp((2, 1), 1))
+    relay.command(message.LookCommand())
+    relay.response(message.CloseResp(None))
+    clock.advance(100)
+    assert len(sent) == 1
+    # Reconnecting starts over.
+    relay.response(message.HelloResp((2, 1), 1))
+    clock.advance(1)
+    assert len(sent) == 2
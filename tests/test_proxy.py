@@ -0,0 +1,135 @@
+import random
+import pytest
+from twisted.internet import error, task
+from twisted.internet.endpoints import connectProtocol
+from gandyloo import loopback, message, proxy
+from gandyloo.connection import MinesweeperClient
+
+def test_rechunk():
+    rng = random.Random(0)
+    data = b'- - F\r\n1 2 3\r\n' * 20
+
+    assert proxy.rechunk(data, rng) == [data]
+
+    chunks = proxy.rechunk(data, rng, max_chunk=7)
+    assert b''.join(chunks) == data
+    assert all(1 <= len(c) <= 7 for c in chunks)
+
+    chunks = proxy.rechunk(data, rng, split_newlines=1.0)
+    assert b''.join(chunks) == data
+    assert len(chunks) == 41
+    assert all(c.endswith(b'\r') or c.startswith(b'\n') for c in chunks)
+
+    chunks = proxy.rechunk(data, rng, max_chunk=5, split_newlines=0.5)
+    assert b''.join(chunks) == data
+    assert any(c.endswith(b'\r') for c in chunks)
+
+class Recorder(object):
+    def __init__(self, clock):
+        self.clock = clock
+        self.received = []
+        self.closed_at = None
+        self.resets = 0
+
+    def deliver(self, data):
+        self.received.append((self.clock.seconds(), data))
+
+    def close(self):
+        self.closed_at = self.clock.seconds()
+
+    def reset(self):
+        self.resets += 1
+
+def make_link(faults, seed=0):
+    clock = task.Clock()
+    r = Recorder(clock)
+    link = proxy.FaultyLink(faults, clock, random.Random(seed),
+            r.deliver, r.close, r.reset)
+    return clock, r, link
+
+def test_latency_and_jitter():
+    clock, r, link = make_link(proxy.Faults(latency=0.1, jitter=0.05,
+        max_chunk=3))
+    link.send(b'hello world')
+    clock.pump([0.01] * 4)
+    assert r.received == []
+    clock.pump([0.01] * 20)
+    assert b''.join(d for t, d in r.received) == b'hello world'
+
+    times = [t for t, d in r.received]
+    assert times == sorted(times)
+    assert all(0.05 <= t <= 0.16 for t in times)
+
+def test_bandwidth():
+    clock, r, link = make_link(proxy.Faults(latency=1.0, bandwidth=100))
+    link.send(b'x' * 100)
+    link.send(b'y' * 50)
+    link.close()
+    clock.pump([0.5] * 8)
+    assert r.received == [(pytest.approx(2.0), b'x' * 100),
+            (pytest.approx(2.5), b'y' * 50)]
+    assert r.closed_at == pytest.approx(2.5)
+
+def test_reset():
+    clock, r, link = make_link(proxy.Faults(latency=1.0, max_chunk=1,
+        reset_rate=0.5))
+    link.send(b'abcdefgh')
+    assert r.resets == 1
+    assert link.closed
+    clock.advance(10)
+    # Data in flight is dropped.
+    assert r.received == []
+    link.send(b'more')
+    assert r.resets == 1
+
+class Sink(object):
+    def __init__(self):
+        self.responses = []
+
+    def response(self, resp):
+        self.responses.append(resp)
+
+def connect_through_proxy(to_server, to_client):
+    clock = loopback.VirtualClock()
+    game = loopback.Game(4, 3, seed=1)
+    upstream = loopback.LoopbackEndpoint(clock,
+            loopback.MinesweeperServerFactory(game), latency=0.005)
+    fault_proxy = proxy.FaultProxy(clock, upstream, to_server, to_client,
+            seed=0)
+    endpoint = loopback.LoopbackEndpoint(clock, fault_proxy, latency=0.005)
+    sink = Sink()
+    client = MinesweeperClient(sink)
+    connectProtocol(endpoint, client)
+    clock.run()
+    return clock, game, fault_proxy, client, sink
+
+def test_proxy():
+    clock, game, fault_proxy, client, sink = connect_through_proxy(
+            proxy.Faults(latency=0.02),
+            proxy.Faults(latency=0.02, jitter=0.01, max_chunk=3))
+    hello, = sink.responses
+    assert hello.size == (4, 3)
+    assert game.players == 1
+
+    client.command(message.LookCommand())
+    client.command(message.ByeCommand())
+    clock.run()
+    board, close = sink.responses[1:]
+    assert board.board._tiles.tolist() == [9] * 12
+    assert close.reason.check(error.ConnectionDone)
+    assert game.players == 0
+    assert fault_proxy.connections == 1
+    assert fault_proxy.resets == 0
+
+def test_proxy_reset_reaches_client():
+    clock, game, fault_proxy, client, sink = connect_through_proxy(
+            proxy.Faults(reset_rate=1.0), proxy.Faults())
+    assert type(sink.responses[0]) == message.HelloResp
+
+    # The look is never delivered: both ends are reset instead.
+    client.command(message.LookCommand())
+    clock.run()
+    close, = sink.responses[1:]
+    assert close.reason.check(error.ConnectionLost)
+    assert fault_proxy.resets == 1
+    assert game.players == 0
@@ -0,0 +1,97 @@
+import csv
+import random
+import pytest
+from gandyloo import report, message, board, parse
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def simulated_run(rate, latency, seconds=30, seed=0):
+    '''A report of a run with messages arriving at about rate per second,
+    each answering a dig after about latency seconds.'''
+    rng = random.Random(seed)
+    clock = FakeClock()
+    r = report.RunReport({'rate': rate}, clock)
+    s = r.connection_stats()
+    s.response_received(message.HelloResp((10, 10), 1), 0)
+    while clock.now < seconds:
+        s.command_sent(message.DigCommand((1, 2)))
+        clock.now += latency * rng.uniform(0.5, 1.5)
+        s.data_received(200)
+        s.response_received(message.BoardResp(board.Board(10, 10)), 0)
+        clock.now += max(0.0, 1.0 / rate - latency) * rng.uniform(0.5, 1.5)
+    r.finish()
+    return r
+
+def test_report(tmpdir):
+    r = simulated_run(50, 0.01)
+    s = r.connection_stats()
+    s.parse_error(parse.InvalidResponseError('Wrong size board', '- -\n'))
+    s.parse_error(parse.InvalidResponseError('Wrong size board', '-\n'))
+    s.parse_error(ValueError())
+
+    d = r.write(str(tmpdir.join('run.json')), str(tmpdir.join('run.csv')))
+    assert d == report.load(str(tmpdir.join('run.json')))
+    assert d['config'] == {'rate': 50}
+    assert d['errors'] == {'Wrong size board': 2, 'ValueError': 1}
+    assert d['totals']['messages'] == d['totals']['commands'] + 1
+    assert d['totals']['bytes_received'] == 200 * d['totals']['commands']
+    assert 40 < d['throughput']['messages_per_sec'] < 60
+    assert d['throughput']['bytes_received_per_sec'] == pytest.approx(
+            d['totals']['bytes_received'] / d['duration'])
+    assert len(d['timeseries']) in (30, 31)
+
+    dig = d['latency']['dig']
+    assert dig['count'] == d['totals']['commands']
+    assert 0.005 <= dig['p50'] <= dig['p90'] <= dig['p99'] <= dig['max'] <= 0.015
+
+    with open(str(tmpdir.join('run.csv'))) as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == len(d['timeseries'])
+    assert float(rows[3]['messages_per_sec']) == d['timeseries'][3]['messages']
+
+def test_reservoir():
+    clock = FakeClock()
+    r = report.RunReport(clock=clock, sample_size=100)
+    for i in range(1000):
+        r.latency('look', i / 1000.0)
+    d = r.to_dict()['latency']['look']
+    assert d['count'] == 1000
+    assert len(d['samples']) == 100
+    assert d['max'] == 0.999
+
+def test_statistics():
+    rng = random.Random(1)
+    a = [rng.gauss(10, 1) for _ in range(200)]
+    b = [rng.gauss(10, 1) for _ in range(200)]
+    c = [rng.gauss(11, 1) for _ in range(200)]
+    assert abs(report.welch_z(a, b)) < 3
+    assert report.welch_z(a, c) > 5
+    assert abs(report.mann_whitney_z(a, b)) < 3
+    assert report.mann_whitney_z(a, c) > 5
+    assert report.mann_whitney_z(c, a) < -5
+    assert report.mann_whitney_z([1, 1, 1], [1, 1]) == 0
+
+def test_compare():
+    base = simulated_run(50, 0.01).to_dict()
+    same = simulated_run(50, 0.01, seed=1).to_dict()
+    slower = simulated_run(50, 0.02, seed=2).to_dict()
+    fewer = simulated_run(30, 0.01, seed=3).to_dict()
+
+    assert not any(f['regression'] for f in report.compare(base, same))
+
+    regressions = [f['metric'] for f in report.compare(base, slower)
+            if f['regression']]
+    assert regressions == ['latency.dig.p50', 'latency.dig.p90',
+            'latency.dig.p99']
+
+    regressions = [f['metric'] for f in report.compare(base, fewer)
+            if f['regression']]
+    assert regressions == ['messages_per_sec']
+
+    # Improvements aren't regressions.
+    assert not any(f['regression'] for f in report.compare(slower, base))
@@ -0,0 +1,209 @@
+import io
+import random
+from gandyloo import board, instrument, loopback, message, scenario, verify
+from gandyloo.connection import Backoff
+
+def make_endpoint(clock, **kwargs):
+    game = loopback.Game(3, 2, seed=1)
+    return game, loopback.LoopbackEndpoint(clock,
+            loopback.MinesweeperServerFactory(game), latency=0.005, **kwargs)
+
+def run(clock, population, seconds):
+    results = []
+    population.run(seconds).addCallback(results.append)
+    clock.run(until=seconds + 1)
+    return results
+
+def test_choose_step_weights():
+    class Mostly(scenario.Scenario):
+        steps = [
+            scenario.Step('a', 3, scenario.look),
+            scenario.Step('b', 1, scenario.help),
+        ]
+    rng = random.Random(0)
+    names = [Mostly.choose_step(rng).name for _ in range(4000)]
+    assert 2800 < names.count('a') < 3200
+    assert names.count('a') + names.count('b') == 4000
+
+def test_assign():
+    mix = [(scenario.Spectator, 75), (scenario.Digger, 25)]
+    assigned = scenario.assign(mix, 8)
+    assert assigned.count(scenario.Spectator) == 6
+    assert assigned.count(scenario.Digger) == 2
+    # Interleaved, so a partial ramp still has the right mix.
+    assert scenario.Digger in assigned[:4]
+
+def test_parse_mix():
+    mix = scenario.parse_mix('spectator=60,gandyloo.scenario:Digger=40')
+    assert mix == [(scenario.Spectator, 60.0), (scenario.Digger, 40.0)]
+
+def test_random_tile():
+    clock = loopback.VirtualClock()
+    population = scenario.Population(clock, None, [(scenario.Digger, 1)], 1)
+    user = scenario.VirtualUser(population, scenario.Digger,
+            random.Random(0), 0, Backoff())
+    user.size = (300, 200)
+    b = board.Board(300, 200)
+    for i in range(len(b._tiles)):
+        b._tiles[i] = 0
+    b[123, 45] = board.Untouched()
+    b[7, 199] = board.Flagged()
+    user.board = b
+    # Rare tiles are still found, and any of them can be.
+    assert user.random_tile(9) == (123, 45)
+    assert user.random_tile(10) == (7, 199)
+    # (Boards from responses are never written to; a new one comes.)
+    user.board = b = b.snapshot()
+    b[3, 3] = board.Untouched()
+    found = set(user.random_tile(9) for _ in range(50))
+    assert found == set([(123, 45), (3, 3)])
+    assert user.random_tile(5) is None
+
+def test_idle_users_slow_down():
+    clock = loopback.VirtualClock()
+    game, endpoint = make_endpoint(clock)
+    game.mines = [0] * len(game.mines)
+    game.dig(0, 0)
+    population = scenario.Population(clock, endpoint,
+            [(scenario.Flagger, 1)], users=1, seed=1)
+    instrument.enable()
+    try:
+        instrument.reset()
+        run(clock, population, 60)
+        steps = instrument.summary()[0]['scenario.step']['calls']
+    finally:
+        instrument.disable()
+        instrument.reset()
+    # Nothing to flag or deflag: after a few quick tries, a step every
+    # MAX_IDLE seconds or so.
+    assert steps < 60 / scenario.VirtualUser.MAX_IDLE + 10
+
+def test_population():
+    clock = loopback.VirtualClock()
+    game, endpoint = make_endpoint(clock)
+    population = scenario.Population(clock, endpoint,
+            [(scenario.Spectator, 50), (scenario.Flagger, 50)], users=10,
+            ramp=0.5, seed=1)
+    report, = run(clock, population, 3)
+
+    assert endpoint.connections == 10
+    assert game.players == 0
+    assert not population.users
+    summary = report.to_dict()
+    assert summary['step_failures'] == {}
+    assert summary['errors'] == {}
+    assert 'look' in summary['latency']
+    assert 'flag' in summary['latency']
+
+def test_verify_population():
+    clock = loopback.VirtualClock()
+    game = loopback.Game(8, 6, seed=2)
+    endpoint = loopback.LoopbackEndpoint(clock,
+            loopback.MinesweeperServerFactory(game), latency=0.005)
+    checker = verify.ConsistencyChecker()
+    log = io.BytesIO() if str is bytes else io.StringIO()
+    recorder = verify.Recorder([checker.feed, verify.LogWriter(log)],
+            clock.seconds)
+    population = scenario.Population(clock, endpoint,
+            [(scenario.Spectator, 40), (scenario.Digger, 30),
+                (scenario.Flagger, 30)],
+            users=6, ramp=0.5, seed=1, watchers=[recorder])
+    run(clock, population, 3)
+
+    assert checker.boards_checked > 0
+    assert checker.ok, checker.violations
+    log.seek(0)
+    logged = verify.check_log(log)
+    assert logged.boards_checked == checker.boards_checked
+    assert logged.ok
+
+def test_step_failures_are_reported():
+    class Confused(scenario.Scenario):
+        steps = [
+            scenario.Step('look', 1, scenario.look,
+                expect=message.HelpResp),
+        ]
+        think_time = scenario.constant(0.05)
+    clock = loopback.VirtualClock()
+    game, endpoint = make_endpoint(clock)
+    population = scenario.Population(clock, endpoint, [(Confused, 1)],
+            users=2, seed=1)
+    report, = run(clock, population, 1)
+    failures = report.to_dict()['step_failures']
+    assert failures['look'] > 0
+    # Everything but the byes and commands in flight at the end failed.
+    assert report.commands - 4 <= sum(failures.values()) < report.commands
+
+def test_stop_while_connecting():
+    clock = loopback.VirtualClock()
+    game, endpoint = make_endpoint(clock, connect_delay=0.5)
+    population = scenario.Population(clock, endpoint,
+            [(scenario.Digger, 1)], users=3, seed=1)
+    # Stopped before any of the connects complete; the users disconnect
+    # as soon as they hear HELLO.
+    report, = run(clock, population, 0.2)
+    assert endpoint.connections == 3
+    assert game.players == 0
+    assert not population.users
+    assert report.to_dict()['errors'] == {}
+
+class HangUpServer(loopback.MinesweeperServer):
+    '''Hangs up without saying hello, like a server shutting down.'''
+    def connectionMade(self):
+        self.game.players += 1
+        self.transport.loseConnection()
+
+class HangUpServerFactory(loopback.MinesweeperServerFactory):
+    def buildProtocol(self, addr):
+        return HangUpServer(self.game)
+
+def test_reconnects_back_off():
+    clock = loopback.VirtualClock()
+    endpoint = loopback.LoopbackEndpoint(clock,
+            HangUpServerFactory(loopback.Game(3, 2)), latency=0.005)
+    population = scenario.Population(clock, endpoint,
+            [(scenario.Spectator, 1)], users=1, seed=1, retry_delay=0.5)
+    report, = run(clock, population, 10)
+    # Waiting about 0.5, 1.4, 3.7 and 10 seconds between tries.
+    assert 3 <= endpoint.connections <= 5
+    # Every hang-up was followed by a delayed retry (the last one cut
+    # short by stop()).
+    assert report.retries == endpoint.connections
+
+def test_server_restart():
+    clock = loopback.VirtualClock()
+    game, endpoint = make_endpoint(clock)
+    population = scenario.Population(clock, endpoint,
+            [(scenario.Spectator, 1)], users=50, seed=1, retry_delay=0.5)
+    results = []
+    population.run(20).addCallback(results.append)
+    clock.run(until=5)
+    assert game.players == 50
+    endpoint.restart(1.0)
+    clock.run(until=6)
+    assert game.players == 0
+    assert endpoint.refused >= 50
+
+    # Everyone is back within a few retries.
+    clock.run(until=15)
+    assert game.players == 50
+    assert len(population.users) == 50
+    clock.run()
+    report, = results
+    assert report.retries >= 100
+    assert report.to_dict()['errors'] == {
+            'ConnectionRefusedError': endpoint.refused}
+
+def test_respawn():
+    clock = loopback.VirtualClock()
+    game, endpoint = make_endpoint(clock)
+    population = scenario.Population(clock, endpoint,
+            [(scenario.Spectator, 1)], users=1, seed=1)
+    population.start()
+    clock.run(until=0.1)
+    user, = population.users
+    user.client.transport.loseConnection()
+    clock.run(until=0.2)
+    assert endpoint.connections == 2
+    assert len(population.users) == 1
+    population.stop()
@@ -0,0 +1,73 @@
+import pytest
+from gandyloo import stats, message, board
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_percentile():
+    assert stats.percentile([5], 99) == 5
+    assert stats.percentile(range(101), 99) == 99
+    assert stats.percentile([3, 1, 2], 0) == 1
+    assert stats.percentile([3, 1, 2], 100) == 3
+    assert stats.percentile(range(1, 101), 99) == 99
+    assert stats.percentile(range(1, 101), 99.5) == 100
+    # Nearest rank rounds up, and the same on every Python.
+    assert stats.percentile([1, 2, 3, 4], 50) == 2
+    assert stats.percentile([1, 2, 3, 4], 51) == 3
+    assert stats.percentile([1, 2, 3, 4, 5, 6], 25) == 2
+
+def test_connection_stats():
+    clock = FakeClock()
+    s = stats.ConnectionStats(clock)
+
+    s.data_received(100)
+    s.response_received(message.HelloResp((10, 10), 1), 0.5)
+
+    s.command_sent(message.LookCommand())
+    clock.now = 1.0
+    s.command_sent(message.DigCommand((1, 1)))
+    s.command_sent(message.ByeCommand())
+    clock.now = 2.0
+    s.data_received(300)
+    s.response_received(message.BoardResp(board.Board(10, 10)), 0.25)
+    s.response_received(message.BoomResp(), 0.125)
+    s.buffered = 12
+    s.render_time(0.01)
+
+    sample = s.sample()
+    assert sample['messages_per_sec'] == 1.5
+    assert sample['bytes_per_sec'] == 200
+    assert sample['last_rtt'] == 1.0
+    assert sample['p99_rtt'] == 2.0
+    assert sample['parse_time'] == 0.25
+    assert sample['render_time'] == 0.01
+    assert sample['buffered'] == 12
+
+    # Rates are per sample.
+    clock.now = 4.0
+    s.data_received(10)
+    sample = s.sample()
+    assert sample['messages_per_sec'] == 0
+    assert sample['bytes_per_sec'] == 5
+
+def test_connection_stats_reconnect():
+    clock = FakeClock()
+    s = stats.ConnectionStats(clock)
+    s.command_sent(message.LookCommand())
+    s.command_sent(message.DigCommand((1, 1)))
+    s.buffered = 7
+    # The connection drops with both commands unanswered.
+    s.connection_lost()
+    assert s.buffered == 0
+
+    clock.now = 10.0
+    s.response_received(message.HelloResp((10, 10), 1), 0.5)
+    s.command_sent(message.HelpCommand())
+    clock.now = 10.5
+    s.response_received(message.HelpResp('help'), 0.0)
+    assert s.last_rtt == 0.5
+    assert list(s.rtts) == [0.5]
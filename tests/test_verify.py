@@ -0,0 +1,111 @@
+import io
+from gandyloo import verify, message, board
+
+# LogWriter writes native strs, like a file opened with open(path, 'w').
+NativeIO = io.BytesIO if str is bytes else io.StringIO
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+def frame(rows):
+    b = board.Board(len(rows[0]), len(rows))
+    for y, row in enumerate(rows):
+        for x, tile in enumerate(row):
+            if tile == 'F':
+                b[x, y] = board.Flagged()
+            elif tile != '-':
+                b[x, y] = board.Dug(int(tile))
+    return message.BoardResp(b)
+
+def run(script):
+    '''Run a script of (connection, command or response) through a
+    Recorder into a checker, and through a log.'''
+    checker = verify.ConsistencyChecker()
+    log = NativeIO()
+    recorder = verify.Recorder([checker.feed, verify.LogWriter(log)],
+            FakeClock())
+    connections = {}
+    for conn, item in script:
+        if conn not in connections:
+            connections[conn] = recorder.connection(conn)
+        if isinstance(item, message.Command):
+            connections[conn].command(item)
+        else:
+            connections[conn].response(item)
+
+    log.seek(0)
+    from_log = verify.check_log(log)
+    assert from_log.violations == checker.violations
+    return checker
+
+HELLO = message.HelloResp((3, 2), 2)
+
+def test_consistent():
+    checker = run([
+        (0, HELLO),
+        (1, HELLO),
+        (0, message.DigCommand((0, 0))),
+        (1, message.FlagCommand((2, 1))),
+        (0, frame(['00-', '12-'])),
+        (1, frame(['00-', '12F'])),
+        (0, message.LookCommand()),
+        (0, frame(['00-', '12F'])),
+        (1, message.DeflagCommand((2, 1))),
+        (1, frame(['00-', '12-'])),
+        (1, message.DigCommand((2, 0))),
+        (1, message.BoomResp()),
+        (0, message.LookCommand()),
+        (0, frame(['001', '11-'])),
+        (0, message.HelpCommand()),
+        (0, message.HelpResp('help\n')),
+        (0, message.ByeCommand()),
+    ])
+    assert checker.violations == []
+    assert checker.ok
+    assert checker.boards_checked == 5
+
+def kinds(checker):
+    return [(v['conn'], v['kind'], v['tile']) for v in checker.violations]
+
+def test_reverted_and_changed():
+    checker = run([
+        (0, HELLO),
+        (0, message.DigCommand((2, 0))),
+        (0, frame(['--2', '---'])),
+        (0, message.LookCommand()),
+        (0, frame(['--3', '---'])),
+        (0, message.LookCommand()),
+        (0, frame(['---', '---'])),
+    ])
+    assert kinds(checker) == [(0, 'changed', (2, 0)), (0, 'reverted', (2, 0))]
+
+def test_lost_update():
+    checker = run([
+        (0, HELLO),
+        (1, HELLO),
+        (0, message.DigCommand((2, 0))),
+        (0, frame(['--2', '---'])),
+        (1, message.LookCommand()),
+        (1, frame(['---', '---'])),
+    ])
+    assert kinds(checker) == [(1, 'lost update', (2, 0))]
+
+def test_disagree_and_unexplained():
+    checker = run([
+        (0, HELLO),
+        (1, HELLO),
+        (0, message.DigCommand((2, 0))),
+        (0, frame(['--2', '---'])),
+        (1, message.LookCommand()),
+        (1, frame(['--1', 'F--'])),
+        (1, message.LookCommand()),
+        (1, frame(['--1', 'F-3'])),
+    ])
+    assert kinds(checker) == [(1, 'disagree', (2, 0)),
+            (1, 'unexplained', (0, 1)),
+            (1, 'unexplained', (2, 1))]